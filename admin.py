@@ -0,0 +1,28 @@
+"""Broker admin commands."""
+import argparse
+import json
+
+from src.middleware import PickleQueue, MiddlewareType
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="print the broker metrics")
+    profile = sub.add_parser("profile", help="profile the broker's event loop")
+    profile.add_argument("action", choices=["start", "stop"])
+    profile.add_argument(
+        "--mode",
+        help="cProfile (pstats dump) or stack sampling (collapsed stacks dump)",
+        choices=["deterministic", "sampling"],
+        default="deterministic",
+    )
+    profile.add_argument("--seconds", help="profiling window", type=float, default=10)
+    profile.add_argument("--path", help="file name of the profile, in the broker's --profile-dir", default=None)
+    args = parser.parse_args()
+
+    queue = PickleQueue(None, _type=MiddlewareType.PRODUCER)
+    if args.command == "stats":
+        queue.stats()
+    else:
+        queue.profile(args.action, args.mode, args.seconds, args.path)
+    print(json.dumps(queue.pull(), indent=2))
@@ -0,0 +1,38 @@
+"""Run a federation bridge between brokers."""
+import argparse
+import time
+
+from src.bridge import Bridge
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--link",
+        nargs=3,
+        action="append",
+        metavar=("SOURCE", "DEST", "PREFIXES"),
+        help="forward publishes under the comma separated PREFIXES from broker SOURCE to DEST (host:port)",
+        default=[],
+    )
+    parser.add_argument(
+        "--mirror",
+        nargs=3,
+        action="append",
+        metavar=("A", "B", "PREFIXES"),
+        help="forward publishes under PREFIXES between brokers A and B, both ways",
+        default=[],
+    )
+    parser.add_argument("--batch", help="frames written at once", type=int, default=64)
+    parser.add_argument("--linger", help="seconds a frame may wait for its batch", type=float, default=0.005)
+    args = parser.parse_args()
+
+    bridge = Bridge()
+    for source, dest, prefixes in args.link:
+        bridge.link(source, dest, prefixes.split(","), batch=args.batch, linger=args.linger)
+    for a, b, prefixes in args.mirror:
+        bridge.mirror(a, b, prefixes.split(","), batch=args.batch, linger=args.linger)
+    bridge.start()
+
+    while True:
+        time.sleep(10)
+        print(bridge.stats())
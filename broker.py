@@ -1,7 +1,82 @@
 """Call broker."""
+import argparse
 
 from src.broker import Broker
 
+
+def rates(text):
+    """MSGS,BYTES per second, either one empty for no limit."""
+    msgs, _, size = text.partition(",")
+    return (float(msgs) if msgs else None, float(size) if size else None)
+
 if __name__ == "__main__":
-    broker = Broker()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="address to listen on", default="localhost")
+    parser.add_argument("--port", help="port to listen on", type=int, default=5000)
+    parser.add_argument("--unix", help="also listen on a Unix domain socket at this path", default=None)
+    parser.add_argument(
+        "--metrics-port",
+        help="serve plain text metrics over HTTP on this local port",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--standby-of",
+        help="run as a standby of the primary broker at HOST:PORT",
+        default=None,
+    )
+    parser.add_argument("--max-topics", help="most retained values, least recently used evicted first", type=int)
+    parser.add_argument("--max-retained-bytes", help="most bytes of retained values", type=int)
+    parser.add_argument(
+        "--priority",
+        help="PREFIX=LEVEL: deliveries under PREFIX get priority LEVEL (high, normal or low), repeatable",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--starvation-limit",
+        help="queued frames a lower priority one may be passed over by before it goes next",
+        type=int,
+        default=32,
+    )
+    parser.add_argument(
+        "--read-budget",
+        help="most frames handled per connection before serving the next one (0: no limit)",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--rate-limit",
+        help="MSGS,BYTES: most messages and bytes per second a connection may send (either one empty for no limit)",
+        type=rates,
+    )
+    parser.add_argument(
+        "--topic-rate-limit",
+        help="PREFIX=MSGS,BYTES: most messages and bytes per second published under PREFIX, repeatable",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="directory of the profiles dumped on admin requests (default: the temporary directory)",
+        default=None,
+    )
+    args = parser.parse_args()
+    topic_rate_limits = dict(item.rsplit("=", 1) for item in args.topic_rate_limit)
+
+    broker = Broker(
+        args.host,
+        args.port,
+        metrics_port=args.metrics_port,
+        standby_of=args.standby_of,
+        unix_path=args.unix,
+        max_topics=args.max_topics,
+        max_retained_bytes=args.max_retained_bytes,
+        priorities=dict(item.rsplit("=", 1) for item in args.priority),
+        starvation_limit=args.starvation_limit,
+        read_budget=args.read_budget or None,
+        rate_limit=args.rate_limit,
+        topic_rate_limits={prefix: rates(limit) for prefix, limit in topic_rate_limits.items()},
+        profile_dir=args.profile_dir,
+    )
     broker.run()
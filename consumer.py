@@ -13,15 +13,16 @@ if __name__ == "__main__":
         default=list(q_generator.keys())[0],
     )
     parser.add_argument("--length", help="number of messages to be sent", default=10)
+    parser.add_argument("--address", help="broker address, host:port", default="localhost:5000")
     parser.add_argument(
         "--queue_type",
-        nargs="+",
         help="producers queue type",
         choices=list(q_protocol.keys()),
         default=list(q_protocol.keys())[0],
     )
+    parser.add_argument("--prefetch", help="frames read ahead by a background thread (0: off)", type=int, default=0)
     args = parser.parse_args()
 
-    c = Consumer(args.topic, q_protocol[args.queue_type])
+    c = Consumer(args.topic, q_protocol[args.queue_type], address=args.address, prefetch=args.prefetch)
 
     c.run(int(args.length))
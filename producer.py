@@ -1,16 +1,15 @@
 """Example Producer."""
 
 import argparse
-import time
+import json
 import random
 
 import src.middleware
-from src.clients import Producer
+from src.clients import BatchProducer, LoadGenerator, Producer, Schedule
 
 
 def _temp():
     """Generate random temperatures."""
-    time.sleep(0.1)
     temp = 20
     while True:
         temp += random.randint(-2, 2)
@@ -35,29 +34,21 @@ def _msg():
         "Mas nele é que espelhou o céu.",
     ]
 
-    time.sleep(0.2)
     yield random.choice(text)
 
 
 def _weather():
     """Generate weather readings."""
-    time.sleep(0.1)
     yield random.randint(0, 40)
-    time.sleep(0.1)
     yield random.randint(0, 100)
-    time.sleep(0.1)
     yield random.randint(10000, 11000)
 
 
 def _weather2():
-    time.sleep(0.1)
     temp = random.randint(0, 40)
     yield temp
-    time.sleep(0.1)
     yield round(temp * 1.8 + 32)
-    time.sleep(0.1)
     yield random.randint(0, 100)
-    time.sleep(0.1)
     yield random.randint(10000, 11000)
 
 
@@ -97,17 +88,72 @@ if __name__ == "__main__":
         default=list(q_generator.keys())[0],
     )
     parser.add_argument("--length", help="number of messages to be sent", default=10)
+    parser.add_argument("--address", help="broker address, host:port", default="localhost:5000")
     parser.add_argument(
         "--queue_type",
-        nargs="+",
         help="producers queue type",
         choices=list(q_protocol.keys()),
         default=list(q_protocol.keys())[0],
     )
-    args = parser.parse_args()
-
-    p = Producer(
-        q_subtopics[args.topic], q_generator[args.topic], q_protocol[args.queue_type]
+    parser.add_argument("--rate", help="values sent per second", type=float, default=10)
+    parser.add_argument(
+        "--load",
+        help="load generator mode: publish on --topics simulated topics for --duration seconds",
+        action="store_true",
+    )
+    parser.add_argument("--topics", help="simulated topics (load mode)", type=int, default=1000)
+    parser.add_argument("--connections", help="connection pool size (load mode)", type=int, default=4)
+    parser.add_argument("--duration", help="seconds of load (load mode)", type=float, default=10)
+    parser.add_argument(
+        "--arrival",
+        help="send times (load mode)",
+        choices=["constant", "poisson"],
+        default="constant",
     )
+    parser.add_argument(
+        "--burst",
+        help="FACTOR,ON,PERIOD: multiply the rate by FACTOR for ON seconds every PERIOD seconds (load mode)",
+        default=None,
+    )
+    parser.add_argument(
+        "--batch",
+        help="send SIZE samples of every subtopic at once, as columns (multi-field topics only)",
+        type=int,
+        default=None,
+    )
+    args = parser.parse_args()
 
-    p.run(int(args.length))
+    if args.load:
+        burst = tuple(float(v) for v in args.burst.split(",")) if args.burst else None
+        gen = LoadGenerator(
+            args.topic,
+            q_generator[args.topic],
+            q_protocol[args.queue_type],
+            topics=args.topics,
+            connections=args.connections,
+            schedule=Schedule(args.rate, args.arrival, burst),
+            address=args.address,
+        )
+        print(json.dumps(gen.run(args.duration)))
+    elif args.batch:
+        if not isinstance(q_subtopics[args.topic], list):
+            parser.error(f"--batch needs a multi-field topic, not {args.topic}")
+        fields = [subtopic[len(args.topic) + 1:] for subtopic in q_subtopics[args.topic]]
+        p = BatchProducer(
+            args.topic,
+            fields,
+            q_generator[args.topic],
+            q_protocol[args.queue_type],
+            address=args.address,
+        )
+
+        p.run(int(args.length), args.batch, rate=args.rate)
+    else:
+        p = Producer(
+            q_subtopics[args.topic],
+            q_generator[args.topic],
+            q_protocol[args.queue_type],
+            address=args.address,
+        )
+
+        p.run(int(args.length), rate=args.rate)
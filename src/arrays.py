@@ -0,0 +1,146 @@
+"""Typed array payloads.
+
+numpy arrays and array.array values travel as a dtype, a shape and their
+raw little-endian bytes, in a segment of their own (see the segmented
+frames in PROTOCOLO.txt). The broker only sees TypedArray holders and
+relays the bytes without decoding them; consumers get numpy arrays back,
+or flat array.array values when numpy is not installed."""
+import array
+import pickle
+import struct
+import sys
+from typing import List
+
+try:
+    import numpy
+except ImportError: # optional
+    numpy = None
+
+MARKER = "__array__" # JSON: {"__array__": [dtype, shape, segment]}
+
+TYPECODES = {} # array.array typecode -> dtype
+DTYPES = {} # dtype -> array.array typecode
+for _code in "bBhHiIlLqQfd":
+    _dtype = ("f" if _code in "fd" else "u" if _code.isupper() else "i") + str(array.array(_code).itemsize)
+    TYPECODES[_code] = _dtype
+    DTYPES.setdefault(_dtype, _code)
+STRUCT = { # dtype -> struct format of one item
+    "i1": "<b", "u1": "<B", "i2": "<h", "u2": "<H", "i4": "<i", "u4": "<I",
+    "i8": "<q", "u8": "<Q", "f4": "<f", "f8": "<d",
+}
+
+
+class TypedArray:
+    """dtype ("f8", "i4", "u1", ..., always little-endian), shape and raw bytes of an array."""
+
+    __slots__ = ("dtype", "shape", "data")
+
+    def __init__(self, dtype: str, shape, data):
+        self.dtype = dtype
+        self.shape = tuple(shape)
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        # out-of-band with protocol 5, so pickle never copies the bytes either
+        data = pickle.PickleBuffer(self.data) if protocol >= 5 else bytes(self.data)
+        return TypedArray, (self.dtype, self.shape, data)
+
+    def __len__(self):
+        return self.shape[0] if self.shape else 1
+
+    def item(self, index: int):
+        """One item of the flattened array, read straight from its bytes."""
+        fmt = STRUCT[self.dtype]
+        size = struct.calcsize(fmt)
+        count = len(self.data) // size
+        if not -count <= index < count:
+            raise IndexError("TypedArray index out of range")
+        return struct.unpack_from(fmt, self.data, (index % count) * size)[0]
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, TypedArray) and self.dtype == other.dtype and self.shape == other.shape
+            and bytes(self.data) == bytes(other.data)
+        )
+
+    def __repr__(self):
+        return f"TypedArray({self.dtype!r}, {self.shape}, {len(self.data)} bytes)"
+
+
+def from_array(value):
+    """TypedArray of a numpy array or array.array, None for anything else."""
+    if isinstance(value, array.array):
+        if value.typecode not in TYPECODES:
+            raise TypeError(f"array.array of type {value.typecode!r} cannot be sent")
+        if sys.byteorder == "big":
+            value = array.array(value.typecode, value)
+            value.byteswap()
+        return TypedArray(TYPECODES[value.typecode], (len(value),), memoryview(value).cast("B"))
+    if numpy is not None and isinstance(value, numpy.ndarray):
+        if value.dtype.kind not in "iuf":
+            raise TypeError(f"numpy arrays of {value.dtype} cannot be sent")
+        dtype = value.dtype.newbyteorder("<")
+        value = numpy.ascontiguousarray(value, dtype=dtype) # no copy when it already is
+        return TypedArray(dtype.str[1:], value.shape, memoryview(value.reshape(-1).view(numpy.uint8)))
+    return None
+
+
+def to_array(typed: TypedArray):
+    """Array of a TypedArray: a read-only numpy view of its bytes, or a flat array.array without numpy."""
+    if numpy is not None:
+        return numpy.frombuffer(typed.data, dtype="<" + typed.dtype).reshape(typed.shape)
+    ret = array.array(DTYPES[typed.dtype])
+    ret.frombytes(typed.data)
+    if sys.byteorder == "big":
+        ret.byteswap()
+    return ret
+
+
+def _map(value, convert, depth: int):
+    """value with convert applied to its items, looking into dicts and short lists only."""
+    new = convert(value)
+    if new is not None:
+        return new
+    kind = type(value)
+    if depth and (kind is dict or ((kind is list or kind is tuple) and len(value) <= 16)):
+        items = value.items() if kind is dict else enumerate(value)
+        mapped = None
+        for key, item in items:
+            new = _map(item, convert, depth - 1)
+            if new is not item:
+                if mapped is None:
+                    mapped = dict(value) if kind is dict else list(value)
+                mapped[key] = new
+        if mapped is not None:
+            return tuple(mapped) if kind is tuple else mapped
+    return value
+
+
+def pack(value, depth: int = 3):
+    """value with its arrays turned into TypedArrays, ready to be sent."""
+    return _map(value, from_array, depth)
+
+
+def unpack(value, depth: int = 4):
+    """value with its TypedArrays turned back into arrays."""
+    return _map(value, lambda item: to_array(item) if type(item) is TypedArray else None, depth)
+
+
+def json_default(buffers: List):
+    """json.dumps default= that moves the bytes of TypedArrays to buffers."""
+    def default(obj):
+        if type(obj) is TypedArray:
+            buffers.append(obj.data)
+            return {MARKER: [obj.dtype, list(obj.shape), len(buffers) - 1]}
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return default
+
+
+def json_object_hook(buffers: List):
+    """json.loads object_hook= that puts the TypedArrays back together from buffers."""
+    def hook(obj):
+        if len(obj) == 1 and MARKER in obj:
+            dtype, shape, segment = obj[MARKER]
+            return TypedArray(dtype, shape, buffers[segment])
+        return obj
+    return hook
@@ -0,0 +1,176 @@
+"""Federation bridge: mirrors topic prefixes between brokers."""
+import random
+import socket
+import threading
+import time
+from typing import List
+
+from .broker import Converter, Serializer, split_segments
+from .transport import connect
+
+
+class Link(threading.Thread):
+    """Forwards the publishes under some prefixes from one broker to another.
+
+    Every forwarded publish carries the list of brokers it went through
+    ("origin"), and a publish that already went through the destination is
+    dropped, so links in both directions (or rings of brokers) do not loop.
+    Brokers are named by their address unless names are given; every bridge
+    of a topology must use the same names.
+
+    Frames for the destination are batched: they are written together once
+    `batch` of them are queued or `linger` seconds after the first one."""
+
+    def __init__(self, source: str, dest: str, prefixes: List[str], source_name: str = None, dest_name: str = None,
+                 batch: int = 64, linger: float = 0.005, backoff: float = 0.1, max_backoff: float = 10):
+        super().__init__(daemon=True)
+        self.source = source
+        self.dest = dest
+        self.prefixes = prefixes
+        self.source_name = source_name or source
+        self.dest_name = dest_name or dest
+        self.batch = batch
+        self.linger = linger
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.canceled = False
+        self.connected = threading.Event()
+        self.converter = Converter(Serializer.PICKLE)
+        self.form = Serializer.PICKLE.value.to_bytes(1, byteorder="big")
+        self.forwarded = 0
+        self.dropped = 0 # publishes that already went through the destination
+        self.reconnects = 0
+        self._was_connected = False
+
+    def run(self):
+        """Forward until canceled, reconnecting with jittered exponential backoff."""
+        attempt = 0
+        while not self.canceled:
+            try:
+                self.forward()
+            except OSError:
+                pass
+            self.connected.clear()
+            if self.canceled:
+                return
+            attempt = 1 if self._was_connected else attempt + 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            time.sleep(delay * random.uniform(0.5, 1))
+            self.reconnects += 1
+
+    def forward(self):
+        """Subscribe to the source and forward to the destination until canceled."""
+        self._was_connected = False
+        with connect(self.source) as src, connect(self.dest) as dst:
+            for prefix in self.prefixes:
+                sub = {"method": "SUBSCRIBE", "topic": prefix, "bridge": True}
+                src.sendall(self.form + self.converter.serialize(sub))
+            self._was_connected = True
+            self.connected.set()
+
+            buffer = b""
+            batch = []
+            first = 0
+            while not self.canceled:
+                # wake up in time to flush the batch, or now and then to check canceled
+                src.settimeout(max(0.0001, first + self.linger - time.monotonic()) if batch else 0.5)
+                try:
+                    data = src.recv(65536)
+                    if not data:
+                        raise ConnectionError("source broker closed the connection")
+                    buffer += data
+                except socket.timeout:
+                    pass
+
+                # split the complete frames off the buffer
+                offset = 0
+                while len(buffer) - offset >= 2:
+                    length = int.from_bytes(buffer[offset:offset + 2], "big")
+                    if length == 0: # segmented
+                        parsed = split_segments(buffer, offset + 2)
+                        if parsed is None:
+                            break
+                        segments, offset = parsed
+                        msg = self.converter.deserialize(segments[0], segments[1:])
+                    else:
+                        if len(buffer) - offset < 2 + length:
+                            break
+                        msg = self.converter.deserialize(buffer[offset + 2:offset + 2 + length])
+                        offset += 2 + length
+                    frame = self.publication(msg)
+                    if frame is not None:
+                        if not batch:
+                            first = time.monotonic()
+                        batch.append(frame)
+                buffer = buffer[offset:]
+
+                if batch and (len(batch) >= self.batch or time.monotonic() - first >= self.linger):
+                    dst.sendall(b"".join(batch))
+                    self.forwarded += len(batch)
+                    batch = []
+
+    def publication(self, msg):
+        """PUBLICATE (or PUBLICATE_BATCH) frame for the destination, or None if msg must not be forwarded."""
+        if msg.get("method") != "SEND" or "topic" not in msg:
+            return None
+        origin = msg.get("origin") or []
+        if self.dest_name in origin:
+            self.dropped += 1
+            return None
+        if "batch" in msg: # columnar batch, republished whole
+            args = {"topic": msg["topic"], "ts": msg["batch"]["ts"], "columns": msg["batch"]["columns"]}
+            pub = {"method": "PUBLICATE_BATCH", "args": args, "origin": origin + [self.source_name]}
+        else:
+            pub = {
+                "method": "PUBLICATE",
+                "args": {"msg": msg["data"], "topic": msg["topic"]},
+                "origin": origin + [self.source_name],
+            }
+        if "priority" in msg:
+            pub["priority"] = msg["priority"]
+        return self.form + b"".join(self.converter.serialize_frame(pub))
+
+    def cancel(self):
+        self.canceled = True
+
+
+class Bridge:
+    """Set of links between brokers."""
+
+    def __init__(self):
+        self.links = []
+
+    def link(self, source: str, dest: str, prefixes: List[str], **kwargs) -> Link:
+        """Forward publishes under prefixes from source to dest."""
+        link = Link(source, dest, prefixes, **kwargs)
+        self.links.append(link)
+        return link
+
+    def mirror(self, a: str, b: str, prefixes: List[str], **kwargs):
+        """Forward publishes under prefixes in both directions."""
+        self.link(a, b, prefixes, **kwargs)
+        self.link(b, a, prefixes, **kwargs)
+
+    def start(self):
+        for link in self.links:
+            link.start()
+
+    def wait_connected(self, timeout=None) -> bool:
+        return all(link.connected.wait(timeout) for link in self.links)
+
+    def cancel(self):
+        for link in self.links:
+            link.cancel()
+
+    def stats(self):
+        return [
+            {
+                "source": link.source_name,
+                "dest": link.dest_name,
+                "forwarded": link.forwarded,
+                "dropped": link.dropped,
+                "reconnects": link.reconnects,
+            }
+            for link in self.links
+        ]
+
@@ -1,11 +1,25 @@
 """Message Broker"""
 import enum
+from collections import OrderedDict, deque
 from typing import Dict, List, Any, Tuple
 import selectors
 import socket
 import json
+import os
 import pickle
-import xml.etree.ElementTree as ET
+import sys
+import time
+
+from .metrics import Metrics, SIZE_BUCKETS, serve_metrics
+from .outbox import NORMAL, Outbox, level
+from .profiler import Profiler
+from .ratelimit import RateLimit
+from .replication import ReplicationLog, Standby
+from . import arrays, shm, xmlcodec
+from .topics import TopicIndex
+
+TOPICS_PAGE = 1000 # default REQ_TOPICS page size
+SHM_RETRY = 0.001 # seconds between writes to a full shared memory ring
 
 
 class Serializer(enum.Enum):
@@ -14,6 +28,101 @@ class Serializer(enum.Enum):
     XML = 1
     PICKLE = 2
 
+OOB_MIN_SIZE = 1024 # pickled binary values at least this long travel out-of-band, as frame segments
+MAX_SEGMENTS = 255
+
+# constant parts of {"method": "SEND", "data": ...} per format, the encoded data goes in between
+SEND_TEMPLATES = {
+    Serializer.JSON: (b'{"method": "SEND", "data": ', b'}'),
+    Serializer.XML: (b'<main><s k="method">SEND</s>', b'</main>'),
+    # EMPTY_DICT, MARK, the two keys and the value; SETITEMS and STOP after the data
+    Serializer.PICKLE: (b'\x80\x05}(\x8c\x06method\x8c\x04SEND\x8c\x04data', b'u.'),
+}
+
+
+def out_of_band(value, depth: int = 3):
+    """value with its large binary parts wrapped in PickleBuffers.
+
+    Pickle protocol 5 hands those to its buffer_callback instead of copying
+    them into the pickle. Only dicts and short lists are looked into, to
+    find payloads in envelopes without walking long lists of numbers.
+    value itself is returned when nothing is wrapped."""
+    kind = type(value)
+    if kind is bytes or kind is bytearray:
+        return pickle.PickleBuffer(value) if len(value) >= OOB_MIN_SIZE else value
+    if kind is memoryview:
+        return pickle.PickleBuffer(value) if value.nbytes >= OOB_MIN_SIZE and value.contiguous else value
+    if depth and (kind is dict or ((kind is list or kind is tuple) and len(value) <= 16)):
+        items = value.items() if kind is dict else enumerate(value)
+        wrapped = None
+        for key, item in items:
+            new = out_of_band(item, depth - 1)
+            if new is not item:
+                if wrapped is None:
+                    wrapped = dict(value) if kind is dict else list(value)
+                wrapped[key] = new
+        if wrapped is None:
+            return value
+        return tuple(wrapped) if kind is tuple else wrapped
+    return value
+
+
+def value_size(value, depth: int = 3) -> int:
+    """Rough size in bytes of a retained value, without encoding it.
+
+    Binary values and strings count their length, typed arrays their
+    bytes; dicts and short lists are looked into, like in out_of_band(),
+    and longer lists count 8 bytes per item."""
+    kind = type(value)
+    if kind is bytes or kind is bytearray or kind is str:
+        return len(value)
+    if kind is memoryview:
+        return value.nbytes
+    if kind is arrays.TypedArray:
+        return memoryview(value.data).nbytes
+    if kind is int or kind is float or kind is bool or value is None:
+        return 8
+    if kind is dict:
+        if not depth:
+            return 16 * len(value)
+        return sum(len(key) if type(key) is str else 8 for key in value) \
+            + sum(value_size(item, depth - 1) for item in value.values())
+    if kind is list or kind is tuple:
+        if not depth or len(value) > 16:
+            return 8 * len(value)
+        return sum(value_size(item, depth - 1) for item in value)
+    return sys.getsizeof(value)
+
+
+def segmented(body: Tuple, buffers: List) -> Tuple:
+    """Buffers of a segmented frame: the body (given in parts) and the out-of-band buffers.
+
+    Segmented frame: length 0, segment count (1 byte), the length of every
+    segment (4 bytes each), then the segments; the body comes first."""
+    lengths = [sum(map(len, body))] + [len(buffer) for buffer in buffers]
+    header = b"\x00\x00" + len(lengths).to_bytes(1, byteorder="big")
+    header += b"".join(length.to_bytes(4, byteorder="big") for length in lengths)
+    return (header, *body, *buffers)
+
+
+def split_segments(buffer, start: int):
+    """(segments, end) of the segmented frame whose count is at buffer[start]; None until it is complete."""
+    if len(buffer) <= start:
+        return None
+    count = buffer[start]
+    pos = start + 1 + 4 * count
+    if len(buffer) < pos:
+        return None
+    lengths = [int.from_bytes(buffer[i:i + 4], byteorder="big") for i in range(start + 1, pos, 4)]
+    if len(buffer) < pos + sum(lengths):
+        return None
+    segments = []
+    with memoryview(buffer) as view:
+        for length in lengths:
+            segments.append(bytes(view[pos:pos + length]))
+            pos += length
+    return segments, pos
+
 class Converter:
     def __init__(self, _format: Serializer):
         self.msg_format = _format
@@ -29,17 +138,11 @@ class Converter:
             return False
 
     def serialize(self, msg: Dict):
-        # converter chaves para str, já que o cringe xml n gosta >:(
-        msg2 = {}
-
-        for key,val in msg.items():
-            msg2[str(key)] = str(val)
-
         if self.msg_format == Serializer.JSON:   # JSON
             ret = json.dumps(msg)
             ret = ret.encode(encoding='UTF-8', errors='replace')
         elif self.msg_format == Serializer.XML: # XML
-            ret = ET.tostring(ET.Element("main", attrib=msg2))
+            ret = xmlcodec.dumps(msg)
         elif self.msg_format == Serializer.PICKLE: # PICKLE
             ret = pickle.dumps(msg)
         else:
@@ -48,17 +151,63 @@ class Converter:
 
         length = len(ret).to_bytes(2, byteorder="big")
         return length + ret
-    def deserialize(self, msg: bytes):
+    def serialize_frame(self, msg: Dict) -> Tuple[bytes, ...]:
+        """Frame of msg as buffers to be written one after the other.
+
+        Typed arrays (see src.arrays) and, with PICKLE, large binary values
+        go in a segmented frame (see segmented()) instead of being copied
+        into the message."""
+        buffers = []
+        if self.msg_format == Serializer.JSON:
+            body = json.dumps(msg, default=arrays.json_default(buffers)).encode(encoding='UTF-8', errors='replace')
+        elif self.msg_format == Serializer.XML:
+            body = xmlcodec.dumps(msg, buffers)
+        else:
+            body = self._pickle(msg, buffers)
+        if buffers:
+            return segmented((body,), buffers)
+        return (len(body).to_bytes(2, byteorder="big"), body)
+
+    def serialize_send(self, data) -> Tuple[bytes, ...]:
+        """Frame of {"method": "SEND", "data": data} as (length, prefix, data, suffix) buffers.
+
+        Only data is encoded, the rest comes from SEND_TEMPLATES, and the
+        buffers are meant to be written with sendmsg instead of joined.
+        The frame is segmented when needed, as in serialize_frame."""
+        prefix, suffix = SEND_TEMPLATES[self.msg_format]
+        buffers = []
+        if self.msg_format == Serializer.JSON:
+            body = json.dumps(data, default=arrays.json_default(buffers)).encode(encoding='UTF-8', errors='replace')
+        elif self.msg_format == Serializer.XML:
+            body = xmlcodec.dumps_value(data, "data", buffers)
+        else: # a pickle spliced in drops its PROTO and STOP opcodes
+            body = memoryview(self._pickle(data, buffers))[2:-1]
+        if buffers:
+            return segmented((prefix, body, suffix), buffers)
+        length = (len(prefix) + len(body) + len(suffix)).to_bytes(2, byteorder="big")
+        return length, prefix, body, suffix
+
+    @staticmethod
+    def _pickle(value, buffers: List) -> bytes:
+        """Protocol 5 pickle of value, its out-of-band buffers appended to buffers (kept in-band if too many)."""
+        oob = []
+        ret = pickle.dumps(out_of_band(value), protocol=5, buffer_callback=oob.append)
+        if len(oob) >= MAX_SEGMENTS:
+            return pickle.dumps(out_of_band(value), protocol=5)
+        buffers.extend(buffer.raw() for buffer in oob)
+        return ret
+
+    def deserialize(self, msg: bytes, buffers: List = None):
+        """Decode a message; buffers: the other segments of a segmented frame."""
         if self.msg_format == Serializer.JSON:
+            if buffers:
+                return json.loads(msg, object_hook=arrays.json_object_hook(buffers))
             ret = json.loads(msg)
             return ret
         elif self.msg_format == Serializer.XML:
-            dataBytes = ET.fromstring(msg)
-            if dataBytes.tag == "main":
-                return dataBytes.attrib
-            return None
+            return xmlcodec.loads(msg, buffers)
         elif self.msg_format == Serializer.PICKLE:
-            return pickle.loads(msg)
+            return pickle.loads(msg, buffers=buffers)
         else:
             return None
     
@@ -79,34 +228,114 @@ class Converter:
 class Broker:
     """Implementation of a PubSub Message Broker."""
 
-    def __init__(self):
-        """Initialize broker."""
+    def __init__(self, host: str = "localhost", port: int = 5000, metrics_port: int = None, standby_of: str = None,
+                 unix_path: str = None, max_topics: int = None, max_retained_bytes: int = None,
+                 priorities: Dict[str, int] = None, starvation_limit: int = 32, read_budget: int = 64,
+                 rate_limit: Tuple[float, float] = None, topic_rate_limits: Dict[str, Tuple[float, float]] = None,
+                 profile_dir: str = None):
+        """Initialize broker.
+
+        unix_path: if given, also listen on a Unix domain socket at this path, for same-host clients.
+        metrics_port: if given, serve the metrics as plain text over HTTP on localhost:metrics_port.
+        standby_of: if given, "host:port" of a primary broker whose retained values are replicated here.
+        max_topics, max_retained_bytes: if given, quotas on the number and the total size of the retained
+        values; the least recently used values are evicted to stay within them.
+        priorities: topic prefix -> priority (0 high, 1 normal, 2 low) of its deliveries; a consumer's
+        queued frames are written highest priority first, see Outbox for starvation_limit.
+        read_budget: most frames handled per connection and event loop iteration (None: no limit); the
+        rest wait in the inbox, and the connection is not read from, until its next turn.
+        rate_limit: (messages, bytes) per second each connection may send, either one None for no limit.
+        topic_rate_limits: topic prefix -> (messages, bytes) per second published under it by all producers.
+        A connection over a limit is not read from until its token bucket has refilled; nothing is dropped.
+        profile_dir: directory of the profiles dumped on PROFILE requests (the temporary directory by default),
+        which only choose the file name."""
         self.canceled = False
-        self._host = "localhost"
-        self._port = 5000
+        self._host = host
+        self._port = port
         self.topics = {}
+        self.topic_index = TopicIndex() # topics holding a value
+        self.retained = OrderedDict() # topic -> size of its value, least recently used first
+        self.retained_bytes = 0
+        self.max_topics = max_topics
+        self.max_retained_bytes = max_retained_bytes
+        self.inbox = {} # conn -> bytearray holding a partially received frame
+        self.read_at = {} # conn -> time.time_ns() of its last read, the "recv" of traced messages
+        self.read_budget = read_budget
+        self.backlog = {} # conns with complete frames left in their inbox by the read budget
+        self.turn = 0 # rotates the order ready connections are served in
+        for limit in [rate_limit, *(topic_rate_limits or {}).values()]:
+            if limit is not None and any(rate is not None and rate <= 0 for rate in limit):
+                raise ValueError(f"invalid rate limit {limit!r}")
+        self.rate_limit = rate_limit
+        self.limits = {} # conn -> its RateLimit
+        self.topic_limits = {prefix: RateLimit(*limit) for prefix, limit in (topic_rate_limits or {}).items()}
+        self.paused = {} # conn over a rate limit -> monotonic time to read from it again
+        self.outbox = {} # conn -> Outbox of frames waiting for the socket to become writable
+        self.stalled = set() # shared memory channels with a full ring, retried every SHM_RETRY
+        self.priorities = {} # topic prefix -> priority level
+        for prefix, priority in (priorities or {}).items():
+            if level(priority) is None:
+                raise ValueError(f"invalid priority {priority!r} for {prefix}")
+            self.priorities[prefix] = level(priority)
+        self.starvation_limit = starvation_limit
+        self.responders = {} # topic -> deque of (conn, format) serving REQUESTs on it, next one first
+        self.calls = {} # call id -> (requester conn, format, its call id, responder conn, start ns)
+        self.next_call = 0
+        self.metrics = Metrics()
+        self.metrics.gauge("connections", 0)
+        self.metrics.gauge("outbound_queued", 0)
+        self.profiler = Profiler(profile_dir)
         self.sock = socket.socket() # listening socket
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # reuse address
         self.sock.bind((self.host, self.port))
         self.sock.listen(100)
         self.sel = selectors.DefaultSelector() # selector
         self.sel.register(self.sock, selectors.EVENT_READ, self.accept) # monitor with selector
-
-    @staticmethod
-    def list_topics_recursive(topics, ret = []) -> List[str]:
-        for topic_name, topic_info in topics.items():
-            if topic_info["value"] != None and topic_name not in ret:
-                ret.append(topic_name)
-            if topic_info["subtopics"] is not None:
-                for subtopic_name, subtopic_info in topic_info["subtopics"].items():
-                    Broker.list_topics_recursive({subtopic_name: subtopic_info}, ret)
-        return ret
+        self.unix_sock = None
+        if unix_path is not None:
+            if os.path.exists(unix_path): # left behind by a previous run
+                os.unlink(unix_path)
+            self.unix_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.unix_sock.bind(unix_path)
+            self.unix_sock.listen(100)
+            self.sel.register(self.unix_sock, selectors.EVENT_READ, self.accept)
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = serve_metrics(self.metrics, self.host, metrics_port)
+        self.replication = ReplicationLog()
+        self.standby = None
+        if standby_of is not None:
+            self.standby = Standby(self, standby_of)
+            self.standby.connect()
 
     def list_topics(self) -> List[str]:
         """Returns a list of strings containing all topics."""
-        lst = Broker.list_topics_recursive(self.topics)
-        #print("list_topics lst:", lst)
-        return lst
+        return list(self.topic_index)
+
+    def req_topics(self, msg: Dict, serializer: Serializer) -> Tuple[bytes, ...]:
+        """Encode the REP_TOPICS reply to a REQ_TOPICS request.
+
+        The page is shrunk until it fits in a frame; clients ask for the
+        next one with the returned cursor."""
+        limit = max(1, int(msg.get("limit") or TOPICS_PAGE))
+        while True:
+            lst, cursor = self.topic_index.page(msg.get("prefix") or "", msg.get("cursor"), limit)
+            try:
+                return self.encode(serializer, {"method": "REP_TOPICS", "lst": lst, "cursor": cursor})
+            except OverflowError: # longer than the 2 byte length allows
+                if len(lst) <= 1:
+                    raise
+                limit = len(lst) // 2
+
+    @staticmethod
+    def new_topic() -> Dict:
+        """Empty topic tree node.
+
+        cache holds the per-format encoding of the node's value for
+        subscription snapshots and is reset whenever the value changes.
+        bridges holds the (address, format) of federation bridges, which
+        get every publish of the subtree along with its topic and origin."""
+        return {"show": False, "value": None, "consumers": [], "bridges": [], "subtopics": {}, "cache": 3 * [None]}
 
     @staticmethod
     def merge_dicts(*dicts):
@@ -115,7 +344,9 @@ class Broker:
             ret.update(dict)
         return ret
 
-    def find_topic(self, topic: str):
+    @staticmethod
+    def topic_path(topic: str) -> List[str]:
+        """Names of the nodes from the root down to topic."""
         lst = [s for s in topic.split("/")]
         # "a" -> ['a']
         # "a/b" -> ['a', 'b'] -> ['a', 'a/b']
@@ -130,51 +361,151 @@ class Broker:
         for i in range(1, len(lst)):
             if lst[i-1] != "/":
                 lst[i] = lst[i - 1] + lst[i]
+        return lst
+
+    @staticmethod
+    def prefix(topic: str) -> str:
+        """Top-level prefix of topic, the key its metrics are reported under."""
+        if topic.startswith("/"):
+            return "/" + topic[1:].split("/", 1)[0]
+        return topic.split("/", 1)[0]
 
+    def find_topic(self, topic: str, create: bool = True):
+        """Node of topic, created along with its parents if needed.
+
+        With create=False, None is returned instead for a topic without a node."""
+        lst = Broker.topic_path(topic)
+        if lst[0] not in self.topics:
+            if not create:
+                return None
+            self.topics[lst[0]] = Broker.new_topic()
         topic = self.topics[lst[0]]
         for subtopic_name in lst[1:]:
             if subtopic_name not in topic["subtopics"]:
-                topic["subtopics"][subtopic_name] = {"show": False, "value": None, "consumers": [], "subtopics": {}}
+                if not create:
+                    return None
+                topic["subtopics"][subtopic_name] = Broker.new_topic()
 
             topic = topic["subtopics"][subtopic_name]
         
         return topic
 
+    @staticmethod
+    def is_empty(node: Dict) -> bool:
+        """Whether node holds nothing and can be removed from the tree."""
+        return node["value"] is None and not node["consumers"] and not node["bridges"] and not node["subtopics"]
+
+    def prune(self, topic: str):
+        """Remove the node of topic and then its parents, as long as they are empty."""
+        lst = Broker.topic_path(topic)
+        parents = [self.topics] # parents[i] holds the node named lst[i]
+        for name in lst[:-1]:
+            node = parents[-1].get(name)
+            if node is None:
+                return
+            parents.append(node["subtopics"])
+        for parent, name in zip(reversed(parents), reversed(lst)):
+            if name not in parent or not Broker.is_empty(parent[name]):
+                return
+            del parent[name]
+
     def get_topic(self, topic):
         """Returns the currently stored value in topic."""
-        return self.find_topic(topic)["value"]
+        node = self.find_topic(topic, create=False)
+        return None if node is None else node["value"]
     
     def put_topic(self, topic, value):
         """Store in topic the value."""
         dic = self.find_topic(topic)
-        dic["value"] = value
         dic["show"] = True
+        self.store(topic, dic, value)
+        if value is None:
+            self.prune(topic)
+
+    def store(self, topic: str, node: Dict, value, size: int = None):
+        """Set the value retained in node, the node of topic.
+
+        Keeps the topic index, the replication log and the memory accounting
+        in sync, and evicts values if a quota is exceeded. size: encoded
+        size of value, if already known."""
+        if (node["value"] is None) != (value is None):
+            self.index_topic(topic, value)
+        node["value"] = value
+        node["cache"] = 3 * [None]
+        self.account(topic, value, size)
+        if self.replication.replicas:
+            self.replication.record(topic, value)
+        if self.max_topics is not None or self.max_retained_bytes is not None:
+            self.evict()
+
+    def account(self, topic: str, value, size: int = None):
+        """Update the retained memory of topic and its prefix to hold value."""
+        prefix = Broker.prefix(topic)
+        old = self.retained.pop(topic, None)
+        if old is not None:
+            self.retained_bytes -= old
+            self.metrics.add_gauge("retained_bytes:" + prefix, -old)
+            self.metrics.add_gauge("retained_topics:" + prefix, -1)
+        if value is None:
+            return
+        if size is None:
+            size = value_size(value)
+        self.retained[topic] = size
+        self.retained_bytes += size
+        self.metrics.add_gauge("retained_bytes:" + prefix, size)
+        self.metrics.add_gauge("retained_topics:" + prefix, 1)
+
+    def touch(self, topic: str):
+        """Mark the value of topic as recently used."""
+        if topic in self.retained:
+            self.retained.move_to_end(topic)
+
+    def evict(self):
+        """Drop the least recently used values until the quotas hold."""
+        while self.retained and (
+            (self.max_topics is not None and len(self.retained) > self.max_topics)
+            or (self.max_retained_bytes is not None and self.retained_bytes > self.max_retained_bytes)
+        ):
+            topic = next(iter(self.retained))
+            node = self.find_topic(topic, create=False)
+            if node is not None:
+                node["value"] = None
+                node["cache"] = 3 * [None]
+            self.topic_index.discard(topic)
+            self.account(topic, None)
+            if self.replication.replicas: # standbys drop it too
+                self.replication.record(topic, None)
+            self.prune(topic)
+            self.metrics.incr("evictions:" + Broker.prefix(topic))
+
+    def index_topic(self, topic: str, value):
+        """Keep topic_index in sync with the value just stored in topic."""
+        if value is None:
+            self.topic_index.discard(topic)
+        elif topic not in self.topic_index:
+            self.topic_index.add(topic)
 
     def list_subscriptions(self, topic: str) -> List[socket.socket]:
         """Provide list of subscribers to a given topic."""
-        return [consumer for consumer in self.find_topic(topic)["consumers"]]
+        node = self.find_topic(topic, create=False)
+        return [] if node is None else [consumer for consumer in node["consumers"]]
 
-    def subscribe(self, topic: str, address: socket.socket, _format: Serializer = None):
-        """Subscribe to topic by client in address."""
-        #print("topic:",topic)
-        lst = [s for s in topic.split("/")]
+    def subscribe(self, topic: str, address: socket.socket, _format: Serializer = None, snapshot: bool = False,
+                  bridge: bool = False):
+        """Subscribe to topic by client in address.
 
-        if lst[0] == '':
-            lst = ["/" + s for s in topic.split("/")]
-        else:
-            for i in range(1, len(lst)):
-                lst[i] = "/" + lst[i]
+        snapshot: send the retained values of the whole subtree instead of
+        only the topic's own value.
+        bridge: subscription of a federation bridge, see Broker.new_topic()."""
+        #print("topic:",topic)
+        lst = Broker.topic_path(topic)
 
-        for i in range(1, len(lst)):
-            if lst[i-1] != "/":
-                lst[i] = lst[i - 1] + lst[i]
-        
         if lst[0] not in self.topics:
-            self.topics[lst[0]] = {"show": False, "value": None, "consumers": [], "subtopics": {}}
+            self.topics[lst[0]] = Broker.new_topic()
         topic = self.topics[lst[0]]
         for subtopic_name in lst[1:]:
             if subtopic_name not in topic["subtopics"]:
-                topic["subtopics"][subtopic_name] = {"show": False, "value": None, "consumers": [], "subtopics": {}}
+                topic["subtopics"][subtopic_name] = Broker.new_topic()
             #print(subtopic_name)
             topic = topic["subtopics"][subtopic_name]
             
@@ -182,111 +513,696 @@ class Broker:
         topic["show"] = True
         #print("lst:",lst)
         #print("True sus:",topic)
+        if bridge: # bridges only forward live publishes
+            topic["bridges"].append((address, _format))
+            return
         topic["consumers"].append((address, _format))
 
-        if topic["value"] is not None:
-            send_msg = {"method": "SEND", "data": topic["value"]}
-            conv = Converter(_format)
-            byt = conv.serialize(send_msg)
-            address.send(byt)
+        if snapshot:
+            self.send(address, self.snapshot(lst[-1], topic, _format))
+        elif topic["value"] is not None:
+            self.touch(lst[-1])
+            try: # marked, so a consumer subscribing again knows it is not a new publish
+                frame = self.encode(_format, {"method": "SEND", "data": topic["value"], "retained": True})
+            except (TypeError, ValueError, OverflowError): # e.g. bytes for JSON
+                self.metrics.incr("encode_errors:" + _format.name)
+                return
+            self.send(address, frame)
+
+    def snapshot(self, name: str, topic: Dict, _format: Serializer) -> bytes:
+        """SNAPSHOT frame followed by one SEND frame per valued topic of the subtree.
+
+        The per-topic frames come from the nodes' caches, so a subtree that
+        did not change since the last snapshot is not encoded again. Values
+        the format cannot encode are left out (encode_errors counter)."""
+        frames = []
+        stack = [(name, topic)]
+        while stack:
+            name, node = stack.pop()
+            if node["value"] is not None:
+                self.touch(name)
+                frame = node["cache"][_format.value]
+                if frame is None:
+                    try:
+                        frame = b"".join(self.encode(_format, {"method": "SEND", "topic": name, "data": node["value"]}))
+                    except (TypeError, ValueError, OverflowError):
+                        frame = b""
+                        self.metrics.incr("encode_errors:" + _format.name)
+                    node["cache"][_format.value] = frame
+                if frame:
+                    frames.append(frame)
+            stack.extend(node["subtopics"].items())
+        header = self.encode(_format, {"method": "SNAPSHOT", "count": len(frames)})
+        return b"".join(header) + b"".join(frames)
 
     def unsubscribe(self, topic, address):
         """Unsubscribe to topic by client in address."""
-        topic_consumers = self.find_topic(topic)["consumers"]
+        node = self.find_topic(topic, create=False)
+        if node is None:
+            return
+        topic_consumers = node["consumers"]
         for addr_ser in topic_consumers:
             if addr_ser[0] == address:
                 topic_consumers.remove(addr_ser)
                 address.close()
+                self.prune(topic)
                 return
 
     def run(self):
         """Run until canceled."""
         while not self.canceled:
-            for key, _ in self.sel.select(): # self.sel.select(): events
-                callback = key.data   # either accept or read (depends on connection)
-                callback(key.fileobj) # accept or read the connection
-    
+            timeout = 0 if self.backlog else self.profiler.timeout() if self.profiler.active else None
+            if self.paused:
+                wait = max(0, min(self.paused.values()) - time.monotonic())
+                timeout = wait if timeout is None else min(timeout, wait)
+            if self.stalled:
+                timeout = SHM_RETRY if timeout is None else min(timeout, SHM_RETRY)
+            events = self.sel.select(timeout)
+            if self.paused:
+                self.resume()
+            for conn in list(self.stalled):
+                self.flush(conn)
+            start = time.perf_counter_ns()
+            ready = [] # connections to read from, served round-robin below
+            for key, mask in events:
+                if mask & selectors.EVENT_READ:
+                    if key.data == self.read:
+                        ready.append(key.fileobj)
+                    else:
+                        key.data(key.fileobj) # accept, or the primary's replication stream
+                if mask & selectors.EVENT_WRITE and key.fileobj in self.outbox:
+                    self.flush(key.fileobj)
+            if self.backlog:
+                ready.extend(conn for conn in self.backlog if conn not in ready)
+            if len(ready) > 1: # nobody is always served first
+                self.turn = (self.turn + 1) % len(ready)
+                ready = ready[self.turn:] + ready[:self.turn]
+            for conn in ready:
+                if conn.fileno() == -1: # closed while serving another one
+                    continue
+                if conn in self.backlog:
+                    self.process(conn) # only what it already sent, until it catches up
+                else:
+                    self.read(conn)
+            self.metrics.gauge("read_backlog", len(self.backlog))
+            self.metrics.observe("loop_us", (time.perf_counter_ns() - start) // 1000)
+            if self.replication.pending:
+                self.ship_replication()
+            if self.profiler.active:
+                self.profiler.tick()
+
+    def encode(self, serializer: Serializer, msg: Dict) -> Tuple[bytes, ...]:
+        """Frame buffers of msg in the given format (see Converter.serialize_frame), timing it."""
+        start = time.perf_counter_ns()
+        ret = Converter(serializer).serialize_frame(msg)
+        self.metrics.observe("serialize_us:" + serializer.name, (time.perf_counter_ns() - start) // 1000)
+        return ret
+
+    def encode_send(self, serializer: Serializer, data) -> Tuple[bytes, ...]:
+        """SEND frame buffers of data (see Converter.serialize_send), timing it like encode()."""
+        start = time.perf_counter_ns()
+        ret = Converter(serializer).serialize_send(data)
+        self.metrics.observe("serialize_us:" + serializer.name, (time.perf_counter_ns() - start) // 1000)
+        return ret
+
+    @staticmethod
+    def frame_size(frame) -> int:
+        """Length of a frame, given whole or as buffers."""
+        return sum(map(len, frame)) if type(frame) is tuple else len(frame)
+
+    def send(self, conn: socket.socket, data: bytes, priority: int = NORMAL):
+        """Send a frame to conn without blocking.
+
+        data is the frame or, as from Converter.serialize_send, a tuple of
+        the buffers it is made of, written with a single sendmsg.
+        Whatever the socket does not take right away is kept in the outbox,
+        by priority, and written once the selector reports the socket as writable.
+        data may also be a function returning the frame, for conns with
+        queued frames only: it is called when the frame is written (see stamped)."""
+        if callable(data):
+            self.metrics.incr("frames_out")
+            self.outbox[conn].append(data, priority)
+            self.metrics.add_gauge("outbound_queued", 1)
+            return
+        buffers = data if type(data) is tuple else None
+        size = Broker.frame_size(data)
+        self.metrics.incr("frames_out")
+        self.metrics.incr("bytes_out", size)
+        pending = self.outbox.get(conn)
+        if pending:
+            pending.append(data if buffers is None else b"".join(buffers), priority)
+            self.metrics.add_gauge("outbound_queued", 1)
+            return
+        try:
+            if buffers is None:
+                sent = conn.send(data)
+            elif hasattr(conn, "sendmsg"):
+                sent = conn.sendmsg(buffers)
+            else:
+                sent = conn.send(b"".join(buffers))
+        except BlockingIOError:
+            sent = 0
+        except ConnectionError: # the next read sees the peer is gone and cleans up
+            return
+        if isinstance(sent, int) and sent < size:
+            if buffers is not None:
+                data = b"".join(buffers)
+            pending = self.outbox[conn] = Outbox(self.starvation_limit)
+            pending.current = data[sent:]
+            self.metrics.add_gauge("outbound_queued", 1)
+            self.watch(conn)
+
+    def stamped(self, serializer: Serializer, msg: Dict):
+        """Function encoding the traced msg with its "out" stamped when it is called, for send()."""
+        def frame() -> bytes:
+            data = b"".join(self.encode(serializer, dict(msg, trace=dict(msg["trace"], out=time.time_ns()))))
+            self.metrics.incr("bytes_out", len(data))
+            return data
+        return frame
+
+    def watch(self, conn: socket.socket):
+        """Have the selector report conn readable unless it is paused, writable if it has queued frames.
+
+        Shared memory channels with queued frames are retried on a timer
+        instead, as their doorbell socket always reports itself writable."""
+        writable = conn in self.outbox
+        if writable and type(conn) is shm.ShmChannel:
+            self.stalled.add(conn)
+            writable = False
+        events = (selectors.EVENT_READ if conn not in self.paused else 0) \
+            | (selectors.EVENT_WRITE if writable else 0)
+        registered = conn in self.sel.get_map()
+        if not events:
+            if registered:
+                self.sel.unregister(conn)
+        elif registered:
+            self.sel.modify(conn, events, self.read)
+        else:
+            self.sel.register(conn, events, self.read)
+
+    def throttle(self, conn: socket.socket, msg: Dict, size: int):
+        """Charge a frame to the rate limits of conn and of the topic it publishes to, pausing conn if over one."""
+        now = time.monotonic()
+        delay = 0.0
+        if self.rate_limit is not None:
+            limit = self.limits.get(conn)
+            if limit is None:
+                limit = self.limits[conn] = RateLimit(*self.rate_limit)
+            delay = limit.take(1, size, now)
+            if delay:
+                self.metrics.incr("throttled")
+        if self.topic_limits and msg["method"] in ("PUBLICATE", "PUBLICATE_BATCH"):
+            for name in reversed(Broker.topic_path(msg["args"]["topic"])):
+                limit = self.topic_limits.get(name)
+                if limit is not None:
+                    count = len(msg["args"]["ts"]) if msg["method"] == "PUBLICATE_BATCH" else 1
+                    topic_delay = limit.take(count, size, now)
+                    if topic_delay:
+                        self.metrics.incr("throttled:" + name)
+                        delay = max(delay, topic_delay)
+                    break
+        if delay:
+            self.paused[conn] = max(self.paused.get(conn, 0), now + delay)
+            self.metrics.incr("throttled_ms", int(delay * 1000))
+            self.metrics.gauge("paused_connections", len(self.paused))
+            self.watch(conn)
+
+    def resume(self):
+        """Read again from the paused connections whose rate limits have refilled."""
+        now = time.monotonic()
+        for conn, until in list(self.paused.items()):
+            if until <= now:
+                del self.paused[conn]
+                self.watch(conn)
+                self.backlog[conn] = None # handle the frames that were waiting first
+        self.metrics.gauge("paused_connections", len(self.paused))
+
+    def flush(self, conn: socket.socket):
+        """Write queued frames to conn until the socket would block."""
+        pending = self.outbox[conn]
+        promoted = pending.promoted
+        try:
+            while pending:
+                data = pending.head()
+                try:
+                    sent = conn.send(data)
+                except BlockingIOError:
+                    return
+                except ConnectionError:
+                    self.metrics.add_gauge("outbound_queued", -len(pending))
+                    pending.clear()
+                    break
+                pending.advance(sent)
+                if sent < len(data):
+                    return
+                self.metrics.add_gauge("outbound_queued", -1)
+        finally:
+            if pending.promoted != promoted:
+                self.metrics.incr("outbound_promoted", pending.promoted - promoted)
+        del self.outbox[conn]
+        self.stalled.discard(conn)
+        self.watch(conn)
+
+    def close(self, conn: socket.socket):
+        """Forget about a connection."""
+        if conn in self.sel.get_map(): # not if paused with nothing to write
+            self.sel.unregister(conn)
+        if self.replication.replicas:
+            self.replication.replicas = [r for r in self.replication.replicas if r[0] != conn]
+            self.metrics.gauge("replicas", len(self.replication.replicas))
+        self.remove_consumer(conn, self.topics)
+        if self.responders or self.calls:
+            self.drop_calls(conn)
+        self.inbox.pop(conn, None)
+        self.read_at.pop(conn, None)
+        self.backlog.pop(conn, None)
+        self.stalled.discard(conn)
+        self.limits.pop(conn, None)
+        if self.paused.pop(conn, None) is not None:
+            self.metrics.gauge("paused_connections", len(self.paused))
+        pending = self.outbox.pop(conn, None)
+        if pending:
+            self.metrics.add_gauge("outbound_queued", -len(pending))
+        self.metrics.add_gauge("connections", -1)
+        conn.close()
+
     def accept(self, sock: socket.socket):
         conn, addr = sock.accept()
         conn.setblocking(False)
         self.sel.register(conn, selectors.EVENT_READ, self.read)
+        self.metrics.add_gauge("connections", 1)
     
     def read(self, conn: socket.socket):
-        _format = conn.recv(1)
-        if _format:
-            _format = int.from_bytes(_format, byteorder="big")
-            serializer = Serializer(_format)
-            converter = Converter(serializer)
-            length = int.from_bytes(conn.recv(2), byteorder="big")
-            msg_bytes = conn.recv(length)
-            msg = converter.deserialize(msg_bytes)
-            method = msg["method"]
-            if method == "SUBSCRIBE":
-                self.subscribe(msg["topic"], conn, serializer)
-            elif method == "PUBLICATE":
-                self.publicate(msg)
-            elif method == "UNSUBSCRIBE":
-                self.unsubscribe(msg["topic"], conn)
-            elif method == "REQ_TOPICS":
-                topics = self.list_topics()
-                dic = {"method": "REP_TOPICS", "lst":topics}
-                conn.send(converter.serialize(dic))
+        """Read what conn has sent and handle the complete frames in it (see process)."""
+        try:
+            data = conn.recv(65536)
+        except BlockingIOError:
+            return
+        except ConnectionError: # reset by the peer, same as a close
+            data = b""
+        if not data:
+            self.close(conn)
+            return
+
+        self.read_at[conn] = time.time_ns()
+        buffer = self.inbox.get(conn)
+        if buffer is None:
+            buffer = self.inbox[conn] = bytearray()
+        buffer += data
+        self.process(conn)
+
+    def process(self, conn: socket.socket):
+        """Handle the complete frames in the inbox of conn, at most read_budget of them.
+
+        If frames are left over, conn goes to the backlog to be served again
+        on the next event loop iteration, without reading more from it."""
+        buffer = self.inbox[conn]
+        offset = 0
+        budget = self.read_budget
+        # frame: format (1 byte) + length (2 bytes) + message, or a segmented frame (length 0)
+        while len(buffer) - offset >= 3:
+            if budget is not None:
+                if budget == 0:
+                    if conn not in self.backlog:
+                        self.backlog[conn] = None
+                        self.metrics.incr("read_budget_hits")
+                    del buffer[:offset]
+                    return
+                budget -= 1
+            length = int.from_bytes(buffer[offset + 1:offset + 3], byteorder="big")
+            serializer = Serializer(buffer[offset])
+            if length == 0:
+                parsed = split_segments(buffer, offset + 3)
+                if parsed is None:
+                    break
+                segments, offset = parsed
+                self.handle(conn, serializer, segments[0], segments[1:])
             else:
-                print("!!! CURSED MSG METHOD !!!")
+                if len(buffer) - offset < 3 + length:
+                    break
+                msg_bytes = bytes(buffer[offset + 3:offset + 3 + length])
+                offset += 3 + length
+                self.handle(conn, serializer, msg_bytes)
+            if conn.fileno() == -1: # closed by an UNSUBSCRIBE
+                self.close(conn)
+                return
+            if conn not in self.inbox: # moved to shared memory
+                self.backlog.pop(conn, None)
+                return
+            if conn in self.paused: # over a rate limit: the rest waits in the inbox
+                del buffer[:offset]
+                self.backlog.pop(conn, None)
+                return
+        del buffer[:offset]
+        self.backlog.pop(conn, None)
+
+    def handle(self, conn: socket.socket, serializer: Serializer, msg_bytes: bytes, buffers: List = ()):
+        """Handle one message received from conn.
+
+        buffers: out-of-band segments of a segmented frame, handed on as they are."""
+        self.metrics.incr("frames_in")
+        size = 3 + len(msg_bytes) + sum(map(len, buffers))
+        self.metrics.incr("bytes_in", size)
+        msg = Converter(serializer).deserialize(msg_bytes, buffers)
+        if self.rate_limit is not None or self.topic_limits:
+            self.throttle(conn, msg, size)
+        method = msg["method"]
+        if method == "SUBSCRIBE":
+            self.subscribe(msg["topic"], conn, serializer, bool(msg.get("snapshot")), bool(msg.get("bridge")))
+        elif method == "PUBLICATE":
+            if "trace" in msg: # read along with the frames before it
+                msg["trace"]["recv"] = self.read_at.get(conn)
+            self.publicate(msg)
+        elif method == "PUBLICATE_BATCH":
+            self.publicate_batch(msg)
+        elif method == "UNSUBSCRIBE":
+            self.unsubscribe(msg["topic"], conn)
+        elif method == "REQ_TOPICS":
+            self.send(conn, self.req_topics(msg, serializer))
+        elif method == "STATS":
+            dic = {"method": "REP_STATS", "stats": self.metrics.snapshot()}
+            self.send(conn, self.encode(serializer, dic))
+        elif method == "REPLICATE":
+            self.add_replica(conn, serializer)
+        elif method == "PROFILE":
+            self.send(conn, self.encode(serializer, self.profile(msg)))
+        elif method == "SHM_ATTACH":
+            self.attach_shm(conn, serializer, msg)
+        elif method == "SERVE":
+            self.responders.setdefault(msg["topic"], deque()).append((conn, serializer))
+        elif method == "REQUEST":
+            self.request(conn, serializer, msg)
+        elif method == "REPLY":
+            self.reply(msg)
         else:
-            self.sel.unregister(conn)
-            self.remove_consumer(conn, self.topics)
-            conn.close()
-    
+            print("!!! CURSED MSG METHOD !!!")
+
+    def attach_shm(self, conn: socket.socket, serializer: Serializer, msg: Dict):
+        """Exchange frames with a local client through its shared memory rings from now on."""
+        try:
+            channel = shm.accept(conn, msg)
+        except (OSError, ValueError) as err:
+            self.send(conn, self.encode(serializer, {"method": "SHM_REFUSED", "error": str(err)}))
+            return
+        self.send(conn, self.encode(serializer, {"method": "SHM_READY"}))
+        self.sel.unregister(conn)
+        self.inbox.pop(conn, None)
+        self.read_at.pop(conn, None)
+        self.sel.register(channel, selectors.EVENT_READ, self.read)
+
+    def request(self, conn: socket.socket, serializer: Serializer, msg: Dict):
+        """Hand a REQUEST to a responder of its topic (or of the nearest parent), round-robin.
+
+        The responder sees a call id of the broker's own, so ids of different
+        requesters never clash; its REPLY goes straight back to conn."""
+        topic = msg["topic"]
+        responders = None
+        for name in reversed(Broker.topic_path(topic)):
+            responders = self.responders.get(name)
+            if responders:
+                break
+        if not responders:
+            reply = {"method": "REPLY", "id": msg["id"], "error": f"no responder for {topic}"}
+            self.send(conn, self.encode(serializer, reply))
+            self.metrics.incr("requests_unserved:" + Broker.prefix(topic))
+            return
+        responder, responder_serializer = responders[0]
+        responders.rotate(-1)
+        call_id = self.next_call
+        request = {"method": "REQUEST", "topic": topic, "id": call_id, "data": msg.get("data")}
+        try:
+            frame = Converter(responder_serializer).serialize_frame(request)
+        except (TypeError, ValueError, OverflowError) as err: # e.g. bytes for a JSON responder
+            self.metrics.incr("encode_errors:" + responder_serializer.name)
+            reply = {"method": "REPLY", "id": msg["id"], "error": f"cannot encode the request: {err}"}
+            self.send(conn, self.encode(serializer, reply))
+            return
+        self.next_call += 1
+        self.calls[call_id] = (conn, serializer, msg["id"], responder, time.perf_counter_ns())
+        self.send(responder, frame)
+        self.metrics.incr("requests:" + Broker.prefix(topic))
+
+    def reply(self, msg: Dict):
+        """Route a responder's REPLY back to the connection that made the request."""
+        call = self.calls.pop(msg["id"], None)
+        if call is None: # requester gone, or the id is bogus
+            self.metrics.incr("replies_dropped")
+            return
+        conn, serializer, call_id, _, start = call
+        reply = {"method": "REPLY", "id": call_id}
+        if "error" in msg:
+            reply["error"] = msg["error"]
+        else:
+            reply["data"] = msg.get("data")
+        try:
+            frame = Converter(serializer).serialize_frame(reply)
+        except (TypeError, ValueError, OverflowError) as err: # e.g. bytes for a JSON requester
+            self.metrics.incr("encode_errors:" + serializer.name)
+            frame = self.encode(serializer, {"method": "REPLY", "id": call_id, "error": f"cannot encode the reply: {err}"})
+        self.send(conn, frame)
+        self.metrics.observe("rpc_us", (time.perf_counter_ns() - start) // 1000)
+
+    def drop_calls(self, conn: socket.socket):
+        """Forget the calls of a closed connection; those it was serving fail."""
+        for topic, responders in list(self.responders.items()):
+            remaining = deque(responder for responder in responders if responder[0] != conn)
+            if remaining:
+                self.responders[topic] = remaining
+            else:
+                del self.responders[topic]
+        for call_id, (requester, serializer, requester_id, responder, _) in list(self.calls.items()):
+            if requester == conn:
+                del self.calls[call_id]
+            elif responder == conn:
+                del self.calls[call_id]
+                reply = {"method": "REPLY", "id": requester_id, "error": "responder went away"}
+                self.send(requester, self.encode(serializer, reply))
+
+    def add_replica(self, conn: socket.socket, serializer: Serializer):
+        """Attach a standby: send it every retained value, then the changes as they happen."""
+        converter = Converter(serializer)
+        entries = [[self.replication.seq, topic, self.get_topic(topic)] for topic in self.topic_index]
+        skipped = []
+        for frame in ReplicationLog.frames(converter, entries, sync=True, skipped=skipped):
+            self.send(conn, frame)
+        if skipped:
+            self.metrics.incr("replication_skipped", len(skipped))
+        self.replication.replicas.append((conn, serializer))
+        self.metrics.gauge("replicas", len(self.replication.replicas))
+
+    def ship_replication(self):
+        """Send the changes recorded during this loop iteration to every standby, batched."""
+        entries = self.replication.take()
+        frames = [None] * 3
+        skipped = []
+        for conn, serializer in self.replication.replicas:
+            if frames[serializer.value] is None:
+                frames[serializer.value] = ReplicationLog.frames(Converter(serializer), entries, skipped=skipped)
+            for frame in frames[serializer.value]:
+                self.send(conn, frame)
+        if skipped:
+            self.metrics.incr("replication_skipped", len(skipped))
+        self.metrics.gauge("replication_seq", self.replication.seq)
+        self.metrics.gauge(
+            "replication_backlog", sum(len(self.outbox.get(conn, ())) for conn, _ in self.replication.replicas)
+        )
+
+    def profile(self, msg: Dict) -> Dict:
+        """Handle a PROFILE admin request, returning the REP_PROFILE reply."""
+        try:
+            if msg.get("action", "start") == "stop":
+                summary = self.profiler.stop()
+                return {"method": "REP_PROFILE", "path": self.profiler.path, "summary": summary}
+            path = self.profiler.start(
+                msg.get("mode", "deterministic"), float(msg.get("seconds", 10)), msg.get("path")
+            )
+            return {"method": "REP_PROFILE", "path": path, "summary": {}}
+        except ValueError as err:
+            return {"method": "REP_PROFILE", "error": str(err)}
+
+    def priority(self, msg: Dict, lst: List[str]) -> int:
+        """Priority of the deliveries of a publish: its own, else that of its nearest configured prefix.
+
+        lst: the topic path of the publish, see topic_path()."""
+        if "priority" in msg:
+            priority = level(msg["priority"])
+            return NORMAL if priority is None else priority
+        if self.priorities:
+            for name in reversed(lst):
+                priority = self.priorities.get(name)
+                if priority is not None:
+                    return priority
+        return NORMAL
+
     def remove_consumer(self, conn: socket.socket, topic: Dict):
-        for topic_name, info in topic.items():
-            for consumer in info["consumers"]:
-                if consumer[0] == conn: # consumer[0]: address
-                    info["consumers"].remove(consumer)
-                    print("removed B)")
-                    return
+        """Drop conn from every subscription under topic, removing the nodes left empty."""
+        for topic_name, info in list(topic.items()):
+            consumers = [consumer for consumer in info["consumers"] if consumer[0] != conn] # consumer[0]: address
+            if len(consumers) != len(info["consumers"]):
+                info["consumers"] = consumers
+                self.metrics.incr("consumers_removed")
+            # a bridge may subscribe several prefixes on one connection
+            info["bridges"] = [bridge for bridge in info["bridges"] if bridge[0] != conn]
             self.remove_consumer(conn, info["subtopics"]) # só iá acontecer se existir pelo menos 1 tópico filho
+            if Broker.is_empty(info):
+                del topic[topic_name]
         
     def publicate(self, msg: Dict):
         topic = msg["args"]["topic"]
 
-        lst = [s for s in topic.split("/")]
+        lst = Broker.topic_path(topic)
 
-        if lst[0] == '':
-            lst = ["/" + s for s in topic.split("/")]
-        else:
-            for i in range(1, len(lst)):
-                lst[i] = "/" + lst[i]
-
-        for i in range(1, len(lst)):
-            if lst[i-1] != "/":
-                lst[i] = lst[i - 1] + lst[i]
-        
         msg_to_send = {"method": "SEND", "data": msg["args"]["msg"]}
+        if "trace" in msg: # stamped by a tracing producer
+            trace = msg["trace"]
+            trace["topic"] = msg["args"]["topic"]
+            trace["out"] = time.time_ns()
+            if trace.get("recv") is None: # not read from a client (replicated)
+                trace["recv"] = trace["out"]
+            msg_to_send["trace"] = trace
         msg_serialized = 3 * [None]
+        bridge_serialized = 3 * [None]
+        fanout = 0
+        priority = self.priority(msg, lst)
 
         if lst[0] not in self.topics:
-            self.topics[lst[0]] = {"show": False, "value": None, "consumers": [], "subtopics": {}}
+            self.topics[lst[0]] = Broker.new_topic()
         topic = self.topics[lst[0]]
-        for addr, s in topic["consumers"]:
-            if msg_serialized[s.value] is None:
-                conv = Converter(s)
-                msg_serialized[s.value] = conv.serialize(msg_to_send)
-            addr.send(msg_serialized[s.value])
-        
+        path = [topic]
         for subtopic_name in lst[1:]: # make our way into the desired topic
             if not subtopic_name in topic["subtopics"]:
-                topic["subtopics"][subtopic_name] = {"show": False, "value": None, "consumers": [], "subtopics": {}}
+                topic["subtopics"][subtopic_name] = Broker.new_topic()
 
             topic = topic["subtopics"][subtopic_name]
-            for addr, s in topic["consumers"]:
+            path.append(topic)
+
+        for node in path: # every subscriber of the topic or of one of its parents
+            for addr, s in node["consumers"]:
                 if msg_serialized[s.value] is None:
-                    conv = Converter(s)
-                    msg_serialized[s.value] = conv.serialize(msg_to_send)
-                addr.send(msg_serialized[s.value])
+                    try:
+                        if "trace" in msg_to_send:
+                            msg_serialized[s.value] = self.encode(s, msg_to_send)
+                        else:
+                            msg_serialized[s.value] = self.encode_send(s, msg_to_send["data"])
+                    except (TypeError, ValueError, OverflowError): # e.g. bytes for JSON, too big to be in-band
+                        msg_serialized[s.value] = b""
+                        self.metrics.incr("encode_errors:" + s.name)
+                if msg_serialized[s.value]:
+                    if "trace" in msg_to_send and addr in self.outbox: # queued: stamped "out" once written
+                        self.send(addr, self.stamped(s, msg_to_send), priority)
+                    else:
+                        self.send(addr, msg_serialized[s.value], priority)
+                    fanout += 1
+            for addr, s in node["bridges"]:
+                if bridge_serialized[s.value] is None:
+                    bridge_msg = {
+                        "method": "SEND",
+                        "topic": msg["args"]["topic"],
+                        "data": msg["args"]["msg"],
+                        "origin": msg.get("origin", []),
+                    }
+                    if "priority" in msg:
+                        bridge_msg["priority"] = msg["priority"]
+                    try:
+                        bridge_serialized[s.value] = Converter(s).serialize_frame(bridge_msg)
+                    except (TypeError, ValueError, OverflowError): # e.g. bytes for a JSON link
+                        bridge_serialized[s.value] = b""
+                        self.metrics.incr("encode_errors:" + s.name)
+                if bridge_serialized[s.value]:
+                    self.send(addr, bridge_serialized[s.value], priority)
+                    fanout += 1
 
-        topic["value"] = msg["args"]["msg"]
+        size = next((Broker.frame_size(frame) for frame in msg_serialized if frame), None)
+        self.store(msg["args"]["topic"], topic, msg["args"]["msg"], size)
+        if topic["value"] is None:
+            self.prune(msg["args"]["topic"])
+        self.metrics.incr("publishes:" + (lst[1] if lst[0] == "/" and len(lst) > 1 else lst[0]))
+        self.metrics.observe("fanout", fanout, SIZE_BUCKETS)
     
+    def publicate_batch(self, msg: Dict):
+        """Fan a columnar batch out: the whole batch to the subscribers of its
+        topic and of its parents, the matching columns only to the subscribers
+        of the field subtopics below it.
+
+        The columns (usually typed arrays) are relayed as they came, never
+        split into samples; each field subtopic retains its last sample."""
+        topic = msg["args"]["topic"].rstrip("/") or "/"
+        ts = msg["args"]["ts"]
+        columns = msg["args"]["columns"]
+        base = "" if topic == "/" else topic
+        fanout = 0
+        priority = self.priority(msg, Broker.topic_path(topic))
+
+        def deliver(node, data, bridge_topic):
+            nonlocal fanout
+            serialized = 3 * [None]
+            for addr, s in node["consumers"]:
+                if serialized[s.value] is None:
+                    try:
+                        serialized[s.value] = self.encode_send(s, data)
+                    except (TypeError, ValueError, OverflowError):
+                        serialized[s.value] = b""
+                        self.metrics.incr("encode_errors:" + s.name)
+                if serialized[s.value]:
+                    self.send(addr, serialized[s.value], priority)
+                    fanout += 1
+            bridge_serialized = 3 * [None]
+            for addr, s in node["bridges"]:
+                if bridge_serialized[s.value] is None:
+                    bridge_msg = {
+                        "method": "SEND",
+                        "topic": bridge_topic,
+                        "batch": data,
+                        "origin": msg.get("origin", []),
+                    }
+                    try:
+                        bridge_serialized[s.value] = Converter(s).serialize_frame(bridge_msg)
+                    except (TypeError, ValueError, OverflowError): # e.g. bytes for a JSON link
+                        bridge_serialized[s.value] = b""
+                        self.metrics.incr("encode_errors:" + s.name)
+                if bridge_serialized[s.value]:
+                    self.send(addr, bridge_serialized[s.value], priority)
+                    fanout += 1
+
+        for field, column in columns.items():
+            if len(column):
+                last = column.item(-1) if type(column) is arrays.TypedArray else column[-1]
+                field_topic = base + "/" + field
+                self.store(field_topic, self.find_topic(field_topic), last)
+
+        batch = {"ts": ts, "columns": columns}
+        lst = Broker.topic_path(topic)
+        if lst[0] not in self.topics:
+            self.topics[lst[0]] = Broker.new_topic()
+        node = self.topics[lst[0]]
+        deliver(node, batch, topic)
+        for subtopic_name in lst[1:]: # the topic and its parents get the whole batch
+            if subtopic_name not in node["subtopics"]:
+                node["subtopics"][subtopic_name] = Broker.new_topic()
+            node = node["subtopics"][subtopic_name]
+            deliver(node, batch, topic)
+
+        # field subtopics, each with the columns at or below it
+        stack = [(node, columns)]
+        while stack:
+            parent, fields = stack.pop()
+            for name, child in parent["subtopics"].items():
+                rel = name[len(base) + 1:]
+                selected = {
+                    field: column for field, column in fields.items()
+                    if field == rel or field.startswith(rel + "/")
+                }
+                if not selected:
+                    continue
+                if child["consumers"] or child["bridges"]:
+                    deliver(child, {"ts": ts, "columns": selected}, topic)
+                stack.append((child, selected))
+
+        self.prune(topic) # nothing but the batch went through it
+        self.metrics.incr("publishes:" + Broker.prefix(topic))
+        self.metrics.incr("batch_samples:" + Broker.prefix(topic), len(ts))
+        self.metrics.observe("fanout", fanout, SIZE_BUCKETS)
+
     # self._host
     @property
     def host(self):
@@ -1,14 +1,69 @@
 """Prototype broker clients: consumer + producer."""
-from src.middleware import PickleQueue, MiddlewareType
+import array
+import itertools
+import random
+import time
+
+from src.middleware import DEFAULT_ADDRESS, PickleQueue, MiddlewareType
+
+
+class Schedule:
+    """Open-loop send times at a target rate.
+
+    arrival: "constant" spacing or "poisson" (exponential gaps).
+    burst: optional (factor, on, period) - for `on` seconds out of every
+    `period` seconds the rate is multiplied by `factor`."""
+
+    def __init__(self, rate, arrival="constant", burst=None):
+        if arrival not in ("constant", "poisson"):
+            raise ValueError(f"unknown arrival process {arrival!r}")
+        self.rate = rate
+        self.arrival = arrival
+        self.burst = burst
+
+    def rate_at(self, elapsed):
+        if self.burst is not None:
+            factor, on, period = self.burst
+            if elapsed % period < on:
+                return self.rate * factor
+        return self.rate
+
+    def expected(self, duration):
+        """Number of sends the schedule asks for in <duration> seconds."""
+        if self.burst is None:
+            return self.rate * duration
+        factor, on, period = self.burst
+        periods, rest = divmod(duration, period)
+        burst_time = periods * on + min(rest, on)
+        return self.rate * (duration + (factor - 1) * burst_time)
+
+    def __iter__(self):
+        """Yield send times (time.monotonic() clock), forever."""
+        start = time.monotonic()
+        elapsed = 0
+        while True:
+            yield start + elapsed
+            rate = self.rate_at(elapsed)
+            elapsed += random.expovariate(rate) if self.arrival == "poisson" else 1 / rate
+
+
+def wait_until(when):
+    delay = when - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
 
 
 class Consumer:
     """Consumer implementation"""
 
-    def __init__(self, topic, queue_type=PickleQueue):
+    def __init__(self, topic, queue_type=PickleQueue, trace=False, address=DEFAULT_ADDRESS, snapshot=False,
+                 prefetch=0):
         """Initialize Queue"""
         self.topic = topic
-        self.queue = queue_type(f"{topic}", _type=MiddlewareType.CONSUMER)
+        self.queue = queue_type(
+            f"{topic}", _type=MiddlewareType.CONSUMER, trace=trace, address=address, snapshot=snapshot,
+            prefetch=prefetch,
+        )
         #self.logger = get_logger(f"Consumer {topic}")
         self.received = []
 
@@ -19,29 +74,141 @@ class Consumer:
             #self.logger.info("%s: %s", topic, data)
             self.received.append(data)
 
+    def latency(self, topic=None):
+        """Latency percentiles of traced messages, see Queue.latency()."""
+        return self.queue.latency(topic)
+
+
+class Responder:
+    """Serves the requests made with Queue.call() on topic.
+
+    handler(topic, payload) returns the reply; an exception it raises is
+    sent back as the error of the call."""
+
+    def __init__(self, topic, handler, queue_type=PickleQueue, address=DEFAULT_ADDRESS):
+        self.queue = queue_type(topic, _type=MiddlewareType.PRODUCER, address=address)
+        self.queue.serve(topic)
+        self.handler = handler
+        self.served = 0
+
+    def run(self, events=None):
+        """Serve at most <events> requests, forever by default."""
+        while events is None or self.served < events:
+            msg = self.queue.pull()
+            if msg is None:
+                continue
+            topic, payload = msg
+            try:
+                result = self.handler(topic, payload)
+            except Exception as err:
+                self.queue.reply(error=repr(err))
+            else:
+                self.queue.reply(result)
+            self.served += 1
+
 
 class Producer:
     """Producer implementation"""
 
-    def __init__(self, topic, value_generator, queue_type=PickleQueue):
+    def __init__(self, topic, value_generator, queue_type=PickleQueue, trace=False, address=DEFAULT_ADDRESS):
         """Initialize Queue."""
         #self.logger = get_logger(f"Producer {topic}")
 
         if isinstance(topic, list):
             self.queue = [
-                queue_type(subtopic, _type=MiddlewareType.PRODUCER)
+                queue_type(subtopic, _type=MiddlewareType.PRODUCER, trace=trace, address=address)
                 for subtopic in topic
             ]
         else:
-            self.queue = [queue_type(topic, _type=MiddlewareType.PRODUCER)]
+            self.queue = [queue_type(topic, _type=MiddlewareType.PRODUCER, trace=trace, address=address)]
         self.produced = []
         self.gen = value_generator
 
-    def run(self, events=10):
-        """Produce at most <events> events."""
+    def run(self, events=10, rate=None):
+        """Produce at most <events> events, at <rate> values/s if given."""
+        schedule = iter(Schedule(rate)) if rate else None
         for _ in range(events):
             for queue, value in zip(self.queue, self.gen()):
+                if schedule is not None:
+                    wait_until(next(schedule))
                 queue.push(value)
                 #self.logger.info("%s: %s", queue.topic, value)
 
                 self.produced.append(value)
+
+
+class BatchProducer:
+    """Columnar producer: sends <size> samples of every field at once.
+
+    fields are the subtopics (relative to topic) of the values that
+    value_generator yields, in order; each batch goes out as one
+    PUBLICATE_BATCH with a timestamp column (ns) and a typed column per field."""
+
+    def __init__(self, topic, fields, value_generator, queue_type=PickleQueue, address=DEFAULT_ADDRESS):
+        self.queue = queue_type(topic, _type=MiddlewareType.PRODUCER, address=address)
+        self.fields = fields
+        self.gen = value_generator
+        self.produced = []
+
+    def run(self, events=10, size=100, rate=None):
+        """Produce at most <events> batches of <size> samples, at <rate> batches/s if given."""
+        schedule = iter(Schedule(rate)) if rate else None
+        for _ in range(events):
+            ts = array.array("q")
+            columns = {}
+            for _ in range(size):
+                ts.append(time.time_ns())
+                for field, value in zip(self.fields, self.gen()):
+                    if field not in columns:
+                        columns[field] = array.array("q" if isinstance(value, int) else "d")
+                    columns[field].append(value)
+            if schedule is not None:
+                wait_until(next(schedule))
+            self.queue.push_batch(ts, columns)
+            self.produced.append(columns)
+
+
+class LoadGenerator:
+    """Open-loop load generator.
+
+    Publishes values from value_generator on <topics> simulated topics
+    (<topic>/0, <topic>/1, ...) over a small pool of connections, following
+    a Schedule, and reports the achieved rate against the target."""
+
+    def __init__(self, topic, value_generator, queue_type=PickleQueue, topics=1000, connections=4,
+                 schedule=None, trace=False, address=DEFAULT_ADDRESS):
+        self.topics = [f"{topic}/{i}" for i in range(topics)]
+        self.queue = [
+            queue_type(topic, _type=MiddlewareType.PRODUCER, trace=trace, address=address)
+            for _ in range(connections)
+        ]
+        self.schedule = schedule or Schedule(1000)
+        # value generators yield a few values per call, chain the calls forever
+        self.values = itertools.chain.from_iterable(value_generator() for _ in itertools.repeat(None))
+
+    def run(self, duration=10):
+        """Publish for <duration> seconds and return a report."""
+        sent = 0
+        late = 0
+        max_lag = 0
+        start = time.monotonic()
+        end = start + duration
+        for when in self.schedule:
+            if when >= end:
+                break
+            wait_until(when)
+            lag = time.monotonic() - when
+            if lag > 0.001:
+                late += 1
+                max_lag = max(max_lag, lag)
+            self.queue[sent % len(self.queue)].push(next(self.values), self.topics[sent % len(self.topics)])
+            sent += 1
+        elapsed = time.monotonic() - start
+        return {
+            "target_rate": round(self.schedule.expected(duration) / duration, 1),
+            "achieved_rate": round(sent / elapsed, 1),
+            "sent": sent,
+            "elapsed": round(elapsed, 3),
+            "late": late,
+            "max_lag_ms": round(max_lag * 1000, 3),
+        }
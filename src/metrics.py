@@ -0,0 +1,143 @@
+"""Broker metrics: counters, gauges and fixed-bucket histograms."""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+# bucket upper bounds, in microseconds
+LATENCY_BUCKETS_US = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                      10000, 20000, 50000, 100000, 200000, 500000, 1000000]
+# bucket upper bounds for counts (fan-out size, queue depth, ...)
+SIZE_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096]
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds.
+
+    observe() is a bisect plus two additions, so it is cheap enough to be
+    called from the broker's hot path."""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1) # last bucket is +Inf
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, p: float):
+        """Upper bound of the bucket holding the p-th percentile (0 < p <= 100).
+
+        Returns None when nothing was observed and inf when the value falls
+        past the last bound."""
+        if self.count == 0:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, cnt in enumerate(self.counts):
+            seen += cnt
+            if seen >= rank and cnt:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        return {
+            "bounds": list(self.bounds),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.total,
+        }
+
+
+class Metrics:
+    """Registry of every metric kept by the broker."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value):
+        self.gauges[name] = value
+
+    def add_gauge(self, name: str, amount):
+        self.gauges[name] = self.gauges.get(name, 0) + amount
+
+    def histogram(self, name: str, bounds: List[float] = LATENCY_BUCKETS_US) -> Histogram:
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = Histogram(bounds)
+        return hist
+
+    def observe(self, name: str, value, bounds: List[float] = LATENCY_BUCKETS_US):
+        self.histogram(name, bounds).observe(value)
+
+    def snapshot(self) -> Dict:
+        """Plain dict copy of every metric, safe to serialize."""
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "histograms": {name: hist.snapshot() for name, hist in list(self.histograms.items())},
+        }
+
+    def render_text(self) -> str:
+        """Render the metrics in the Prometheus plain text format."""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"{_metric_name(name)} {value}")
+        for name, value in sorted(snap["gauges"].items()):
+            lines.append(f"{_metric_name(name)} {value}")
+        for name, hist in sorted(snap["histograms"].items()):
+            base, labels = _split_labels(name)
+            cumulative = 0
+            for bound, cnt in zip(hist["bounds"] + ["+Inf"], hist["counts"]):
+                cumulative += cnt
+                lines.append(f'broker_{base}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            lines.append(f"broker_{base}_count{{{labels.rstrip(',')}}} {hist['count']}")
+            lines.append(f"broker_{base}_sum{{{labels.rstrip(',')}}} {hist['sum']}")
+        return "\n".join(lines) + "\n"
+
+
+def _split_labels(name: str):
+    # "publishes:/weather" -> ("publishes", 'key="/weather",')
+    if ":" in name:
+        base, key = name.split(":", 1)
+        key = key.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return base, f'key="{key}",'
+    return name, ""
+
+
+def _metric_name(name: str) -> str:
+    base, labels = _split_labels(name)
+    if labels:
+        return f"broker_{base}{{{labels.rstrip(',')}}}"
+    return f"broker_{base}"
+
+
+def serve_metrics(metrics: Metrics, host: str, port: int) -> ThreadingHTTPServer:
+    """Serve metrics.render_text() over HTTP from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -1,13 +1,25 @@
 """Middleware to communicate with PubSub Message Broker."""
+from collections import deque
 from collections.abc import Callable
 from enum import Enum
-from queue import LifoQueue, Empty
-from .broker import Serializer, Converter
+from .broker import Serializer, Converter, split_segments
+import asyncio
+import itertools
 import json
 import pickle
+import random
+import select
 import xml.etree.ElementTree as ET
-import socket
-from typing import Any
+import threading
+import time
+from typing import Any, Dict
+
+from .metrics import Histogram, LATENCY_BUCKETS_US
+from .transport import connect, open_connection
+from . import arrays, shm
+
+
+DEFAULT_ADDRESS = "localhost:5000"
 
 
 class MiddlewareType(Enum):
@@ -17,63 +29,594 @@ class MiddlewareType(Enum):
     PRODUCER = 2
 
 
+class PrefetchBuffer:
+    """Bounded FIFO of raw frames, filled by a receiver thread and emptied by pull().
+
+    A full buffer blocks the receiver, which stops reading the socket and
+    so pushes back on the broker as a slow consumer would."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.frames = deque()
+        self.error = None # why the receiver stopped
+        self.cond = threading.Condition()
+
+    def put(self, frames: list):
+        with self.cond:
+            for frame in frames:
+                while len(self.frames) >= self.capacity and self.error is None:
+                    self.cond.notify_all() # wake pull() up for those already in
+                    self.cond.wait()
+                self.frames.append(frame)
+            self.cond.notify_all()
+
+    def fail(self, error: Exception):
+        with self.cond:
+            self.error = error
+            self.cond.notify_all()
+
+    def take(self, timeout: float = None) -> list:
+        """Every frame buffered, waiting up to timeout for one; [] on timeout.
+
+        Raises the receiver's error once the frames before it are taken."""
+        with self.cond:
+            if not self.frames and self.error is None:
+                self.cond.wait_for(lambda: self.frames or self.error is not None, timeout)
+            if not self.frames:
+                if self.error is not None:
+                    raise self.error
+                return []
+            frames = list(self.frames)
+            self.frames.clear()
+            self.cond.notify_all()
+            return frames
+
+
+class RPCError(Exception):
+    """A call() failed: no responder for the topic, or the responder replied with an error."""
+
+
+class Backoff:
+    """Reconnect delays: exponential with full jitter.
+
+    Retry n waits a random time in [0, min(cap, base * 2**n)], so clients
+    that lost the broker at the same moment come back spread out instead of
+    all at once. retries: attempts before giving up (None: never give up)."""
+
+    def __init__(self, base: float = 0.1, cap: float = 30.0, retries: int = None):
+        self.base = base
+        self.cap = cap
+        self.retries = retries
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
 class Queue:
     """Representation of Queue interface for both Consumers and Producers."""
 
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        """Create Queue."""
-        host = "localhost"
-        port = 5000
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, trace=False, address=DEFAULT_ADDRESS, snapshot=False,
+                 prefetch=0, reconnect=True, max_pending=1000):
+        """Create Queue.
+
+        trace: producers stamp their publications with the send time and
+        consumers record the latency of stamped messages (see latency()).
+        address: broker address, "host:port" or "unix:///path"; prefixed
+        with "shm+", frames go through shared memory (same host only).
+        snapshot: consumers first receive the current values of the whole
+        subtree of topic, as a {topic: value} dict.
+        prefetch: if > 0, a background thread keeps reading the socket into
+        a buffer of up to prefetch frames, and pull() takes them from memory.
+        reconnect: when the connection is lost, connect again (retrying
+        after Backoff delays, True for the default one), subscribe again and
+        send what was pushed meanwhile, up to max_pending messages (the
+        oldest are dropped first). The value the broker retains, sent again
+        on subscribing, is skipped if it is the last one received. False:
+        pull() and push() raise ConnectionError."""
         self.topic = topic
-        self.sckt = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sckt.connect((host,port))
+        self.address = address
+        self.backoff = Backoff() if reconnect is True else reconnect or None
+        self.pending = deque(maxlen=max_pending) # frames pushed while disconnected
+        self.attempts = 0 # failed reconnects in a row
+        self.retry_at = 0 # monotonic time of the next reconnect attempt
+        self.reconnects = 0
+        self.resumed = False # reconnected, the next value may be the retained one already received
+        self.last = None # data of the last SEND received
+        self.prefetch = prefetch
+        self.prefetched = None # PrefetchBuffer, when prefetching
+        self.decoded = deque() # messages decoded from prefetched frames, not pulled yet
+        self.sckt = self._connect(address)
+        self._start_receiver()
         self.msg_format = None
         self.sub = {"method": "SUBSCRIBE", "topic":topic}
+        if snapshot:
+            self.sub["snapshot"] = True
         self.converter = None
         self._type = _type
-
-    def push(self, value):
-        """Sends data to broker. """
+        self.trace = trace
+        self.latencies = {} # topic -> {segment: Histogram}
+        self.topics_cursor = None
+        self.calls = {} # call id -> [replied, REPLY], outstanding call()s
+        self.reading = False # a thread is reading the socket inline (no receiver thread)
+        self.read_cond = threading.Condition() # reading, replies and decoded change under it
+        self.call_ids = itertools.count()
+        self.serving = [] # topics this queue answers REQUESTs on
+        self.request_id = None # id of the last REQUEST pulled, for reply()
+        self.send_lock = threading.Lock() # call() may be used from many threads
+
+    def _connect(self, address):
+        """Socket (or shared memory channel) connected to the broker at address."""
+        if address.startswith(shm.SHM_PREFIX):
+            sock = connect(address[len(shm.SHM_PREFIX):])
+            return shm.attach(sock, Converter(Serializer.PICKLE))
+        return connect(address)
+
+    def _start_receiver(self):
+        if self.prefetch and self.sckt is not None:
+            self.prefetched = PrefetchBuffer(self.prefetch)
+            threading.Thread(
+                target=self._receive, args=(self.sckt, self.prefetched), daemon=True, name=f"receiver {self.topic}"
+            ).start()
+
+    def close(self):
+        """Close the connection to the broker, and the shared memory rings of a "shm+" address.
+
+        The queue is not reconnected afterwards: pull() and push() raise ConnectionError."""
+        self.backoff = None
+        sckt, self.sckt = self.sckt, None
+        self._fail_calls()
+        if sckt is not None:
+            try:
+                sckt.close()
+            except OSError:
+                pass
+
+    def _lost(self):
+        """Forget the broken connection, the next reconnect attempt waits a first random delay."""
+        if self.sckt is not None:
+            try:
+                self.sckt.close()
+            except OSError:
+                pass
+        self.sckt = None
+        self.decoded.clear()
+        self.retry_at = time.monotonic() + self.backoff.delay(0)
+
+    def _reconnect(self, block=True) -> bool:
+        """Connect again, subscribe again and send the frames pushed meanwhile.
+
+        Without block, gives up (returning False) instead of waiting for the
+        next attempt. Raises ConnectionError after Backoff.retries failures."""
+        if self.backoff is None: # closed
+            raise ConnectionError("the queue is closed")
+        while True:
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                if not block:
+                    return False
+                time.sleep(wait)
+            try:
+                self.sckt = self._connect(self.address)
+                if self._type == MiddlewareType.CONSUMER:
+                    self._write(self._frame(self.sub))
+                for topic in self.serving:
+                    self._write(self._frame({"method": "SERVE", "topic": topic}))
+                while self.pending:
+                    self._write(self.pending[0])
+                    self.pending.popleft()
+            except OSError as err:
+                self._lost()
+                self.attempts += 1
+                if self.backoff.retries is not None and self.attempts > self.backoff.retries:
+                    raise ConnectionError(f"could not reconnect to {self.address}") from err
+                self.retry_at = time.monotonic() + self.backoff.delay(self.attempts)
+                if not block:
+                    return False
+                continue
+            self.attempts = 0
+            self.reconnects += 1
+            self.resumed = True
+            self._start_receiver()
+            return True
+
+    def push(self, value, topic=None, priority=None):
+        """Sends data to broker.
+
+        Producers publish to their own topic unless another one is given.
+        numpy arrays and array.array values are sent as typed arrays, as
+        their raw bytes, and consumers get them back as numpy arrays.
+        priority: "high", "normal" or "low" (or 0, 1, 2), overriding the
+        priority the broker gives the topic; consumers lagging behind get
+        high priority values before the others waiting for them."""
         if self._type == MiddlewareType.PRODUCER:
-            value = {"method":"PUBLICATE", "args":{"msg": value, "topic": self.topic}}
+            value = {"method":"PUBLICATE", "args":{"msg": arrays.pack(value), "topic": topic or self.topic}}
+            if self.trace:
+                value["trace"] = {"sent": time.time_ns()}
+            if priority is not None:
+                value["priority"] = priority
             #print("prod_send:",value)
 
+        return self._send(value)
+
+    def push_batch(self, ts, columns: Dict, topic=None):
+        """Sends N samples of several fields at once, as columns.
+
+        ts holds the N timestamps and columns maps each field, a subtopic
+        relative to the topic (e.g. "temperature/celsius"), to its N values.
+        Subscribers of the topic get the whole batch, those of a field
+        subtopic only its columns: {"ts": ts, "columns": {field: values}}."""
+        args = {
+            "topic": topic or self.topic,
+            "ts": arrays.pack(ts, 0),
+            "columns": {field: arrays.pack(column, 0) for field, column in columns.items()},
+        }
+        return self._send({"method": "PUBLICATE_BATCH", "args": args})
+
+    def _send(self, value):
+        """Sends a protocol message to broker, as is.
+
+        While disconnected, the frame waits in pending for the reconnect."""
         #print("value:",value)
-        msg = self.converter.serialize(value)
+        frame = self._frame(value)
+        if self.sckt is None and not self._reconnect(block=False):
+            self.pending.append((b"".join(frame),))
+            return
+        try:
+            self._write(frame)
+        except OSError:
+            if self.backoff is None:
+                raise
+            self._lost()
+            self.pending.append((b"".join(frame),))
+            self._reconnect(block=False)
+
+    def _frame(self, value):
+        """Buffers of the frame of a message: format byte, length and body, or a segmented frame."""
         #print("msg:",msg)
         form = self.msg_format.to_bytes(1, byteorder="big")
-
-        self.sckt.send(form+msg)
-
-    def pull(self) -> (str, Any):
+        return (form, *self.converter.serialize_frame(value))
+
+    def _write(self, buffers):
+        with self.send_lock:
+            if len(buffers) <= 3:
+                self.sckt.send(b"".join(buffers))
+            else: # segmented frame, write the out-of-band buffers without copying them
+                self._sendmsg(buffers)
+
+    def _sendmsg(self, buffers):
+        """Writes all the buffers, in order, as if they were one."""
+        sent = self.sckt.sendmsg(buffers)
+        if sent < sum(map(len, buffers)):
+            self.sckt.sendall(b"".join(buffers)[sent:])
+
+    def pull(self, timeout=None) -> (str, Any):
         """Waits for (topic, data) from broker.
 
-        Should BLOCK the consumer!"""
+        Should BLOCK the consumer! For at most timeout seconds if given,
+        returning None if nothing arrived. A lost connection is reconnected
+        (see reconnect in __init__) while waiting."""
+        while True:
+            if self.sckt is None:
+                self._reconnect() # raises ConnectionError once it gives up
+            try:
+                dic = self._next_msg(timeout)
+                if dic is None:
+                    return None
+                if dic["method"] == "SNAPSHOT":
+                    values = {}
+                    for _ in range(int(dic["count"])):
+                        item = self._next_msg()
+                        values[item["topic"]] = item["data"]
+                    return (self.topic, values)
+                if self.resumed:
+                    self.resumed = False
+                    if dic.get("retained") and self._same(dic["data"], self.last):
+                        continue # the retained value, received before the connection was lost
+                return self._result(dic)
+            except OSError:
+                self._fail_calls()
+                if self.backoff is None:
+                    raise
+                self._lost()
+
+    @staticmethod
+    def _same(data, last) -> bool:
         try:
-            size = self.sckt.recv(2)
-            length = int.from_bytes(size, "big")
-            content = self.sckt.recv(length)
-
-            dic = self.converter.deserialize(content)
-            print("receive:",dic)
-            method = dic["method"]
-            if method == "SEND":
-                return (self.topic, dic["data"])
-            if method == "REP_TOPICS":
-                return dic["lst"]
-
+            return bool(data == last)
+        except ValueError: # numpy arrays compare element-wise
+            return False
+
+    def _result(self, dic):
+        """What pull() returns for a message from the broker (SNAPSHOTs aside)."""
+        method = dic["method"]
+        if method == "SEND":
+            if "trace" in dic:
+                self._record_trace(dic["trace"])
+            self.last = dic["data"]
+            return (self.topic, dic["data"])
+        if method == "REP_TOPICS":
+            self.topics_cursor = dic.get("cursor")
+            return dic["lst"]
+        if method == "REP_STATS":
+            return dic["stats"]
+        if method == "REP_PROFILE":
+            return dic
+        if method == "REQUEST":
+            self.request_id = dic["id"]
+            return (dic["topic"], dic["data"])
+
+        return None
+
+    def _next_msg(self, timeout=None):
+        """Next message from the broker, None if none arrived within timeout."""
+        if self.prefetched is None:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            with self.read_cond: # a call() may be reading the socket
+                while not self.decoded and self.reading:
+                    if not self._wait(deadline):
+                        return None
+                if self.decoded:
+                    return self.decoded.popleft()
+                self.reading = True
+            try:
+                while True:
+                    msg = self._read(deadline)
+                    if msg is None or not self._route(msg, keep=False):
+                        return msg
+            finally:
+                self._done_reading()
+        if not self.decoded:
+            frames = self.prefetched.take(timeout)
+            if not frames:
+                return None
+            self.decoded.extend(self._decode(frame) for frame in frames)
+        return self.decoded.popleft()
+
+    def _wait(self, deadline) -> bool:
+        """Wait on read_cond (held) until notified or deadline; False once it passed."""
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return False
+        self.read_cond.wait(remaining)
+        return True
+
+    def _read(self, deadline):
+        """Next message read from the socket, None if none started arriving before deadline."""
+        if self.sckt is None:
+            raise ConnectionError("not connected to the broker")
+        if deadline is not None and not self._readable(max(0, deadline - time.monotonic())):
             return None
-        except:
-            dic = {"method": "UNSUBSCRIBE", "topic": self.topic}
-            self.push(dic)
-            quit()
-
-
-    def list_topics(self, callback: Callable):
-        """Lists all topics available in the broker."""
+        return self._recv_msg()
+
+    def _route(self, msg, keep=True) -> bool:
+        """Hand a REPLY to the call() waiting for it, and keep any other message
+        for pull() if keep. Returns whether msg was taken."""
+        with self.read_cond:
+            if msg.get("method") == "REPLY":
+                waiter = self.calls.pop(msg["id"], None)
+                if waiter is not None: # else, the call timed out
+                    waiter[0] = True
+                    waiter[1] = msg
+                    self.read_cond.notify_all()
+                return True
+            if keep:
+                self.decoded.append(msg)
+                self.read_cond.notify_all()
+            return keep
+
+    def _done_reading(self):
+        with self.read_cond:
+            self.reading = False
+            self.read_cond.notify_all()
+
+    def _fail_calls(self):
+        """The connection is gone, and with it the replies of every outstanding call."""
+        with self.read_cond:
+            for waiter in self.calls.values():
+                waiter[0] = True
+            self.calls.clear()
+            self.read_cond.notify_all()
+
+    def _readable(self, timeout) -> bool:
+        """Whether a frame starts arriving within timeout seconds."""
+        wait = getattr(self.sckt, "wait", None) # shared memory: the socket only carries doorbells
+        if wait is not None:
+            return wait(timeout)
+        return bool(select.select([self.sckt], [], [], timeout)[0])
+
+    def _receive(self, sckt, prefetched: PrefetchBuffer):
+        """Receiver thread: split what sckt delivers into frames and buffer them in prefetched."""
+        buffer = bytearray()
+        try:
+            while True:
+                data = sckt.recv(65536)
+                if not data:
+                    raise ConnectionError("broker closed the connection")
+                buffer += data
+                frames = []
+                offset = 0
+                while len(buffer) - offset >= 2:
+                    length = int.from_bytes(buffer[offset:offset + 2], "big")
+                    if length == 0: # segmented
+                        parsed = split_segments(buffer, offset + 2)
+                        if parsed is None:
+                            break
+                        frame, offset = parsed
+                    else:
+                        if len(buffer) - offset < 2 + length:
+                            break
+                        frame = bytes(buffer[offset + 2:offset + 2 + length])
+                        offset += 2 + length
+                    if self.calls and self._dispatch(frame):
+                        continue
+                    frames.append(frame)
+                del buffer[:offset]
+                if frames:
+                    prefetched.put(frames)
+        except OSError as err: # ConnectionError included, or the socket closed under us
+            prefetched.fail(err)
+            self._fail_calls()
+
+    def _dispatch(self, frame) -> bool:
+        """Hand a REPLY frame to the call() waiting for it. False for any other frame."""
+        if b"REPLY" not in (frame[0] if type(frame) is list else frame)[:48]: # the method comes first
+            return False
+        msg = self._decode(frame)
+        return msg.get("method") == "REPLY" and self._route(msg)
+
+    def _decode(self, frame):
+        """Message of a frame: its body, or the list of segments of a segmented frame."""
+        if type(frame) is list:
+            return arrays.unpack(self.converter.deserialize(frame[0], frame[1:]))
+        return arrays.unpack(self.converter.deserialize(frame)) # TypedArrays pickled in-band
+
+    def _recv_exact(self, length):
+        """Reads exactly length bytes from the socket."""
+        data = self.sckt.recv(length)
+        if len(data) == length:
+            return data
+        chunks = [data]
+        missing = length - len(data)
+        while missing:
+            chunk = self.sckt.recv(missing)
+            if not chunk:
+                raise ConnectionError("broker closed the connection")
+            chunks.append(chunk)
+            missing -= len(chunk)
+        return b"".join(chunks)
+
+    def _recv_msg(self):
+        """Reads and decodes one frame."""
+        length = int.from_bytes(self._recv_exact(2), "big")
+        if length == 0: # segmented: count, segment lengths, then the pickle and its out-of-band buffers
+            count = self._recv_exact(1)[0]
+            lengths = self._recv_exact(4 * count)
+            segments = [self._recv_exact(int.from_bytes(lengths[i:i + 4], "big")) for i in range(0, 4 * count, 4)]
+            return self._decode(segments)
+        return self._decode(self._recv_exact(length))
+
+    def _record_trace(self, trace: Dict):
+        """Split the latency of a stamped message into its segments (microseconds)."""
+        now = time.time_ns()
+        hists = self.latencies.get(trace["topic"])
+        if hists is None:
+            hists = self.latencies[trace["topic"]] = {
+                segment: Histogram(LATENCY_BUCKETS_US) for segment in ("producer", "broker", "network", "total")
+            }
+        hists["producer"].observe((trace["recv"] - trace["sent"]) // 1000)
+        hists["broker"].observe((trace["out"] - trace["recv"]) // 1000)
+        hists["network"].observe((now - trace["out"]) // 1000)
+        hists["total"].observe((now - trace["sent"]) // 1000)
+
+    def latency(self, topic=None) -> Dict:
+        """Latency percentiles of the traced messages received, per topic and segment.
+
+        Segments: producer (producer send -> broker receive), broker (broker
+        receive -> broker send), network (broker send -> pull) and total."""
+        ret = {}
+        for name, hists in self.latencies.items():
+            if topic is not None and name != topic:
+                continue
+            ret[name] = {
+                segment: {
+                    "count": hist.count,
+                    "p50": hist.percentile(50),
+                    "p99": hist.percentile(99),
+                    "p999": hist.percentile(99.9),
+                }
+                for segment, hist in hists.items()
+            }
+        return ret
+
+    def list_topics(self, callback: Callable, prefix=None, cursor=None, limit=None):
+        """Lists topics available in the broker, answered with a REP_TOPICS on pull().
+
+        Topics come sorted and paginated: only those starting with prefix,
+        after cursor, at most limit of them. After pull(), topics_cursor
+        holds the cursor of the next page, or None if this was the last one."""
         dic = {"method": "REQ_TOPICS"}
-        self.push(dic)
-
+        if prefix is not None:
+            dic["prefix"] = prefix
+        if cursor is not None:
+            dic["cursor"] = cursor
+        if limit is not None:
+            dic["limit"] = limit
+        return self._send(dic)
+
+    def stats(self):
+        """Asks the broker for its metrics, answered with a REP_STATS on pull()."""
+        dic = {"method": "STATS"}
+        return self._send(dic)
+
+    def profile(self, action="start", mode="deterministic", seconds=10, path=None):
+        """Starts or stops profiling the broker, answered with a REP_PROFILE on pull()."""
+        dic = {"method": "PROFILE", "action": action, "mode": mode, "seconds": seconds}
+        if path is not None:
+            dic["path"] = path
+        return self._send(dic)
+
+    def call(self, topic, payload=None, timeout=None):
+        """Sends a REQUEST to the responder of topic and waits for its reply.
+
+        Many threads may have calls outstanding on the same queue: one of
+        them at a time reads the socket and hands every REPLY to its caller
+        (or the receiver thread does, see prefetch); other messages are kept
+        for pull(). Raises TimeoutError after timeout seconds, RPCError if
+        there is no responder or it failed, and ConnectionError if the
+        connection was lost meanwhile."""
+        call_id = next(self.call_ids)
+        waiter = self.calls[call_id] = [False, None]
+        self._send({"method": "REQUEST", "topic": topic, "id": call_id, "data": arrays.pack(payload)})
+        if not self._wait_reply(waiter, None if timeout is None else time.monotonic() + timeout):
+            self.calls.pop(call_id, None)
+            raise TimeoutError(f"no reply from {topic} within {timeout}s")
+        reply = waiter[1]
+        if reply is None:
+            raise ConnectionError("connection lost while waiting for the reply")
+        if "error" in reply:
+            raise RPCError(reply["error"])
+        return reply["data"]
+
+    def _wait_reply(self, waiter, deadline) -> bool:
+        """Wait for waiter[0], reading the socket when no other thread does. False on timeout."""
+        with self.read_cond:
+            while not waiter[0] and (self.reading or self.prefetched is not None):
+                if not self._wait(deadline):
+                    return False
+            if waiter[0]:
+                return True
+            self.reading = True
+        try:
+            while not waiter[0]:
+                msg = self._read(deadline)
+                if msg is None:
+                    return False
+                self._route(msg)
+            return True
+        except OSError:
+            self._fail_calls()
+            if self.backoff is None:
+                raise
+            self._lost()
+            return True # failed, waiter[1] is None
+        finally:
+            self._done_reading()
+
+    def serve(self, topic):
+        """Answer the REQUESTs on topic (and its subtopics without a responder of their own).
+
+        Requests come from pull() as (topic, payload); answer each with reply()."""
+        self.serving.append(topic)
+        return self._send({"method": "SERVE", "topic": topic})
+
+    def reply(self, data=None, error=None, request_id=None):
+        """Answers the last REQUEST pulled (or request_id), with data or an error message."""
+        dic = {"method": "REPLY", "id": self.request_id if request_id is None else request_id}
+        if error is not None:
+            dic["error"] = str(error)
+        else:
+            dic["data"] = arrays.pack(data)
+        return self._send(dic)
 
     def cancel(self):
         """Cancel subscription."""
@@ -87,8 +630,8 @@ class Queue:
 class JSONQueue(Queue):
     """Queue implementation with JSON based serialization."""
 
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        super().__init__(topic, _type)
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        super().__init__(topic, _type, **kwargs)
         self.msg_format = 0
         self.converter = Converter(Serializer(self.msg_format))
         #print(self.sub)
@@ -121,8 +664,8 @@ class JSONQueue(Queue):
 class XMLQueue(Queue):
     """Queue implementation with XML based serialization."""
 
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        super().__init__(topic, _type)
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        super().__init__(topic, _type, **kwargs)
         self.msg_format = 1
         self.converter = Converter(Serializer(self.msg_format))
         if _type == MiddlewareType.CONSUMER:
@@ -156,8 +699,8 @@ class XMLQueue(Queue):
 class PickleQueue(Queue):
     """Queue implementation with Pickle based serialization."""
 
-    def __init__(self, topic, _type=MiddlewareType.CONSUMER):
-        super().__init__(topic, _type)
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        super().__init__(topic, _type, **kwargs)
         self.msg_format = 2
         self.converter = Converter(Serializer(self.msg_format))
         if _type == MiddlewareType.CONSUMER:
@@ -184,3 +727,261 @@ class PickleQueue(Queue):
     def cancel(self):
         super().cancel()
         self.push(self.canc)
+
+
+class AsyncQueue(Queue):
+    """Queue on asyncio streams: same wire protocol, awaitable methods.
+
+    Many queues (one connection each) share one event loop:
+
+        async with AsyncJSONQueue("/weather", MiddlewareType.CONSUMER) as queue:
+            async for topic, data in queue:
+                ...
+
+    push(), push_batch(), list_topics(), stats(), profile() and call()
+    are coroutines. Shared memory addresses are not supported."""
+
+    def _connect(self, address):
+        if address.startswith(shm.SHM_PREFIX):
+            raise ValueError("shared memory transport is not available to asyncio queues")
+        self.reader = self.writer = None
+        self.read_task = None # read of the next message, shared by whoever waits for one
+        self.futures = {} # call id -> Future of the REPLY of an outstanding call()
+        return None # connected by open()
+
+    @classmethod
+    async def create(cls, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        """Connected queue, subscribed to topic if a consumer."""
+        queue = cls(topic, _type, **kwargs)
+        await queue.open()
+        return queue
+
+    async def open(self):
+        """Connect to the broker and subscribe consumers to their topic."""
+        self.reader, self.writer = await open_connection(self.address)
+        self.sckt = self.writer.get_extra_info("socket")
+        if self._type == MiddlewareType.CONSUMER:
+            await self._write(self._frame(self.sub))
+        for topic in self.serving:
+            await self._write(self._frame({"method": "SERVE", "topic": topic}))
+
+    def _lost(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.read_task is not None:
+            self.read_task.cancel()
+            self.read_task = None
+        self._fail_calls()
+        self.reader = self.writer = self.sckt = None
+        self.retry_at = time.monotonic() + self.backoff.delay(0)
+
+    async def _reconnect(self, block=True) -> bool:
+        """Queue._reconnect, waiting on the event loop."""
+        while True:
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                if not block:
+                    return False
+                await asyncio.sleep(wait)
+            try:
+                await self.open()
+                while self.pending:
+                    await self._write(self.pending[0])
+                    self.pending.popleft()
+            except OSError as err:
+                self._lost()
+                self.attempts += 1
+                if self.backoff.retries is not None and self.attempts > self.backoff.retries:
+                    raise ConnectionError(f"could not reconnect to {self.address}") from err
+                self.retry_at = time.monotonic() + self.backoff.delay(self.attempts)
+                if not block:
+                    return False
+                continue
+            self.attempts = 0
+            self.reconnects += 1
+            self.resumed = True
+            return True
+
+    async def _send(self, value):
+        frame = self._frame(value)
+        if self.writer is None and not await self._reconnect(block=False):
+            self.pending.append((b"".join(frame),))
+            return
+        try:
+            await self._write(frame)
+        except OSError:
+            if self.backoff is None:
+                raise
+            self._lost()
+            self.pending.append((b"".join(frame),))
+            await self._reconnect(block=False)
+
+    async def call(self, topic, payload=None, timeout=None):
+        """Queue.call() without blocking the event loop.
+
+        Many coroutines may have calls outstanding on the same queue: the
+        REPLYs are matched to their futures by call id, whichever of them
+        (or pull()) happens to read them; other messages are kept for pull()."""
+        call_id = next(self.call_ids)
+        future = self.futures[call_id] = asyncio.get_running_loop().create_future()
+        await self._send({"method": "REQUEST", "topic": topic, "id": call_id, "data": arrays.pack(payload)})
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not future.done():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"no reply from {topic} within {timeout}s")
+                try:
+                    await self._pump(remaining)
+                except ConnectionError:
+                    if self.backoff is None:
+                        raise
+                    self._lost()
+        finally:
+            self.futures.pop(call_id, None)
+        reply = future.result()
+        if reply is None:
+            raise ConnectionError("connection lost while waiting for the reply")
+        if "error" in reply:
+            raise RPCError(reply["error"])
+        return reply["data"]
+
+    def _fail_calls(self):
+        for future in self.futures.values():
+            if not future.done():
+                future.set_result(None)
+
+    async def _pump(self, timeout=None):
+        """Read the next message, if one arrives within timeout: a REPLY goes
+        to the future of its call(), anything else to decoded for pull()."""
+        if self.read_task is None:
+            if self.reader is None:
+                raise ConnectionError("not connected to the broker")
+            self.read_task = asyncio.ensure_future(self._recv_msg())
+        task = self.read_task
+        await asyncio.wait([task], timeout=timeout) # a timeout leaves the read going, for the next one
+        if self.read_task is not task or not task.done():
+            return # timed out, or taken by another coroutine waiting on it
+        self.read_task = None
+        if task.cancelled():
+            raise ConnectionError("connection lost")
+        msg = task.result() # raises the ConnectionError of the read
+        if msg.get("method") == "REPLY":
+            future = self.futures.get(msg["id"])
+            if future is not None and not future.done(): # else, the call timed out
+                future.set_result(msg)
+        else:
+            self.decoded.append(msg)
+
+    async def _next_msg(self):
+        while not self.decoded:
+            await self._pump()
+        return self.decoded.popleft()
+
+    async def _write(self, buffers):
+        self.writer.writelines(buffers)
+        await self.writer.drain()
+
+    async def pull(self) -> (str, Any):
+        """Waits for (topic, data) from broker, without blocking the event loop.
+
+        Reconnects like Queue.pull(); raises ConnectionError if the broker
+        closed the connection and reconnect is off (or gave up)."""
+        while True:
+            if self.writer is None:
+                await self._reconnect() # raises ConnectionError once it gives up
+            try:
+                dic = await self._next_msg()
+                if dic["method"] == "SNAPSHOT":
+                    values = {}
+                    for _ in range(int(dic["count"])):
+                        item = await self._next_msg()
+                        values[item["topic"]] = item["data"]
+                    return (self.topic, values)
+                if self.resumed:
+                    self.resumed = False
+                    if dic.get("retained") and self._same(dic["data"], self.last):
+                        continue
+                return self._result(dic)
+            except ConnectionError:
+                if self.backoff is None:
+                    raise
+                self._lost()
+
+    async def _recv_exact(self, length):
+        try:
+            return await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError as err:
+            raise ConnectionError("broker closed the connection") from err
+
+    async def _recv_msg(self):
+        length = int.from_bytes(await self._recv_exact(2), "big")
+        if length == 0: # segmented, see Queue._recv_msg
+            count = (await self._recv_exact(1))[0]
+            lengths = await self._recv_exact(4 * count)
+            segments = [await self._recv_exact(int.from_bytes(lengths[i:i + 4], "big")) for i in range(0, 4 * count, 4)]
+            return self._decode(segments)
+        return self._decode(await self._recv_exact(length))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.pull()
+        except ConnectionError:
+            raise StopAsyncIteration
+
+    async def __aenter__(self):
+        if self.writer is None:
+            await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def cancel(self):
+        """Cancel subscription and close the connection."""
+        await self.push({"method": "UNSUBSCRIBE", "topic": self.topic})
+        await self.close()
+
+    async def close(self):
+        """Close the connection to the broker."""
+        if self.read_task is not None:
+            self.read_task.cancel()
+            self.read_task = None
+        self._fail_calls()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+
+class AsyncJSONQueue(AsyncQueue):
+    """AsyncQueue with JSON based serialization."""
+
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        super().__init__(topic, _type, **kwargs)
+        self.msg_format = 0
+        self.converter = Converter(Serializer(self.msg_format))
+
+
+class AsyncXMLQueue(AsyncQueue):
+    """AsyncQueue with XML based serialization."""
+
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        super().__init__(topic, _type, **kwargs)
+        self.msg_format = 1
+        self.converter = Converter(Serializer(self.msg_format))
+
+
+class AsyncPickleQueue(AsyncQueue):
+    """AsyncQueue with Pickle based serialization."""
+
+    def __init__(self, topic, _type=MiddlewareType.CONSUMER, **kwargs):
+        super().__init__(topic, _type, **kwargs)
+        self.msg_format = 2
+        self.converter = Converter(Serializer(self.msg_format))
@@ -0,0 +1,78 @@
+"""Per-connection queue of the frames the socket did not take yet, by priority."""
+from collections import deque
+from typing import Optional
+
+HIGH = 0 # alarms
+NORMAL = 1
+LOW = 2 # bulk telemetry
+LEVELS = 3
+PRIORITY_NAMES = {"high": HIGH, "normal": NORMAL, "low": LOW}
+
+
+def level(priority) -> Optional[int]:
+    """Priority level of "high"/"normal"/"low" or of a level number (int or str), None if invalid."""
+    if type(priority) is str:
+        priority = int(priority) if priority.isdigit() else PRIORITY_NAMES.get(priority)
+    return priority if type(priority) is int and 0 <= priority < LEVELS else None
+
+
+class Outbox:
+    """Frames waiting for a socket to become writable, written highest priority first.
+
+    A frame is always written whole before the next one is picked, so a
+    level only overtakes another at frame boundaries. Starvation: once a
+    waiting frame has been passed over starvation_limit times by higher
+    priority ones, it goes next (None: higher priorities always win)."""
+
+    __slots__ = ("levels", "current", "skipped", "starvation_limit", "promoted")
+
+    def __init__(self, starvation_limit: Optional[int] = 32):
+        self.levels = [deque() for _ in range(LEVELS)]
+        self.current = None # frame being written, possibly partially
+        self.skipped = [0] * LEVELS # times the head of each level was passed over
+        self.starvation_limit = starvation_limit
+        self.promoted = 0 # frames sent early to stop them from starving
+
+    def __len__(self):
+        return sum(map(len, self.levels)) + (self.current is not None)
+
+    def append(self, data, priority: int = NORMAL):
+        self.levels[priority].append(data)
+
+    def head(self):
+        """Frame to write next, what is left of the current one first.
+
+        Frames queued as functions are only made (called) when their turn comes."""
+        if self.current is None:
+            self.current = self.levels[self._pick()].popleft()
+            if callable(self.current):
+                self.current = self.current()
+        return self.current
+
+    def advance(self, sent: int):
+        """sent bytes of head() were written."""
+        if sent < len(self.current):
+            self.current = self.current[sent:]
+        else:
+            self.current = None
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+        self.current = None
+
+    def _pick(self) -> int:
+        levels = self.levels
+        first = next(i for i in range(LEVELS) if levels[i])
+        limit = self.starvation_limit
+        for i in range(first + 1, LEVELS):
+            if not levels[i]:
+                self.skipped[i] = 0
+            elif limit is not None and self.skipped[i] >= limit:
+                self.skipped[i] = 0
+                self.promoted += 1
+                return i
+            else:
+                self.skipped[i] += 1
+        self.skipped[first] = 0
+        return first
@@ -0,0 +1,135 @@
+"""Runtime profiler for the broker's event loop."""
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+
+# methods whose timing is summarized at the end of every profile
+HOT_METHODS = [
+    "read", "process", "handle", "publicate", "subscribe",
+    "serialize", "serialize_send", "serialize_frame", "deserialize",
+]
+
+
+class Profiler:
+    """Profiles the thread running the broker's event loop for a bounded window.
+
+    Two modes are supported:
+    - "deterministic": cProfile, dumped in pstats format;
+    - "sampling": a side thread samples the loop's stack every `interval`
+      seconds, dumped as collapsed stacks (flamegraph.pl input).
+
+    While idle the broker only checks `active`, so it can be left in place.
+    Dumps only ever go to directory (the temporary directory by default)."""
+
+    def __init__(self, directory: str = None):
+        self.directory = directory or tempfile.gettempdir()
+        self.active = False
+        self.mode = None
+        self.path = None
+        self.deadline = 0
+        self.summary = {}
+        self._profile = None
+        self._samples = None
+        self._sampler = None
+        self._interval = 0
+
+    def start(self, mode: str = "deterministic", seconds: float = 10, path: str = None, interval: float = 0.001):
+        """Start profiling the calling thread. Returns the dump path.
+
+        Only the file name of path is used, the dump goes to directory."""
+        if self.active:
+            self.stop()
+        if mode not in ("deterministic", "sampling"):
+            raise ValueError(f"unknown profiling mode {mode!r}")
+        if path is None:
+            ext = "pstats" if mode == "deterministic" else "collapsed"
+            name = f"broker-{os.getpid()}-{int(time.time())}.{ext}"
+        else: # asked for by any client: never anywhere else
+            name = os.path.basename(path)
+            if name in ("", ".", ".."):
+                raise ValueError(f"bad profile file name {path!r}")
+        path = os.path.join(self.directory, name)
+        self.mode = mode
+        self.path = path
+        self.deadline = time.monotonic() + seconds
+        self.active = True
+        if mode == "deterministic":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._samples = Counter()
+            self._interval = interval
+            self._sampler = threading.Thread(
+                target=self._sample, args=(threading.get_ident(), interval), daemon=True
+            )
+            self._sampler.start()
+        return path
+
+    def timeout(self):
+        """Seconds left in the window, used as the selector timeout."""
+        return max(0, self.deadline - time.monotonic())
+
+    def tick(self):
+        """Stop once the window is over. Called by the event loop."""
+        if time.monotonic() >= self.deadline:
+            self.stop()
+
+    def stop(self) -> Dict:
+        """Stop profiling, dump the profile and return the hot method summary."""
+        if not self.active:
+            return self.summary
+        self.active = False
+        if self.mode == "deterministic":
+            self._profile.disable()
+            self._profile.dump_stats(self.path)
+            self.summary = self._summarize_pstats(pstats.Stats(self._profile))
+            self._profile = None
+        else:
+            self._sampler.join()
+            with open(self.path, "w") as fp:
+                for stack, count in sorted(self._samples.items()):
+                    fp.write(f"{stack} {count}\n")
+            self.summary = self._summarize_samples(self._samples, self._interval)
+            self._samples = None
+        return self.summary
+
+    def _sample(self, thread_id: int, interval: float):
+        while self.active and time.monotonic() < self.deadline:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self._samples[";".join(reversed(stack))] += 1
+            time.sleep(interval)
+
+    @staticmethod
+    def _summarize_pstats(stats: pstats.Stats) -> Dict:
+        summary = {}
+        for (filename, _, name), (_, calls, _, cumtime, _) in stats.stats.items():
+            if name in HOT_METHODS and os.path.basename(filename) == "broker.py":
+                entry = summary.setdefault(name, {"calls": 0, "cumtime": 0.0})
+                entry["calls"] += calls
+                entry["cumtime"] += cumtime
+        return summary
+
+    @staticmethod
+    def _summarize_samples(samples: Counter, interval: float) -> Dict:
+        summary = {}
+        for stack, count in samples.items():
+            names = {frame.split(":", 1)[1] for frame in stack.split(";")}
+            for name in HOT_METHODS:
+                if name in names:
+                    entry = summary.setdefault(name, {"samples": 0, "cumtime": 0.0})
+                    entry["samples"] += count
+                    entry["cumtime"] += count * interval
+        return summary
@@ -0,0 +1,46 @@
+"""Token buckets limiting the messages and bytes per second a producer may send."""
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """rate tokens per second, up to burst of them saved up (one second's worth by default).
+
+    Taking more tokens than there are leaves the bucket in debt rather than
+    refusing: what was received is never dropped, the sender has to wait
+    for the debt to be paid back before it is read from again."""
+
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate: float, burst: float = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, not {rate}")
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self.last = time.monotonic()
+
+    def take(self, amount: float, now: float = None) -> float:
+        """Take amount tokens; seconds until the bucket is out of debt (0 if it is not)."""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate) - amount
+        self.last = now
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimit:
+    """Messages and bytes per second, either one None for no limit."""
+
+    __slots__ = ("msgs", "bytes")
+
+    def __init__(self, msgs: Optional[float] = None, bytes: Optional[float] = None):
+        self.msgs = None if msgs is None else TokenBucket(msgs)
+        self.bytes = None if bytes is None else TokenBucket(bytes)
+
+    def take(self, msgs: int, size: int, now: float = None) -> float:
+        """Charge msgs messages of size bytes in all; seconds to wait before sending more."""
+        now = time.monotonic() if now is None else now
+        delay = self.msgs.take(msgs, now) if self.msgs is not None else 0.0
+        if self.bytes is not None:
+            delay = max(delay, self.bytes.take(size, now))
+        return delay
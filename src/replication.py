@@ -0,0 +1,135 @@
+"""Primary/standby replication of the broker's retained values."""
+import selectors
+import socket
+import time
+from typing import Dict, List, Tuple
+
+from .transport import connect
+
+# entries per REPL_BATCH frame, halved when a batch does not fit in a frame
+BATCH_ENTRIES = 256
+
+
+class ReplicationLog:
+    """Primary side: value changes waiting to be shipped to the standbys.
+
+    The broker records a change only while some standby is attached and
+    ships everything recorded once per event loop iteration, so the
+    publish path itself never waits on a standby."""
+
+    def __init__(self):
+        self.replicas = [] # (conn, serializer) of the attached standbys
+        self.pending = [] # [seq, topic, value]
+        self.seq = 0
+
+    def record(self, topic: str, value):
+        self.seq += 1
+        self.pending.append([self.seq, topic, value])
+
+    def take(self) -> List:
+        pending, self.pending = self.pending, []
+        return pending
+
+    @staticmethod
+    def frames(converter, entries: List, sync: bool = False, skipped: List = None) -> List[Tuple[bytes, ...]]:
+        """Encode entries as REPL_BATCH frames (as buffers), splitting them to fit the 2 byte length.
+
+        Large binary values travel out-of-band, in segmented frames (see
+        Converter.serialize_frame). An entry that does not fit on its own,
+        or that the format cannot encode, is appended to skipped."""
+        frames = []
+        todo = [entries[i:i + BATCH_ENTRIES] for i in range(0, len(entries), BATCH_ENTRIES)]
+        while todo:
+            batch = todo.pop(0)
+            msg = {"method": "REPL_BATCH", "entries": batch, "ts": time.time_ns(), "sync": sync}
+            try:
+                frames.append(converter.serialize_frame(msg))
+            except (TypeError, ValueError, OverflowError):
+                if len(batch) == 1:
+                    if skipped is not None:
+                        skipped.append(batch[0])
+                    continue
+                half = len(batch) // 2
+                todo[:0] = [batch[:half], batch[half:]]
+        return frames
+
+
+class Standby:
+    """Standby side: keeps a broker's retained values in sync with a primary.
+
+    The replication stream is read from the standby broker's own event
+    loop, and every entry is applied as a local publish, so clients of the
+    standby see the updates too. When the primary goes away the standby
+    promotes itself and keeps serving the values it holds."""
+
+    def __init__(self, broker, primary: str):
+        from .broker import Converter, Serializer, split_segments # the broker module imports this one
+
+        self.broker = broker
+        self.primary = primary
+        self.converter = Converter(Serializer.PICKLE)
+        self.split_segments = split_segments
+        self.sock = None
+        self.buffer = bytearray()
+        self.last_seq = 0
+        self.promoted = False
+
+    def connect(self):
+        self.sock = connect(self.primary)
+        form = self.converter.msg_format.value.to_bytes(1, byteorder="big")
+        self.sock.sendall(form + self.converter.serialize({"method": "REPLICATE"}))
+        self.sock.setblocking(False)
+        self.broker.sel.register(self.sock, selectors.EVENT_READ, self.read)
+        self.broker.metrics.gauge("replication_connected", 1)
+
+    def read(self, sock: socket.socket):
+        try:
+            data = sock.recv(65536)
+        except BlockingIOError:
+            return
+        except ConnectionError:
+            data = b""
+        if not data:
+            self.promote()
+            return
+        buffer = self.buffer
+        buffer += data
+        offset = 0
+        while len(buffer) - offset >= 2:
+            length = int.from_bytes(buffer[offset:offset + 2], "big")
+            if length == 0: # segmented: the pickle and its out-of-band values
+                parsed = self.split_segments(buffer, offset + 2)
+                if parsed is None:
+                    break
+                segments, offset = parsed
+                self.apply(self.converter.deserialize(segments[0], segments[1:]))
+                continue
+            if len(buffer) - offset < 2 + length:
+                break
+            self.apply(self.converter.deserialize(buffer[offset + 2:offset + 2 + length]))
+            offset += 2 + length
+        del buffer[:offset]
+
+    def apply(self, batch: Dict):
+        if batch.get("method") != "REPL_BATCH":
+            return
+        for seq, topic, value in batch["entries"]:
+            if value is None: # evicted on the primary
+                self.broker.put_topic(topic, None)
+            else:
+                self.broker.publicate({"method": "PUBLICATE", "args": {"msg": value, "topic": topic}})
+            self.last_seq = seq
+        metrics = self.broker.metrics
+        metrics.observe("replication_lag_us", max(0, time.time_ns() - batch["ts"]) // 1000)
+        metrics.gauge("replication_seq", self.last_seq)
+        metrics.incr("replication_entries", len(batch["entries"]))
+
+    def promote(self):
+        """Stop following the primary and serve as the primary."""
+        if self.sock is not None:
+            self.broker.sel.unregister(self.sock)
+            self.sock.close()
+            self.sock = None
+        self.promoted = True
+        self.broker.metrics.gauge("replication_connected", 0)
+        print(f"primary {self.primary} lost, promoted at seq {self.last_seq}")
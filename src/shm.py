@@ -0,0 +1,240 @@
+"""Shared memory transport for clients on the same host as the broker.
+
+Each direction is a single-producer/single-consumer ring buffer in a
+multiprocessing.shared_memory segment. The socket the client connected
+with stays open only as a doorbell: one byte is sent on it when a ring
+goes from empty to non-empty, so a steady stream of frames costs no
+syscalls at all.
+
+Clients ask for it with a "shm+" address, e.g. "shm+unix:///tmp/broker.sock"."""
+import select
+import socket
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+SHM_PREFIX = "shm+"
+HEADER = 16 # head and tail positions, 8 bytes each
+RING_SIZE = 1 << 20
+
+_created = set() # names of the segments created by this process
+
+
+class Ring:
+    """Byte ring buffer in shared memory, for exactly one writer and one reader.
+
+    head and tail are ever-increasing byte positions; the writer only
+    moves head and the reader only moves tail."""
+
+    def __init__(self, name: str = None, size: int = RING_SIZE, create: bool = False):
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=HEADER + size if create else 0)
+        if create:
+            _created.add(self.shm.name)
+        elif self.shm.name not in _created:
+            # the creator unlinks the segment, don't let this process' tracker do it too
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        if not create and not 0 < size <= self.shm.size - HEADER: # the creator says how big it is
+            self.shm.close()
+            raise ValueError(f"ring size {size} does not fit the {self.shm.size} bytes segment {name}")
+        self.owner = create
+        self.size = size
+        self.buf = self.shm.buf
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _positions(self):
+        return struct.unpack_from("<QQ", self.buf, 0)
+
+    def available(self) -> int:
+        head, tail = self._positions()
+        return head - tail
+
+    def write(self, data) -> (int, bool):
+        """Write as much of data as fits. Returns (bytes written, ring was empty)."""
+        head, tail = self._positions()
+        n = min(len(data), self.size - (head - tail))
+        if n == 0:
+            return 0, head == tail
+        start = head % self.size
+        first = min(n, self.size - start)
+        self.buf[HEADER + start:HEADER + start + first] = data[:first]
+        if n > first:
+            self.buf[HEADER:HEADER + n - first] = data[first:n]
+        struct.pack_into("<Q", self.buf, 0, head + n) # publish only once the bytes are in place
+        # look at tail after publishing: either the reader sees the new head
+        # after consuming, or we see it consumed everything and ring the doorbell
+        tail, = struct.unpack_from("<Q", self.buf, 8)
+        return n, tail == head
+
+    def read(self, limit: int = None) -> bytes:
+        """Read up to limit bytes (everything available by default)."""
+        head, tail = self._positions()
+        n = head - tail if limit is None else min(limit, head - tail)
+        if n == 0:
+            return b""
+        start = tail % self.size
+        first = min(n, self.size - start)
+        data = bytes(self.buf[HEADER + start:HEADER + start + first])
+        if n > first:
+            data += bytes(self.buf[HEADER:HEADER + n - first])
+        struct.pack_into("<Q", self.buf, 8, tail + n)
+        return data
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm.name)
+
+
+class ShmChannel:
+    """Socket look-alike over a pair of rings, with sock as the doorbell.
+
+    Blocking channels (clients) wait on the doorbell when there is nothing
+    to read and for space when the ring is full. Non-blocking channels (the
+    broker) raise BlockingIOError instead, like a non-blocking socket, and
+    read everything available at once so no doorbell can be missed.
+    Doorbells are always drained before the ring is looked at, so a frame
+    never rings twice. The doorbell socket always reports itself writable:
+    while a client's ring is full the broker retries on a timer instead
+    (see Broker.watch)."""
+
+    def __init__(self, sock, rx: Ring, tx: Ring, blocking: bool = True):
+        self.sock = sock
+        self.rx = rx
+        self.tx = tx
+        self.blocking = blocking
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def pending(self) -> int:
+        """Bytes that can be read without waiting."""
+        return self.rx.available()
+
+    def send(self, data) -> int:
+        sent = 0
+        while True:
+            n, was_empty = self.tx.write(data[sent:] if sent else data)
+            sent += n
+            if n and was_empty:
+                self._ring()
+            if sent == len(data):
+                return sent
+            if not self.blocking:
+                if sent == 0:
+                    raise BlockingIOError("ring buffer full")
+                return sent
+            time.sleep(0.0001) # full: wait for the reader
+
+    def sendmsg(self, buffers) -> int:
+        """send() the buffers one after the other, without joining them."""
+        sent = 0
+        for data in buffers:
+            try:
+                n = self.send(data)
+            except BlockingIOError:
+                if sent:
+                    return sent
+                raise
+            sent += n
+            if n < len(data):
+                break
+        return sent
+
+    def sendall(self, data):
+        self.send(data)
+
+    def recv(self, n: int) -> bytes:
+        if not self.blocking:
+            closed = self._drain()
+            data = b""
+            while self.rx.available(): # frames written while reading ring no doorbell
+                data += self.rx.read()
+            if data:
+                return data
+            if closed:
+                return b""
+            raise BlockingIOError("ring buffer empty")
+        while True:
+            closed = self._drain()
+            data = self.rx.read(n)
+            if data:
+                return data
+            if closed or not self.sock.recv(4096): # wait for the doorbell
+                return b""
+
+    def wait(self, timeout: float = None) -> bool:
+        """Whether there is something to read (or the peer closed) within timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._drain() or self.rx.available():
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            select.select([self.sock], [], [], remaining)
+
+    def _drain(self) -> bool:
+        """Consume the doorbells rung so far, without waiting. True if the peer closed."""
+        try:
+            while True:
+                if not self.sock.recv(4096, socket.MSG_DONTWAIT):
+                    return True
+        except BlockingIOError:
+            return False
+
+    def _ring(self):
+        try:
+            self.sock.send(b"\0")
+        except BlockingIOError: # doorbells already pending, the reader will wake up
+            pass
+
+    def close(self):
+        """Close the doorbell and the rings; the side that created them (the client) unlinks them."""
+        self.sock.close()
+        self.rx.close()
+        self.tx.close()
+
+
+def attach(sock, converter, size: int = RING_SIZE) -> ShmChannel:
+    """Client side: create the rings and hand them to the broker over sock."""
+    c2b = Ring(size=size, create=True)
+    b2c = Ring(size=size, create=True)
+    form = converter.msg_format.value.to_bytes(1, byteorder="big")
+    msg = {"method": "SHM_ATTACH", "c2b": c2b.name, "b2c": b2c.name, "size": size}
+    sock.sendall(form + converter.serialize(msg))
+    length = int.from_bytes(_recv_exact(sock, 2), "big")
+    reply = converter.deserialize(_recv_exact(sock, length))
+    if reply.get("method") != "SHM_READY":
+        c2b.close()
+        b2c.close()
+        raise ConnectionError(f"broker refused the shared memory transport: {reply}")
+    return ShmChannel(sock, b2c, c2b, blocking=True)
+
+
+def accept(sock, msg) -> ShmChannel:
+    """Broker side: attach to the rings of a SHM_ATTACH request.
+
+    Raises ValueError if the size asked for is more than the segments hold."""
+    size = int(msg["size"])
+    c2b = Ring(msg["c2b"], size)
+    try:
+        b2c = Ring(msg["b2c"], size)
+    except (OSError, ValueError):
+        c2b.close()
+        raise
+    return ShmChannel(sock, c2b, b2c, blocking=False)
+
+
+def _recv_exact(sock, length: int) -> bytes:
+    data = b""
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError("broker closed the connection")
+        data += chunk
+    return data
@@ -0,0 +1,52 @@
+"""Sorted index of the topics visible through REQ_TOPICS."""
+import bisect
+from typing import List, Optional, Tuple
+
+
+class TopicIndex:
+    """Topics kept in sorted order, updated as they gain or lose their value.
+
+    Topics sharing a string prefix are contiguous, so a page of a prefix
+    query costs a bisect plus the page itself, whatever the tree size."""
+
+    def __init__(self):
+        self._topics = []
+
+    def __len__(self):
+        return len(self._topics)
+
+    def __iter__(self):
+        return iter(list(self._topics))
+
+    def __contains__(self, topic: str) -> bool:
+        i = bisect.bisect_left(self._topics, topic)
+        return i < len(self._topics) and self._topics[i] == topic
+
+    def add(self, topic: str):
+        i = bisect.bisect_left(self._topics, topic)
+        if i == len(self._topics) or self._topics[i] != topic:
+            self._topics.insert(i, topic)
+
+    def discard(self, topic: str):
+        i = bisect.bisect_left(self._topics, topic)
+        if i < len(self._topics) and self._topics[i] == topic:
+            del self._topics[i]
+
+    def page(self, prefix: str = "", cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[List[str], Optional[str]]:
+        """Topics starting with prefix, after cursor, at most limit of them.
+
+        Returns the page and the cursor for the next one (None on the last page)."""
+        if cursor is not None and cursor >= prefix:
+            start = bisect.bisect_right(self._topics, cursor)
+        else:
+            start = bisect.bisect_left(self._topics, prefix)
+        stop = len(self._topics) if limit is None else min(len(self._topics), start + limit)
+        page = []
+        for i in range(start, stop):
+            topic = self._topics[i]
+            if not topic.startswith(prefix):
+                return page, None
+            page.append(topic)
+        if stop < len(self._topics) and self._topics[stop].startswith(prefix):
+            return page, page[-1] if page else None
+        return page, None
@@ -0,0 +1,30 @@
+"""Broker addresses: "host:port" for TCP or "unix:///path" for a Unix domain socket."""
+import asyncio
+import socket
+
+UNIX_SCHEME = "unix://"
+
+
+def connect(address: str, timeout: float = None) -> socket.socket:
+    """Connected socket to the broker at address."""
+    if address.startswith(UNIX_SCHEME):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address[len(UNIX_SCHEME):])
+        sock.settimeout(None)
+        return sock
+    host, port = address.rsplit(":", 1)
+    sock = socket.create_connection((host, int(port)), timeout)
+    sock.settimeout(None)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # frames are written whole, don't hold them back
+    return sock
+
+
+async def open_connection(address: str):
+    """asyncio (reader, writer) streams connected to the broker at address."""
+    if address.startswith(UNIX_SCHEME):
+        return await asyncio.open_unix_connection(address[len(UNIX_SCHEME):])
+    host, port = address.rsplit(":", 1)
+    reader, writer = await asyncio.open_connection(host, int(port))
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return reader, writer
@@ -0,0 +1,318 @@
+"""XML encoding of the broker's messages.
+
+Every value is an element named after its type, so values come back with
+the type they were sent with:
+
+    {"method": "SEND", "data": [1, 2.5, None]}
+    <main><s k="method">SEND</s><l k="data"><i>1</i><f>2.5</f><n/></l></main>
+
+Types: s str, i int, f float, b bool, n None, y bytes (hex), l list or
+tuple, d dict (keys are turned into str, as in JSON), a typed array (its
+dtype, shape and the segment holding its bytes, e.g. <a>f8 3,2 1</a>),
+r list of RUN_MIN or more floats (or 64-bit ints), as the array typecode
+and the hex of the little-endian items (<r>d 000000000000f03f...</r>)."""
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Callable, Dict, List, Sequence
+
+from .arrays import TypedArray
+
+CACHE_SIZE = 4096 # most key attributes / message heads / decoding plans kept
+RUN_MIN = 8 # shorter lists of numbers are written item by item
+PLAN_TAGS = 64 # messages with more elements are always decoded element by element
+
+_keys = {} # dict key -> ' k="key"'
+_heads = {} # method -> '<main><s k="method">METHOD</s>'
+_tags = {} # start tag -> (kind, key, converter, end tag), see _tag()
+_plans = {} # tags of a message -> function building it from the texts, see _plan()
+_seen = set() # tags of the messages decoded once, the second time gets a plan
+
+
+def _escape(text: str) -> str:
+    if "&" in text or "<" in text or ">" in text or '"' in text:
+        text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    return text
+
+
+def _unescape(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace("&amp;", "&")
+    return text
+
+
+def _key(key) -> str:
+    attr = _keys.get(key)
+    if attr is None:
+        attr = f' k="{_escape(str(key))}"'
+        if type(key) is str and len(_keys) < CACHE_SIZE: # 1 == True, don't mix them up
+            _keys[key] = attr
+    return attr
+
+
+_CODES = {float: "d", int: "q"} # array typecodes of the items of r elements
+
+
+def _pack(code: str, items) -> str:
+    items = array(code, items)
+    if sys.byteorder == "big":
+        items.byteswap()
+    return f"{code} {items.tobytes().hex()}"
+
+
+def _unpack(text: str) -> list:
+    code, data = text.split(" ")
+    if code not in "dq":
+        raise ValueError(f"bad r element typecode {code!r}")
+    items = array(code, bytes.fromhex(data))
+    if sys.byteorder == "big":
+        items.byteswap()
+    return items.tolist()
+
+
+def _encode(value, key: str, out: list, buffers: List = None):
+    """Append the element of value, with key attribute key, to out.
+
+    The bytes of typed arrays are appended to buffers."""
+    kind = type(value)
+    if kind is str:
+        out.append(f"<s{key}>{_escape(value)}</s>")
+    elif kind is int:
+        out.append(f"<i{key}>{value}</i>")
+    elif kind is float:
+        out.append(f"<f{key}>{value!r}</f>")
+    elif value is None:
+        out.append(f"<n{key}/>")
+    elif kind is dict:
+        out.append(f"<d{key}>")
+        for k, v in value.items():
+            _encode(v, _key(k), out, buffers)
+        out.append("</d>")
+    elif kind is list or kind is tuple:
+        item = type(value[0]) if value else None
+        if item is float or item is int:
+            if len(value) >= RUN_MIN and set(map(type, value)) == {item}:
+                try:
+                    out.append(f"<r{key}>{_pack(_CODES[item], value)}</r>")
+                    return
+                except OverflowError: # ints beyond 64 bits
+                    pass
+        elif item is str and len(set(map(type, value))) == 1: # all at once
+            out.append(f"<l{key}><s>{'</s><s>'.join(map(_escape, value))}</s></l>")
+            return
+        out.append(f"<l{key}>")
+        for v in value:
+            _encode(v, "", out, buffers)
+        out.append("</l>")
+    elif kind is bool:
+        out.append(f"<b{key}>{int(value)}</b>")
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(f"<y{key}>{bytes(value).hex()}</y>")
+    elif kind is TypedArray and buffers is not None:
+        out.append(f"<a{key}>{value.dtype} {','.join(map(str, value.shape))} {len(buffers)}</a>")
+        buffers.append(value.data)
+    elif isinstance(value, int):
+        _encode(int(value), key, out)
+    elif isinstance(value, float):
+        _encode(float(value), key, out)
+    elif isinstance(value, str):
+        _encode(str(value), key, out)
+    elif isinstance(value, dict):
+        _encode(dict(value), key, out, buffers)
+    elif isinstance(value, (list, tuple)):
+        _encode(list(value), key, out, buffers)
+    else:
+        raise TypeError(f"Object of type {kind.__name__} is not XML serializable")
+
+
+def dumps(msg: Dict, buffers: List = None) -> bytes:
+    """Encode a message (a dict) as XML; the bytes of its typed arrays go to buffers."""
+    method = msg.get("method")
+    head = _heads.get(method)
+    if head is None:
+        head = "<main>"
+        if type(method) is str:
+            head += f'<s k="method">{_escape(method)}</s>'
+            if len(_heads) < CACHE_SIZE:
+                _heads[method] = head
+    out = [head]
+    for key, value in msg.items():
+        if key != "method" or head == "<main>":
+            _encode(value, _key(key), out, buffers)
+    out.append("</main>")
+    return "".join(out).encode("utf-8", errors="replace")
+
+
+def dumps_value(value, key: str, buffers: List = None) -> bytes:
+    """Element of value with key attribute key, to be spliced into a message."""
+    out = []
+    _encode(value, _key(key), out, buffers)
+    return "".join(out).encode("utf-8", errors="replace")
+
+
+def _str(text: str) -> str:
+    return _unescape(text) if "&" in text else text
+
+
+# converter of the text of each kind of element, None for a (it needs the buffers)
+_CONVERTERS = {
+    "s": str, "i": int, "f": float, "b": {"1": True, "0": False}.__getitem__, "y": bytes.fromhex, "r": _unpack,
+    "a": None, "d": dict, "l": list, "n": type(None),
+}
+_LEAVES = "sifbyra" # elements holding text, the others are empty
+
+
+def _fail(detail: str = None):
+    raise ValueError("malformed XML message" + (f" near {detail!r}" if detail else ""))
+
+
+def _entry(kind: str, key: str = None):
+    return kind, key, _CONVERTERS[kind], "/" + kind if kind in _LEAVES else None
+
+
+def _tag(tag: str):
+    """(kind, key, converter, end tag or None) of a start tag, e.g. 'i k="a"' or 'n/'."""
+    entry = _tags.get(tag)
+    if entry is None:
+        kind = tag[:1]
+        body = tag[:-1] if kind == "n" else tag # <n k="a"/>
+        if (kind not in _CONVERTERS or kind == "n" and tag[-1:] != "/" or body[1:5] != ' k="' or len(body) < 6
+                or body[-1] != '"' or '"' in body[5:-1]):
+            _fail(tag)
+        entry = _entry(kind, _str(body[5:-1]))
+        if len(_tags) < CACHE_SIZE:
+            _tags[tag] = entry
+    return entry
+
+
+_tags.update({kind: _entry(kind) for kind in _CONVERTERS if kind != "n"})
+_tags["n/"] = _entry("n")
+_tags["/d"] = _tags["/l"] = ("/", None, None, None)
+
+
+def _array(text: str, buffers: List) -> TypedArray:
+    dtype, shape, segment = text.split(" ")
+    return TypedArray(dtype, [int(n) for n in shape.split(",") if n], buffers[int(segment)])
+
+
+def _parse(tags: Sequence[str], texts: Sequence[str], buffers: List) -> Dict:
+    """Message of the elements with start/end tags tags, each followed by the text in texts.
+
+    Checks every element: anything but the elements dumps() writes, in the
+    order it writes them, raises ValueError."""
+    root = parent = {}
+    stack = [root]
+    keyed = True # parent is a dict
+    pairs = zip(tags, texts)
+    for tag, text in pairs:
+        kind, key, convert, end = _tag(tag)
+        if end is not None:
+            close, tail = next(pairs)
+            if close != end or tail:
+                _fail(close)
+            value = convert(text) if convert is not None else _array(text, buffers)
+        elif text:
+            _fail(text)
+        elif convert is None: # the end of the innermost list or dict
+            if len(stack) == 1 or tag != ("/d" if keyed else "/l"):
+                _fail(tag)
+            stack.pop()
+            parent = stack[-1]
+            keyed = type(parent) is dict
+            continue
+        else:
+            value = convert()
+        if keyed:
+            if key is None:
+                _fail(tag)
+            parent[key] = value
+        elif key is None:
+            parent.append(value)
+        else:
+            _fail(tag)
+        if kind == "d" or kind == "l":
+            stack.append(value)
+            parent = value
+            keyed = kind == "d"
+    if len(stack) != 1:
+        _fail()
+    return root
+
+
+def _plan(tags: Sequence[str]) -> Callable:
+    """plan(texts, buffers) building the messages with these (already checked) tags, like _parse().
+
+    The message is built by a single expression, generated and compiled
+    here, after checking that the texts that must be empty are."""
+    names = {"s": "", "i": "int", "f": "float", "b": "_bool", "y": "_hex", "r": "_unpack"}
+    out = []
+    empty = [] # indices of the texts that must be empty
+    last = "{" # what precedes the next value: no comma after an opening bracket
+    i = 0
+    while i < len(tags):
+        kind, key, _, end = _tag(tags[i])
+        if kind == "/":
+            out.append("}" if tags[i] == "/d" else "]")
+            empty.append(i)
+            last = "}"
+            i += 1
+            continue
+        if last != "{":
+            out.append(",")
+        if key is not None:
+            out.append(f"{key!r}:")
+        if end is not None:
+            out.append(f"_array(t[{i}], buffers)" if kind == "a" else f"{names[kind]}(t[{i}])")
+            empty.append(i + 1)
+            last = ","
+            i += 2
+        else:
+            out.append("None" if kind == "n" else "{" if kind == "d" else "[")
+            empty.append(i)
+            last = "," if kind == "n" else "{"
+            i += 1
+    check = " or ".join(f"t[{i}]" for i in empty) or "False"
+    source = f"def plan(t, buffers):\n    if {check}:\n        _fail()\n    return {{{''.join(out)}}}\n"
+    namespace = {
+        "_array": _array, "_fail": _fail, "_bool": _CONVERTERS["b"], "_hex": bytes.fromhex, "_unpack": _unpack,
+    }
+    exec(source, namespace)
+    return namespace["plan"]
+
+
+def loads(data: bytes, buffers: List = None) -> Dict:
+    """Decode a message encoded by dumps(), with buffers the segments of its typed arrays.
+
+    Anything but the elements dumps() writes, in the order it writes them,
+    raises ValueError. The first message with a given sequence of elements
+    is checked and decoded element by element, the next ones by a plan
+    compiled for it (see _plan). Messages in the older attribute form
+    (<main key="value" .../>, every value a str) are still understood."""
+    text = data.decode("utf-8") if not isinstance(data, str) else data
+    if not (text.startswith("<main>") and text.endswith("</main>")):
+        root = ET.fromstring(data)
+        return root.attrib if root.tag == "main" else None
+    # tags and the text after each of them: <i k="a">1</i> -> '', 'i k="a"', '1', '/i', ''
+    parts = text[6:-7].replace(">", "<").split("<")
+    if parts[0] or not len(parts) & 1:
+        _fail(parts[0])
+    tags = parts[1::2]
+    texts = parts[2::2]
+    if "&" in text:
+        texts = [_str(text) for text in texts]
+    try:
+        if len(tags) > PLAN_TAGS:
+            return _parse(tags, texts, buffers)
+        tags = tuple(tags)
+        plan = _plans.get(tags)
+        if plan is not None:
+            return plan(texts, buffers)
+        root = _parse(tags, texts, buffers)
+        if tags in _seen:
+            if len(_plans) < CACHE_SIZE:
+                _plans[tags] = _plan(tags)
+        elif len(_seen) < CACHE_SIZE:
+            _seen.add(tags)
+        return root
+    except (IndexError, KeyError, TypeError, StopIteration) as err:
+        raise ValueError("malformed XML message") from err
@@ -0,0 +1,272 @@
+"""Throughput and latency benchmark.
+
+Launches a broker in a subprocess, drives it with open-loop producers at a
+target rate and reports delivered msgs/s, MB/s and latency percentiles as
+JSON. Run from the repository root:
+
+    python -m tests.bench --producers 2 --consumers 4 --topics 8 --fanout 2 --rate 2000
+    python -m tests.bench ... --save-baseline tests/bench_baseline.json
+    python -m tests.bench ... --baseline tests/bench_baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import selectors
+import subprocess
+import sys
+import time
+
+from src.clients import Schedule, wait_until
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
+from src.shm import SHM_PREFIX
+from src.transport import connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+q_protocol = {
+    "json": JSONQueue,
+    "xml": XMLQueue,
+    "pickle": PickleQueue,
+}
+
+
+def start_broker(port, broker_args=(), address=None):
+    """Start broker.py on port and wait until it accepts connections on address."""
+    proc = subprocess.Popen(
+        [sys.executable, "broker.py", "--port", str(port), *broker_args],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            connect(address or f"localhost:{port}", timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"broker did not start on port {port}")
+
+
+def percentiles(samples):
+    """p50/p90/p99/p999/max of a list of latencies, in microseconds."""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+    return {
+        "p50": pick(50),
+        "p90": pick(90),
+        "p99": pick(99),
+        "p999": pick(99.9),
+        "max": samples[-1],
+    }
+
+
+def consumer_main(address, topics, queue_type, deadline, results):
+    """Receive from every topic until deadline, reporting counts and latencies."""
+    sys.stdout = open(os.devnull, "w")
+    sel = selectors.DefaultSelector()
+    for topic in topics:
+        queue = q_protocol[queue_type](topic, MiddlewareType.CONSUMER, address=address)
+        sel.register(queue.sckt, selectors.EVENT_READ, queue)
+    received = 0
+    nbytes = 0
+    latencies = []
+    while time.time() < deadline:
+        for key, _ in sel.select(timeout=0.1):
+            while True:
+                _, data = key.data.pull()
+                now = time.time_ns()
+                sent, payload = data
+                received += 1
+                nbytes += len(payload)
+                latencies.append((now - sent) // 1000)
+                if not buffered(key.data):
+                    break
+    for key in list(sel.get_map().values()):
+        key.data.close()
+    results.put({"received": received, "bytes": nbytes, "latencies": latencies})
+
+
+def buffered(queue) -> bool:
+    """Whether queue has frames that its socket will not signal again (shared memory)."""
+    pending = getattr(queue.sckt, "pending", None)
+    return pending is not None and pending() > 0
+
+
+def producer_main(address, topics, queue_type, rate, duration, size, arrival, results):
+    """Publish round-robin over topics at rate msgs/s for duration seconds.
+
+    Open loop: send times follow the schedule no matter how long a push takes,
+    and latency is measured from the scheduled time, so a stalled broker shows
+    up as latency instead of silently lowering the offered load."""
+    sys.stdout = open(os.devnull, "w")
+    queues = [q_protocol[queue_type](topic, MiddlewareType.PRODUCER, address=address) for topic in topics]
+    payload = "x" * size
+    start = time.monotonic()
+    wall_offset = time.time() - start # schedule is on the monotonic clock, latency on the wall clock
+    sent = 0
+    for when in Schedule(rate, arrival):
+        if when >= start + duration:
+            break
+        wait_until(when)
+        queues[sent % len(queues)].push([int((when + wall_offset) * 1e9), payload])
+        sent += 1
+    for queue in queues:
+        queue.close()
+    results.put({"sent": sent, "elapsed": time.monotonic() - start})
+
+
+def collect(results, count, timeout):
+    """Reports of count clients, read before joining them so that big reports
+    do not block their exit. A client that crashed reports nothing."""
+    reports = []
+    deadline = time.monotonic() + timeout
+    for _ in range(count):
+        try:
+            reports.append(results.get(timeout=max(0, deadline - time.monotonic())))
+        except queue.Empty:
+            print("some clients did not report", file=sys.stderr)
+            break
+    return reports
+
+
+def run(args):
+    if args.transport in ("unix", "shm"):
+        path = f"/tmp/broker-bench-{args.port}.sock"
+        address = "unix://" + path
+        broker = start_broker(args.port, ["--unix", path], address)
+        if args.transport == "shm":
+            address = SHM_PREFIX + address
+    else:
+        address = f"localhost:{args.port}"
+        broker = start_broker(args.port)
+    try:
+        topics = [f"/bench/{i}" for i in range(args.topics)]
+        formats = args.formats.split(",")
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+
+        # topic i is subscribed by `fanout` consumers, spread round-robin
+        subscriptions = [[] for _ in range(args.consumers)]
+        for i, topic in enumerate(topics):
+            for k in range(args.fanout):
+                subscriptions[(i * args.fanout + k) % args.consumers].append(topic)
+
+        deadline = time.time() + args.duration + args.warmup + 2
+        consumers = [
+            ctx.Process(
+                target=consumer_main,
+                args=(address, subscriptions[c], formats[c % len(formats)], deadline, results),
+            )
+            for c in range(args.consumers)
+            if subscriptions[c]
+        ]
+        for proc in consumers:
+            proc.start()
+        time.sleep(args.warmup) # let every consumer subscribe
+
+        producers = [
+            ctx.Process(
+                target=producer_main,
+                args=(
+                    address,
+                    topics[p::args.producers] or topics,
+                    formats[p % len(formats)],
+                    args.rate / args.producers,
+                    args.duration,
+                    args.size,
+                    args.arrival,
+                    results,
+                ),
+            )
+            for p in range(args.producers)
+        ]
+        for proc in producers:
+            proc.start()
+        reports = collect(results, len(producers + consumers), args.duration + args.warmup + 30)
+        for proc in producers + consumers:
+            proc.join()
+    finally:
+        broker.terminate()
+        broker.wait()
+
+    sent = sum(r.get("sent", 0) for r in reports)
+    received = sum(r.get("received", 0) for r in reports)
+    nbytes = sum(r.get("bytes", 0) for r in reports)
+    latencies = [lat for r in reports for lat in r.get("latencies", [])]
+    return {
+        "config": {
+            "transport": args.transport,
+            "producers": args.producers,
+            "consumers": args.consumers,
+            "formats": args.formats,
+            "topics": args.topics,
+            "fanout": args.fanout,
+            "size": args.size,
+            "rate": args.rate,
+            "arrival": args.arrival,
+            "duration": args.duration,
+        },
+        "sent": sent,
+        "received": received,
+        "expected": sent * args.fanout,
+        "offered_msgs_s": round(sent / args.duration, 1),
+        "msgs_s": round(received / args.duration, 1),
+        "mb_s": round(nbytes / args.duration / 1e6, 3),
+        "latency_us": percentiles(latencies),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """List the metrics that regressed by more than tolerance (a fraction)."""
+    regressions = []
+    if result["msgs_s"] < baseline["msgs_s"] * (1 - tolerance):
+        regressions.append(f"msgs_s {result['msgs_s']} < baseline {baseline['msgs_s']}")
+    for key in ("p50", "p99"):
+        new = result["latency_us"].get(key)
+        old = baseline["latency_us"].get(key)
+        if new is not None and old and new > old * (1 + tolerance):
+            regressions.append(f"latency {key} {new}us > baseline {old}us")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="port for the benchmarked broker", type=int, default=5100)
+    parser.add_argument("--transport", help="how clients reach the broker", choices=["tcp", "unix", "shm"], default="tcp")
+    parser.add_argument("--producers", type=int, default=1)
+    parser.add_argument("--consumers", type=int, default=1)
+    parser.add_argument(
+        "--formats",
+        help="comma separated serializer mix, assigned round-robin to clients",
+        default="pickle",
+    )
+    parser.add_argument("--size", help="payload size in bytes", type=int, default=64)
+    parser.add_argument("--topics", type=int, default=1)
+    parser.add_argument("--fanout", help="consumers per topic", type=int, default=1)
+    parser.add_argument("--rate", help="target publish rate (msgs/s, all producers)", type=float, default=1000)
+    parser.add_argument("--arrival", choices=["constant", "poisson"], default="constant")
+    parser.add_argument("--duration", help="seconds of load", type=float, default=5)
+    parser.add_argument("--warmup", help="seconds to wait for subscriptions", type=float, default=1)
+    parser.add_argument("--baseline", help="JSON result to compare against", default=None)
+    parser.add_argument("--save-baseline", help="store the result as a baseline", default=None)
+    parser.add_argument("--tolerance", help="allowed regression, as a fraction", type=float, default=0.1)
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(result, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(result, json.load(fp), args.tolerance)
+        for line in regressions:
+            print("REGRESSION:", line, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,78 @@
+"""Throughput and latency across a federation bridge.
+
+Starts two brokers in subprocesses, links them with a bridge running in
+this process, publishes on the first and consumes on the second. Run from
+the repository root:
+
+    python -m tests.bench_bridge --rate 5000 --topics 4 --batch 64
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+from src.bridge import Bridge
+from tests.bench import collect, consumer_main, percentiles, producer_main, start_broker
+
+
+def run(args):
+    a = f"localhost:{args.port}"
+    b = f"localhost:{args.port + 1}"
+    brokers = [start_broker(args.port), start_broker(args.port + 1)]
+    bridge = Bridge()
+    bridge.link(a, b, ["/bench"], batch=args.batch, linger=args.linger)
+    try:
+        bridge.start()
+        bridge.wait_connected(5)
+        topics = [f"/bench/{i}" for i in range(args.topics)]
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue()
+
+        deadline = time.time() + args.duration + args.warmup + 2
+        consumer = ctx.Process(target=consumer_main, args=(b, topics, args.format, deadline, results))
+        consumer.start()
+        time.sleep(args.warmup)
+        producer = ctx.Process(
+            target=producer_main,
+            args=(a, topics, args.format, args.rate, args.duration, args.size, "constant", results),
+        )
+        producer.start()
+        reports = collect(results, 2, args.duration + args.warmup + 30)
+        producer.join()
+        consumer.join()
+    finally:
+        bridge.cancel()
+        for broker in brokers:
+            broker.terminate()
+            broker.wait()
+
+    sent = sum(r.get("sent", 0) for r in reports)
+    received = sum(r.get("received", 0) for r in reports)
+    nbytes = sum(r.get("bytes", 0) for r in reports)
+    latencies = [lat for r in reports for lat in r.get("latencies", [])]
+    return {
+        "config": {"rate": args.rate, "topics": args.topics, "size": args.size, "batch": args.batch,
+                   "linger": args.linger, "format": args.format, "duration": args.duration},
+        "sent": sent,
+        "received": received,
+        "msgs_s": round(received / args.duration, 1),
+        "mb_s": round(nbytes / args.duration / 1e6, 3),
+        "latency_us": percentiles(latencies),
+        "bridge": bridge.stats(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="first of the two broker ports", type=int, default=5110)
+    parser.add_argument("--format", choices=["json", "pickle"], default="pickle")
+    parser.add_argument("--size", help="payload size in bytes", type=int, default=64)
+    parser.add_argument("--topics", type=int, default=1)
+    parser.add_argument("--rate", help="target publish rate (msgs/s)", type=float, default=2000)
+    parser.add_argument("--duration", help="seconds of load", type=float, default=5)
+    parser.add_argument("--warmup", help="seconds to wait for subscriptions", type=float, default=1)
+    parser.add_argument("--batch", help="bridge batch size", type=int, default=64)
+    parser.add_argument("--linger", help="bridge batch linger (s)", type=float, default=0.005)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args), indent=2))
@@ -0,0 +1,135 @@
+"""Microbenchmark of Converter.serialize/deserialize for every Serializer.
+
+XML_ET rows time the ElementTree codec XML messages used to go through,
+for comparison with the XML rows.
+
+Prints one row per (format, payload, operation) with ns/op, bytes
+allocated per op (tracemalloc peak) and encoded size. Rows are sorted and
+numbers rounded so that two runs can be diffed. Run from the repository root:
+
+    python -m tests.bench_converter > before.txt
+    python -m tests.bench_converter > after.txt && diff before.txt after.txt
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from src.broker import Converter, Serializer
+
+random.seed(0)
+
+PAYLOADS = {
+    "int": 12345,
+    "short_str": "Ó mar salgado, quanto do teu sal",
+    "nested_dict": {
+        "station": "aveiro",
+        "readings": {"temperature": {"celsius": 21, "fahrenheit": 70}, "humidity": 63},
+        "tags": ["coast", "north"],
+    },
+    "float_list": [random.random() for _ in range(100)],
+    "blob_60k": bytes(random.getrandbits(8) for _ in range(60 * 1024)),
+}
+
+
+class LegacyXMLConverter:
+    """Previous XML codec: one attribute per key, every value turned into a str."""
+
+    def serialize(self, msg):
+        body = ET.tostring(ET.Element("main", attrib={str(key): str(val) for key, val in msg.items()}))
+        return len(body).to_bytes(2, byteorder="big") + body
+
+    def deserialize(self, msg):
+        return ET.fromstring(msg).attrib
+
+
+def envelope(payload, fmt: Serializer):
+    # JSON has no bytes type, it gets the blob as text
+    if isinstance(payload, bytes) and fmt == Serializer.JSON:
+        payload = payload.hex()[: len(payload)]
+    return {"method": "SEND", "data": payload}
+
+
+def ns_per_op(func, min_time: float) -> float:
+    """Time func, growing the loop count until a run takes min_time seconds."""
+    loops = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9:
+            return elapsed / loops
+        loops *= 2
+
+
+def allocated(func) -> int:
+    """Peak bytes allocated by one call of func."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+def round_sig(value: float, digits: int = 3) -> int:
+    """Round to a few significant digits so noise does not show up in diffs."""
+    if value <= 0:
+        return 0
+    return int(float(f"{value:.{digits}g}"))
+
+
+def run(min_time: float):
+    rows = []
+    converters = [(fmt.name, fmt, Converter(fmt)) for fmt in Serializer]
+    converters.append(("XML_ET", Serializer.XML, LegacyXMLConverter()))
+    for fmt_name, fmt, conv in converters:
+        for name, payload in PAYLOADS.items():
+            msg = envelope(payload, fmt)
+            try:
+                encoded = conv.serialize(msg)
+            except Exception as err: # format cannot carry this payload
+                rows.append({"format": fmt_name, "payload": name, "op": "serialize", "error": type(err).__name__})
+                continue
+            body = encoded[2:]
+            for op, func in (
+                ("serialize", lambda: conv.serialize(msg)),
+                ("deserialize", lambda: conv.deserialize(body)),
+            ):
+                rows.append({
+                    "format": fmt_name,
+                    "payload": name,
+                    "op": op,
+                    "ns_op": round_sig(ns_per_op(func, min_time)),
+                    "alloc_bytes": round_sig(allocated(func)),
+                    "out_bytes": len(encoded),
+                })
+    return sorted(rows, key=lambda r: (r["payload"], r["op"], r["format"]))
+
+
+def table(rows) -> str:
+    header = f"{'payload':<12} {'op':<12} {'format':<7} {'ns/op':>10} {'alloc B':>10} {'out B':>8}"
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        if "error" in r:
+            lines.append(f"{r['payload']:<12} {r['op']:<12} {r['format']:<7} {r['error']:>10}")
+        else:
+            lines.append(
+                f"{r['payload']:<12} {r['op']:<12} {r['format']:<7} "
+                f"{r['ns_op']:>10} {r['alloc_bytes']:>10} {r['out_bytes']:>8}"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--min-time", help="seconds spent timing each row", type=float, default=0.2)
+    parser.add_argument("--json", help="print JSON instead of a table", action="store_true")
+    args = parser.parse_args()
+
+    rows = run(args.min_time)
+    print(json.dumps(rows, indent=2) if args.json else table(rows))
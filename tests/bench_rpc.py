@@ -0,0 +1,122 @@
+"""Round-trip latency of REQUEST/REPLY calls against request/reply emulated with pub/sub.
+
+Starts a broker in a subprocess and a responder process for each mode,
+then times sequential round trips (and, with --threads, concurrent calls
+sharing one connection). Run from the repository root:
+
+    python -m tests.bench_rpc --calls 5000 --threads 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from src.clients import Responder
+from src.middleware import MiddlewareType
+from tests.bench import percentiles, q_protocol, start_broker
+
+REQUESTS = "/bench/emulated/requests"
+REPLIES = "/bench/emulated/replies"
+
+
+def rpc_responder(address, queue_type):
+    sys.stdout = open(os.devnull, "w")
+    Responder("/bench/rpc", lambda topic, payload: payload, q_protocol[queue_type], address=address).run()
+
+
+def emulated_responder(address, queue_type):
+    """Consume requests on one topic and publish each reply on the topic named in the request."""
+    sys.stdout = open(os.devnull, "w")
+    requests = q_protocol[queue_type](REQUESTS, MiddlewareType.CONSUMER, address=address)
+    replies = q_protocol[queue_type](REPLIES, MiddlewareType.PRODUCER, address=address)
+    while True:
+        _, request = requests.pull()
+        if request is not None: # the retained request, on subscribing
+            replies.push(request["data"], request["reply_to"])
+
+
+def time_calls(call, count):
+    """Latencies (us) of count sequential calls."""
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter_ns()
+        call(i)
+        latencies.append((time.perf_counter_ns() - start) // 1000)
+    return latencies
+
+
+def run(args):
+    address = f"localhost:{args.port}"
+    broker = start_broker(args.port)
+    ctx = multiprocessing.get_context("spawn")
+    responders = [
+        ctx.Process(target=rpc_responder, args=(address, args.format), daemon=True),
+        ctx.Process(target=emulated_responder, args=(address, args.format), daemon=True),
+    ]
+    try:
+        for proc in responders:
+            proc.start()
+        time.sleep(args.warmup)
+        queue_type = q_protocol[args.format]
+        payload = "x" * args.size
+
+        client = queue_type("/bench/rpc", MiddlewareType.PRODUCER, address=address)
+        call = lambda i: client.call("/bench/rpc", payload, timeout=5)
+        time_calls(call, min(100, args.calls)) # warm up
+        rpc = time_calls(call, args.calls)
+
+        reply_topic = f"{REPLIES}/{os.getpid()}"
+        inbox = queue_type(reply_topic, MiddlewareType.CONSUMER, address=address)
+        outbox = queue_type(REQUESTS, MiddlewareType.PRODUCER, address=address)
+
+        def emulated_call(i):
+            outbox.push({"reply_to": reply_topic, "data": payload})
+            inbox.pull()
+
+        time_calls(emulated_call, min(100, args.calls))
+        emulated = time_calls(emulated_call, args.calls)
+
+        concurrent = []
+        if args.threads > 1:
+            per_thread = args.calls // args.threads
+            threads = [
+                threading.Thread(target=lambda: concurrent.extend(time_calls(call, per_thread)))
+                for _ in range(args.threads)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+    finally:
+        for proc in responders:
+            proc.terminate()
+        broker.terminate()
+        broker.wait()
+
+    result = {
+        "config": {"calls": args.calls, "size": args.size, "format": args.format, "threads": args.threads},
+        "rpc_us": percentiles(rpc),
+        "emulated_us": percentiles(emulated),
+    }
+    if concurrent:
+        result["concurrent_us"] = percentiles(concurrent)
+        result["concurrent_calls_s"] = round(len(concurrent) / elapsed, 1)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", help="port for the benchmarked broker", type=int, default=5120)
+    parser.add_argument("--format", choices=list(q_protocol), default="pickle")
+    parser.add_argument("--size", help="payload size in bytes", type=int, default=64)
+    parser.add_argument("--calls", help="round trips per mode", type=int, default=2000)
+    parser.add_argument("--threads", help="threads sharing one connection for the concurrent run", type=int, default=1)
+    parser.add_argument("--warmup", help="seconds to let the responders start", type=float, default=1)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args), indent=2))
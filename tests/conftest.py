@@ -1,3 +1,5 @@
+import os
+import socket
 import threading
 import time
 
@@ -6,13 +8,49 @@ import pytest
 from src.broker import Broker
 
 
-@pytest.fixture(scope="session")
-def broker():
-    broker = Broker()
-
+def _start(port: int = 5000, **kwargs):
+    broker = Broker(port=port, **kwargs)
     thread = threading.Thread(target=broker.run, daemon=True)
     thread.start()
-    time.sleep(1)
-    yield broker
+    return broker, thread
+
+
+def _stop(broker: Broker, thread: threading.Thread):
     broker.canceled = True
+    try: # wake the loop up from select(), it only checks canceled between events
+        socket.create_connection((broker.host, broker.port), timeout=1).close()
+    except OSError:
+        pass
     thread.join(timeout=5)
+    broker.sock.close()
+    if broker.unix_sock is not None:
+        path = broker.unix_sock.getsockname()
+        broker.unix_sock.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+@pytest.fixture(scope="session")
+def broker():
+    broker, thread = _start()
+    time.sleep(1)
+    yield broker
+    _stop(broker, thread)
+
+
+@pytest.fixture(scope="module")
+def start_broker():
+    """start_broker(port, **kwargs) runs an own Broker, stopped once the module's tests are done.
+
+    For tests changing the broker's settings, or whose topics must not show
+    up in the session broker (test_basic lists them)."""
+    started = []
+
+    def start(port: int, **kwargs) -> Broker:
+        broker, thread = _start(port, **kwargs)
+        started.append((broker, thread))
+        return broker
+
+    yield start
+    for broker, thread in started:
+        _stop(broker, thread)
@@ -0,0 +1,69 @@
+"""Test typed array payloads."""
+import array
+
+import pytest
+
+from src.arrays import TypedArray, pack, unpack
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
+
+ADDRESS = "localhost:5403"
+
+
+@pytest.fixture(scope="module")
+def array_broker(start_broker):
+    """Own broker, the session one must only hold the topics of test_basic when it runs."""
+    return start_broker(5403)
+
+
+def test_pack():
+    values = array.array("h", [1, -2, 3])
+    packed = pack({"ts": 1, "values": values})
+    assert packed["values"] == TypedArray("i2", (3,), b"\x01\x00\xfe\xff\x03\x00")
+    assert unpack(packed)["values"].tolist() == [1, -2, 3]
+
+    plain = {"ts": 1, "values": [1, 2]}
+    assert pack(plain) is plain
+
+
+@pytest.mark.parametrize("producer_type", [JSONQueue, XMLQueue, PickleQueue])
+def test_relay(array_broker, producer_type):
+    topic = "/arrays/" + producer_type.__name__
+    consumers = [queue(topic, MiddlewareType.CONSUMER, address=ADDRESS) for queue in (JSONQueue, XMLQueue, PickleQueue)]
+    producer = producer_type(topic, MiddlewareType.PRODUCER, address=ADDRESS)
+    readings = array.array("d", [0.5 * i for i in range(20000)]) # bigger than a plain frame
+
+    producer.push({"station": "aveiro", "readings": readings})
+    for consumer in consumers:
+        _, data = consumer.pull()
+        assert data["station"] == "aveiro"
+        assert list(data["readings"]) == readings.tolist()
+
+    assert array_broker.get_topic(topic)["readings"].dtype == "f8" # relayed, not decoded
+
+
+def test_numpy(array_broker):
+    numpy = pytest.importorskip("numpy")
+    consumer = PickleQueue("/arrays/numpy", MiddlewareType.CONSUMER, address=ADDRESS)
+    producer = JSONQueue("/arrays/numpy", MiddlewareType.PRODUCER, address=ADDRESS)
+    matrix = numpy.arange(12, dtype=">i4").reshape(3, 4)
+
+    producer.push(matrix)
+    _, data = consumer.pull()
+    assert data.dtype == numpy.dtype("<i4") and data.shape == (3, 4)
+    assert (data == matrix).all()
+
+
+def test_snapshot_and_trace(array_broker):
+    readings = array.array("i", [1, 2, 3])
+    producer = JSONQueue("/arrays/snap/a", MiddlewareType.PRODUCER, address=ADDRESS, trace=True)
+    producer.push(readings)
+    consumer = JSONQueue("/arrays/snap", MiddlewareType.CONSUMER, address=ADDRESS, snapshot=True)
+    _, values = consumer.pull()
+    assert list(values["/arrays/snap/a"]) == [1, 2, 3]
+
+    traced = PickleQueue("/arrays/snap/a", MiddlewareType.CONSUMER, address=ADDRESS)
+    traced.pull() # the retained value
+    producer.push(readings)
+    _, data = traced.pull()
+    assert type(data) is not TypedArray and list(data) == [1, 2, 3]
+    assert "/arrays/snap/a" in traced.latency()
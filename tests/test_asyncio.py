@@ -0,0 +1,76 @@
+"""Test the asyncio queues."""
+import asyncio
+
+import pytest
+
+from src.middleware import (
+    AsyncJSONQueue, AsyncPickleQueue, AsyncXMLQueue, MiddlewareType, PickleQueue,
+)
+
+ADDRESS = "localhost:5405"
+
+
+@pytest.fixture(scope="module")
+def async_broker(start_broker):
+    return start_broker(5405)
+
+
+def test_many_subscriptions(async_broker):
+    async def main():
+        topics = [f"/async/{i}" for i in range(20)]
+        queue_types = [AsyncJSONQueue, AsyncXMLQueue, AsyncPickleQueue]
+        consumers = await asyncio.gather(*(
+            queue_types[i % 3].create(topic, MiddlewareType.CONSUMER, address=ADDRESS)
+            for i, topic in enumerate(topics)
+        ))
+        producer = await AsyncPickleQueue.create("/async", MiddlewareType.PRODUCER, address=ADDRESS)
+        await asyncio.sleep(0.1)
+
+        async def consume(queue):
+            received = []
+            async for topic, data in queue:
+                received.append(data)
+                if len(received) == 3:
+                    break
+            return topic, received
+
+        tasks = [asyncio.create_task(consume(queue)) for queue in consumers]
+        for n in range(3):
+            for topic in topics:
+                await producer.push({"n": n, "topic": topic}, topic)
+        results = await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        for (topic, received), expected in zip(results, topics):
+            assert topic == expected
+            assert received == [{"n": n, "topic": expected} for n in range(3)]
+        for queue in consumers + [producer]:
+            await queue.close()
+
+    asyncio.run(main())
+
+
+def test_same_wire_protocol(async_broker):
+    """Sync producers and async consumers talk to each other, requests included."""
+    async def main():
+        async with AsyncJSONQueue("/wire/async", MiddlewareType.CONSUMER, address=ADDRESS) as queue:
+            await asyncio.sleep(0.1)
+            producer = PickleQueue("/wire/async", MiddlewareType.PRODUCER, address=ADDRESS)
+            producer.push([1, "two", None])
+            assert await asyncio.wait_for(queue.pull(), 5) == ("/wire/async", [1, "two", None])
+
+            await queue.list_topics(None, prefix="/wire/")
+            assert await asyncio.wait_for(queue.pull(), 5) == ["/wire/async"]
+
+    asyncio.run(main())
+
+
+def test_closed_by_broker(async_broker):
+    async def main():
+        queue = await AsyncJSONQueue.create("/closed", MiddlewareType.CONSUMER, address=ADDRESS, reconnect=False)
+        await asyncio.sleep(0.1)
+        for conn in [key.fileobj for key in async_broker.sel.get_map().values() if key.data == async_broker.read]:
+            if conn.getpeername() == queue.sckt.getsockname():
+                conn.shutdown(2)
+        assert [item async for item in queue] == []
+        await queue.close()
+
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Test columnar batches."""
+import array
+import time
+
+import pytest
+
+from src.clients import BatchProducer
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
+
+ADDRESS = "localhost:5404"
+
+FIELDS = ["temperature/celsius", "temperature/fahrenheit", "humidity", "pressure"]
+
+
+@pytest.fixture(scope="module")
+def batch_broker(start_broker):
+    return start_broker(5404)
+
+
+@pytest.mark.parametrize("queue_type", [JSONQueue, XMLQueue, PickleQueue])
+def test_fan_out(batch_broker, queue_type):
+    base = "/batch/" + queue_type.__name__
+    whole = queue_type(base, MiddlewareType.CONSUMER, address=ADDRESS)
+    temperature = queue_type(base + "/temperature", MiddlewareType.CONSUMER, address=ADDRESS)
+    humidity = queue_type(base + "/humidity", MiddlewareType.CONSUMER, address=ADDRESS)
+    time.sleep(0.1)
+
+    producer = queue_type(base, MiddlewareType.PRODUCER, address=ADDRESS)
+    ts = array.array("q", [1000 + i for i in range(500)])
+    columns = {field: array.array("d", [n + 0.5 * i for i in range(500)]) for n, field in enumerate(FIELDS)}
+    producer.push_batch(ts, columns)
+
+    _, data = whole.pull()
+    assert list(data["ts"]) == ts.tolist()
+    assert sorted(data["columns"]) == sorted(FIELDS)
+
+    _, data = temperature.pull()
+    assert sorted(data["columns"]) == ["temperature/celsius", "temperature/fahrenheit"]
+    assert list(data["columns"]["temperature/fahrenheit"]) == columns["temperature/fahrenheit"].tolist()
+
+    _, data = humidity.pull()
+    assert list(data["ts"]) == ts.tolist()
+    assert list(data["columns"]) == ["humidity"]
+
+    # every field retains its last sample
+    assert batch_broker.get_topic(base + "/humidity") == columns["humidity"][-1]
+    assert batch_broker.get_topic(base + "/temperature/celsius") == columns["temperature/celsius"][-1]
+    assert batch_broker.get_topic(base) is None
+
+
+def test_plain_columns(batch_broker):
+    consumer = JSONQueue("/plain/pressure", MiddlewareType.CONSUMER, address=ADDRESS)
+    time.sleep(0.1)
+    producer = JSONQueue("/plain", MiddlewareType.PRODUCER, address=ADDRESS)
+
+    producer.push_batch([1, 2], {"pressure": [10000, 10001], "humidity": [50, 51]})
+    _, data = consumer.pull()
+    assert data == {"ts": [1, 2], "columns": {"pressure": [10000, 10001]}}
+    assert batch_broker.get_topic("/plain/humidity") == 51
+
+
+def test_batch_producer(batch_broker):
+    consumer = PickleQueue("/station/humidity", MiddlewareType.CONSUMER, address=ADDRESS)
+    time.sleep(0.1)
+    producer = BatchProducer("/station", ["temperature", "humidity"], lambda: iter([21, 0.5]), address=ADDRESS)
+
+    producer.run(events=2, size=10)
+    for _ in range(2):
+        _, data = consumer.pull()
+        assert list(data["columns"]["humidity"]) == [0.5] * 10
+        assert len(data["ts"]) == 10
+    assert batch_broker.get_topic("/station/temperature") == 21
@@ -0,0 +1,87 @@
+"""Test the federation bridge between brokers."""
+import random
+import threading
+import time
+
+import pytest
+
+from src.bridge import Bridge
+from src.clients import Consumer, Producer
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+
+
+def gen():
+    while True:
+        yield random.randint(0, 100)
+
+
+@pytest.fixture(scope="module")
+def sites(start_broker):
+    for port in (5201, 5202, 5203):
+        start_broker(port)
+    return ["localhost:5201", "localhost:5202", "localhost:5203"]
+
+
+def test_mirror(sites):
+    a, b, _ = sites
+    bridge = Bridge()
+    bridge.mirror(a, b, ["/fed"])
+    bridge.start()
+    assert bridge.wait_connected(5)
+    time.sleep(0.1) # let the brokers register the bridge subscriptions
+
+    consumer_a = Consumer("/fed", PickleQueue, address=a)
+    consumer_b = Consumer("/fed", JSONQueue, address=b)
+    local_b = Consumer("/local", PickleQueue, address=b)
+
+    Producer("/fed/x", gen, PickleQueue, address=a).run(3)
+    Producer("/fed/y", gen, JSONQueue, address=b).run(2)
+    Producer("/local", gen, PickleQueue, address=a).run(1)
+    time.sleep(0.2)
+
+    threading.Thread(target=consumer_a.run, args=(5,), daemon=True).start()
+    threading.Thread(target=consumer_b.run, args=(5,), daemon=True).start()
+    time.sleep(0.2)
+
+    assert len(consumer_a.received) == 5
+    assert sorted(consumer_a.received) == sorted(consumer_b.received)
+    assert local_b.received == []
+    stats = bridge.stats()
+    assert sum(link["forwarded"] for link in stats) == 5
+    assert sum(link["dropped"] for link in stats) == 5 # each publish came back once
+    bridge.cancel()
+
+
+def test_ring(sites):
+    a, b, c = sites
+    bridge = Bridge()
+    bridge.link(a, b, ["/ring"])
+    bridge.link(b, c, ["/ring"])
+    bridge.link(c, a, ["/ring"])
+    bridge.start()
+    assert bridge.wait_connected(5)
+    time.sleep(0.1) # let the brokers register the bridge subscriptions
+
+    consumer_c = Consumer("/ring", PickleQueue, address=c)
+    producer = Producer("/ring/x", gen, PickleQueue, address=a)
+    producer.run(1)
+    consumer_c.run(1)
+    time.sleep(0.2)
+
+    assert consumer_c.received == producer.produced
+    assert [link["forwarded"] for link in bridge.stats()] == [1, 1, 0]
+    bridge.cancel()
+
+
+def test_unencodable_for_link(sites):
+    a, _, _ = sites
+    link = JSONQueue(None, MiddlewareType.PRODUCER, address=a)
+    link._send({"method": "SUBSCRIBE", "topic": "/fedbytes", "bridge": True})
+    producer = PickleQueue("/fedbytes", MiddlewareType.PRODUCER, address=a)
+    time.sleep(0.1)
+
+    producer.push(b"\x00\xff") # JSON has no bytes: not forwarded, and the broker goes on
+    producer.push(1)
+    assert link.pull(timeout=5)[1] == 1
+    link.stats()
+    assert link.pull(timeout=5)["counters"]["encode_errors:JSON"] >= 1
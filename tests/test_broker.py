@@ -1,9 +1,11 @@
 """Test simple consumer/producer interaction."""
+import array
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from src.broker import Serializer
+from src.arrays import pack
+from src.broker import Broker, Serializer, value_size
 
 
 def test_subscriptions(broker):
@@ -38,3 +40,59 @@ def test_topics(broker):
     assert len(broker.list_topics()) >= 2  # t3, t4 and the topic from basic
     assert "/t3" in broker.list_topics()
     assert "/t4" in broker.list_topics()
+
+
+def test_read_paths_do_not_allocate(broker):
+    assert broker.get_topic("/nowhere/deep") is None
+    assert broker.list_subscriptions("/nowhere/deep") == []
+    broker.unsubscribe("/nowhere/deep", MagicMock())
+
+    assert broker.find_topic("/nowhere", create=False) is None
+
+
+def test_reclaim_empty_nodes(broker):
+    fake_subscriber = MagicMock()
+    broker.subscribe("/gc/a/b", fake_subscriber, Serializer.JSON)
+    broker.subscribe("/gc/c", fake_subscriber, Serializer.JSON)
+    broker.put_topic("/gc/c", 1)
+
+    broker.unsubscribe("/gc/a/b", fake_subscriber)
+    assert broker.find_topic("/gc/a", create=False) is None
+
+    removed = broker.metrics.counters.get("consumers_removed", 0)
+    broker.remove_consumer(fake_subscriber, broker.topics)
+    assert broker.metrics.counters["consumers_removed"] == removed + 1
+    assert broker.get_topic("/gc/c") == 1 # still holds a value
+    broker.put_topic("/gc/c", None)
+    assert broker.find_topic("/gc", create=False) is None
+
+
+def test_quotas():
+    broker = Broker(port=5402, max_topics=3, max_retained_bytes=1000)
+    try:
+        for i in range(5):
+            broker.put_topic(f"/quota/{i}", i)
+        assert broker.list_topics() == ["/quota/2", "/quota/3", "/quota/4"]
+        assert broker.find_topic("/quota/0", create=False) is None
+
+        broker.subscribe("/quota/2", MagicMock(), Serializer.JSON) # reading the value makes it recent
+        broker.put_topic("/quota/5", 5)
+        assert broker.list_topics() == ["/quota/2", "/quota/4", "/quota/5"]
+
+        broker.put_topic("/other/big", "x" * 990) # 990 bytes, numbers count 8
+        assert broker.list_topics() == ["/other/big", "/quota/5"]
+
+        gauges = broker.metrics.snapshot()["gauges"]
+        assert gauges["retained_topics:/quota"] == 1
+        assert gauges["retained_bytes:/other"] == broker.retained["/other/big"]
+        assert broker.metrics.snapshot()["counters"]["evictions:/quota"] == 5
+    finally:
+        broker.sock.close()
+
+
+def test_value_size():
+    with patch("pickle.dumps") as dumps: # sized without being encoded
+        assert value_size(b"x" * 1000000) == 1000000
+        assert value_size({"id": "abc", "readings": pack(array.array("d", [0.5] * 100))}) == 2 + 3 + 8 + 800
+        assert value_size(list(range(1000))) == 8000
+    dumps.assert_not_called()
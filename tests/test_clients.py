@@ -0,0 +1,28 @@
+"""Test the client helpers."""
+import itertools
+
+from src.clients import Schedule
+
+
+def test_constant_schedule():
+    times = list(itertools.islice(Schedule(100), 11))
+    gaps = [b - a for a, b in zip(times, times[1:])]
+
+    assert all(abs(gap - 0.01) < 1e-9 for gap in gaps)
+
+
+def test_burst_schedule():
+    schedule = Schedule(10, burst=(4, 1, 2)) # 40 msgs/s during the first second of every two
+
+    times = list(itertools.islice(schedule, 200))
+    start = times[0]
+    sent = sum(1 for t in times if t - start < 4)
+
+    assert abs(sent - schedule.expected(4)) <= 2
+    assert schedule.expected(4) == 100
+
+
+def test_poisson_schedule():
+    times = list(itertools.islice(Schedule(1000, "poisson"), 5001))
+
+    assert 4 < times[-1] - times[0] < 6
@@ -0,0 +1,30 @@
+"""Test fair reading of connections under per-connection read budgets."""
+import time
+
+from src.middleware import MiddlewareType, PickleQueue
+
+ADDRESS = "localhost:5411"
+
+
+def test_quiet_client_not_starved(start_broker):
+    broker = start_broker(5411, read_budget=8)
+    consumer = PickleQueue("/fair", MiddlewareType.CONSUMER, address=ADDRESS)
+    flooder = PickleQueue("/fair/flood", MiddlewareType.PRODUCER, address=ADDRESS)
+    quiet = PickleQueue("/fair/quiet", MiddlewareType.PRODUCER, address=ADDRESS)
+    time.sleep(0.1)
+
+    frames = [
+        b"".join(flooder._frame({"method": "PUBLICATE", "args": {"msg": i, "topic": "/fair/flood"}}))
+        for i in range(5000)
+    ]
+    flooder.sckt.sendall(b"".join(frames)) # thousands of frames in every read of the broker
+    quiet.push("hello")
+
+    received = []
+    while len(received) < 5001:
+        _, value = consumer.pull(timeout=5)
+        if value is not None: # the retained value, on subscribing
+            received.append(value)
+    assert received.index("hello") < 400 # not behind the ~800 frames of each read from the flooder
+    assert [value for value in received if value != "hello"] == list(range(5000))
+    assert broker.metrics.counters["read_budget_hits"] > 0
@@ -0,0 +1,74 @@
+"""Test broker metrics."""
+import random
+import string
+import urllib.request
+
+from src.metrics import Histogram, Metrics, serve_metrics
+from src.middleware import JSONQueue, PickleQueue
+from src.clients import Producer
+
+TOPIC = "/" + "".join(random.sample(string.ascii_lowercase, 6))
+
+
+def gen():
+    while True:
+        yield random.randint(0, 100)
+
+
+def test_histogram():
+    hist = Histogram([1, 10, 100])
+    for value in [0, 5, 5, 50, 500]:
+        hist.observe(value)
+
+    assert hist.counts == [1, 2, 1, 1]
+    assert hist.count == 5
+    assert hist.percentile(50) == 10
+    assert hist.percentile(100) == float("inf")
+    assert Histogram([1]).percentile(50) is None
+
+
+def test_render_text():
+    metrics = Metrics()
+    metrics.incr("frames_in", 3)
+    metrics.incr("publishes:/weather")
+    metrics.observe("fanout", 2, [1, 4])
+
+    text = metrics.render_text()
+    assert "broker_frames_in 3" in text
+    assert 'broker_publishes{key="/weather"} 1' in text
+    assert 'broker_fanout_bucket{le="4"} 1' in text
+
+
+def test_label_escaping():
+    metrics = Metrics()
+    metrics.incr('publishes:/a"b\\c\nd')
+    assert 'broker_publishes{key="/a\\"b\\\\c\\nd"} 1' in metrics.render_text()
+
+
+def test_serve_metrics():
+    metrics = Metrics()
+    metrics.incr("frames_in", 7)
+    server = serve_metrics(metrics, "localhost", 0)
+    try:
+        with urllib.request.urlopen(f"http://localhost:{server.server_address[1]}/metrics", timeout=5) as response:
+            assert response.status == 200
+            assert "broker_frames_in 7" in response.read().decode("utf-8").splitlines()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_stats(broker):
+    queue = PickleQueue(TOPIC)
+    producer = Producer(TOPIC, gen, JSONQueue)
+    producer.run(3)
+    for _ in range(3):
+        queue.pull()
+
+    queue.stats()
+    stats = queue.pull()
+
+    assert stats["counters"]["publishes:" + TOPIC] == 3
+    assert stats["counters"]["frames_in"] >= 4
+    assert stats["gauges"]["connections"] >= 2
+    assert stats["histograms"]["serialize_us:PICKLE"]["count"] >= 3
@@ -0,0 +1,83 @@
+"""Test the priority outbox."""
+import time
+
+from src.middleware import MiddlewareType, PickleQueue
+from src.outbox import HIGH, LOW, NORMAL, Outbox, level
+
+
+def drain(outbox):
+    frames = []
+    while outbox:
+        frames.append(outbox.head())
+        outbox.advance(len(frames[-1]))
+    return frames
+
+
+def test_priority_order():
+    outbox = Outbox()
+    outbox.current = b"partial" # being written: always finished first
+    for i in range(3):
+        outbox.append(b"low%d" % i, LOW)
+        outbox.append(b"normal%d" % i, NORMAL)
+    outbox.append(b"alarm", HIGH)
+
+    assert len(outbox) == 8
+    assert drain(outbox) == [
+        b"partial", b"alarm", b"normal0", b"normal1", b"normal2", b"low0", b"low1", b"low2",
+    ]
+
+
+def test_partial_writes():
+    outbox = Outbox()
+    outbox.append(b"abcdef", LOW)
+    outbox.append(b"xyz", HIGH)
+    assert outbox.head() == b"xyz"
+    outbox.advance(1)
+    outbox.append(b"!", HIGH)
+    assert outbox.head() == b"yz" # not overtaken in the middle of a frame
+    outbox.advance(2)
+    assert drain(outbox) == [b"!", b"abcdef"]
+
+
+def test_starvation_limit():
+    outbox = Outbox(starvation_limit=3)
+    for i in range(8):
+        outbox.append(b"h%d" % i, HIGH)
+    outbox.append(b"l0", LOW)
+    outbox.append(b"l1", LOW)
+    assert drain(outbox) == [b"h0", b"h1", b"h2", b"l0", b"h3", b"h4", b"h5", b"l1", b"h6", b"h7"]
+    assert outbox.promoted == 2
+
+    strict = Outbox(starvation_limit=None)
+    for i in range(100):
+        strict.append(b"h", HIGH)
+    strict.append(b"l", LOW)
+    assert drain(strict)[-1] == b"l"
+
+
+def test_level():
+    assert [level(p) for p in ("high", "normal", "low", 0, "2", 7, "urgent", None)] == [0, 1, 2, 0, 2, None, None, None]
+
+
+def test_alarm_overtakes_backlog(start_broker):
+    start_broker(5410, priorities={"/prio/bulk": "low", "/prio/alarm": "high"})
+    address = "localhost:5410"
+    consumer = PickleQueue("/prio", MiddlewareType.CONSUMER, address=address)
+    producer = PickleQueue("/prio", MiddlewareType.PRODUCER, address=address)
+    time.sleep(0.1)
+
+    payload = "x" * 4000
+    for i in range(4000): # ~16 MB, more than the socket buffers hold: the rest waits in the outbox
+        producer.push([i, payload], "/prio/bulk")
+    time.sleep(0.5)
+    producer.push("fire", "/prio/alarm")
+    producer.push([-1, "urgent"], "/prio/bulk", priority="high")
+    time.sleep(0.2)
+
+    received = []
+    while len(received) < 4002:
+        received.append(consumer.pull(timeout=5)[1])
+    alarm = received.index("fire")
+    assert alarm < 3000 # the backlog queued in the broker did not go first
+    assert received[alarm + 1] == [-1, "urgent"]
+    assert [value[0] for value in received if value != "fire"][-1] == 3999
@@ -0,0 +1,67 @@
+"""Test the broker's runtime profiler."""
+import os
+import pstats
+import random
+import string
+import time
+
+import pytest
+
+from src.clients import Producer
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+from src.profiler import Profiler
+
+TOPIC = "/" + "".join(random.sample(string.ascii_lowercase, 6))
+
+
+def gen():
+    while True:
+        yield random.randint(0, 100)
+
+
+def test_profile_broker(broker, tmp_path, monkeypatch):
+    monkeypatch.setattr(broker.profiler, "directory", str(tmp_path))
+    path = str(tmp_path / "broker.pstats")
+    admin = PickleQueue(None, _type=MiddlewareType.PRODUCER)
+    consumer = JSONQueue(TOPIC, MiddlewareType.CONSUMER)
+
+    admin.profile("start", seconds=30, path=path)
+    assert admin.pull()["path"] == path
+    assert broker.profiler.active
+
+    Producer(TOPIC, gen, JSONQueue).run(5)
+    time.sleep(0.1)
+
+    admin.profile("stop")
+    reply = admin.pull()
+    assert not broker.profiler.active
+    assert reply["summary"]["publicate"]["calls"] == 5
+    assert reply["summary"]["handle"]["calls"] >= 5
+    for name in ("read", "process", "serialize_send", "serialize_frame"):
+        assert name in reply["summary"]
+    assert consumer.pull(timeout=1)[1] is not None
+    assert pstats.Stats(path).total_calls > 0
+
+
+def test_dumps_stay_in_directory(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    assert profiler.start(path="../../etc/cron.d/evil") == str(tmp_path / "evil")
+    profiler.stop()
+    assert os.listdir(tmp_path) == ["evil"]
+    with pytest.raises(ValueError):
+        profiler.start(path="/tmp/..")
+
+
+def test_sampling_window(tmp_path):
+    path = str(tmp_path / "loop.collapsed")
+    profiler = Profiler(str(tmp_path))
+
+    profiler.start("sampling", seconds=0.05, path="loop.collapsed")
+    while profiler.active:
+        time.sleep(0.01)
+        profiler.tick()
+
+    with open(path) as fp:
+        lines = fp.read().splitlines()
+    assert lines
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
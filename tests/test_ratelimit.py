@@ -0,0 +1,69 @@
+"""Test rate limiting with token buckets."""
+import time
+
+import pytest
+
+from src.middleware import MiddlewareType, PickleQueue
+from src.ratelimit import RateLimit, TokenBucket
+
+ADDRESS = "localhost:5412"
+
+
+def test_token_bucket():
+    bucket = TokenBucket(10, burst=5)
+    now = bucket.last
+    assert [bucket.take(1, now) for _ in range(5)] == [0] * 5
+    assert bucket.take(2, now) == pytest.approx(0.2) # in debt, never refused
+    assert bucket.take(1, now + 0.3) == 0
+    assert bucket.take(0, now + 100) == 0 and bucket.tokens == 5 # no more than burst saved up
+
+    limit = RateLimit(bytes=1000)
+    assert limit.take(1000, 1000, bucket.last) == 0
+    assert limit.take(1000, 500, bucket.last) == pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+@pytest.fixture(scope="module")
+def limited_broker(start_broker):
+    return start_broker(5412, rate_limit=(200, None), topic_rate_limits={"/limited/slow": (None, 20000)})
+
+
+def receive(consumer, count):
+    received = []
+    while len(received) < count:
+        _, value = consumer.pull(timeout=5)
+        if value is not None: # the retained value, on subscribing
+            received.append(value)
+    return received
+
+
+def test_connection_paused_not_dropped(limited_broker):
+    consumer = PickleQueue("/fast", MiddlewareType.CONSUMER, address=ADDRESS)
+    producer = PickleQueue("/fast", MiddlewareType.PRODUCER, address=ADDRESS)
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    for i in range(300):
+        producer.push(i)
+    assert receive(consumer, 300) == list(range(300))
+    assert time.monotonic() - start > 0.4 # 200 right away, the other 100 at 200/s
+    assert limited_broker.metrics.counters["throttled"] > 0
+
+
+def test_topic_limit(limited_broker):
+    consumer = PickleQueue("/limited", MiddlewareType.CONSUMER, address=ADDRESS)
+    slow = PickleQueue("/limited/slow", MiddlewareType.PRODUCER, address=ADDRESS)
+    other = PickleQueue("/limited/other", MiddlewareType.PRODUCER, address=ADDRESS)
+    time.sleep(0.1)
+
+    payload = "x" * 1000
+    for i in range(40): # ~40 KB, twice what /limited/slow may take per second
+        slow.push([i, payload], "/limited/slow/data")
+    time.sleep(0.1)
+    other.push("unaffected", "/limited/other")
+
+    received = receive(consumer, 41)
+    assert received.index("unaffected") < 40 # the other producer is not held back
+    assert [value[0] for value in received if value != "unaffected"] == list(range(40))
+    assert limited_broker.metrics.counters["throttled:/limited/slow"] > 0
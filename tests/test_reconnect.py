@@ -0,0 +1,83 @@
+"""Test reconnecting to a broker that went away."""
+import socket
+import time
+
+from src.middleware import Backoff, JSONQueue, MiddlewareType, PickleQueue
+from tests import bench
+
+ADDRESS = "localhost:5407"
+
+
+def test_backoff():
+    backoff = Backoff(base=0.1, cap=1)
+    delays = [backoff.delay(attempt) for attempt in range(10) for _ in range(50)]
+    assert all(0 <= delay <= 1 for delay in delays)
+    assert max(delays[:50]) <= 0.1
+    assert len(set(delays)) == len(delays) # jittered
+
+
+def test_broker_restart():
+    broker = bench.start_broker(5407)
+    backoff = Backoff(base=0.05, cap=0.2)
+    consumer = JSONQueue("/reconnect", MiddlewareType.CONSUMER, address=ADDRESS, reconnect=backoff)
+    producer = PickleQueue("/reconnect", MiddlewareType.PRODUCER, address=ADDRESS, reconnect=backoff, max_pending=3)
+    try:
+        producer.push(1)
+        assert consumer.pull(timeout=5) == ("/reconnect", 1)
+
+        broker.terminate()
+        broker.wait()
+        while producer.sckt is not None: # the first writes may still go into the void
+            producer.push(0)
+            time.sleep(0.05)
+        for value in (10, 11, 12, 13):
+            producer.push(value)
+        assert len(producer.pending) == 3 # bounded, oldest dropped
+
+        broker = bench.start_broker(5407)
+        assert consumer.pull(timeout=1) is None # reconnected and subscribed again, nothing retained
+        assert consumer.reconnects == 1
+        time.sleep(0.3) # past the producer's next attempt
+        producer.push(14)
+        assert not producer.pending
+        assert [consumer.pull(timeout=5)[1] for _ in range(4)] == [11, 12, 13, 14]
+    finally:
+        broker.terminate()
+        broker.wait()
+
+
+def drop(broker, queue):
+    """Shut the broker's end of the connection of queue down."""
+    for key in list(broker.sel.get_map().values()):
+        if key.data == broker.read and key.fileobj.getpeername() == queue.sckt.getsockname():
+            key.fileobj.shutdown(socket.SHUT_RDWR)
+
+
+def test_resume_skips_retained(start_broker):
+    broker = start_broker(5408)
+    address = "localhost:5408"
+    consumer = JSONQueue("/resume", MiddlewareType.CONSUMER, address=address, reconnect=Backoff(base=0.01))
+    producer = JSONQueue("/resume", MiddlewareType.PRODUCER, address=address)
+    producer.push(7)
+    assert consumer.pull(timeout=5) == ("/resume", 7)
+
+    drop(broker, consumer)
+    assert consumer.pull(timeout=0.5) is None # 7 again, retained, already received
+    assert consumer.reconnects == 1
+    producer.push(8)
+    assert consumer.pull(timeout=5) == ("/resume", 8)
+
+
+def test_resume_keeps_equal_publish(start_broker):
+    broker = start_broker(5413)
+    address = "localhost:5413"
+    consumer = JSONQueue("/parent", MiddlewareType.CONSUMER, address=address, reconnect=Backoff(base=0.01))
+    producer = JSONQueue("/parent/switch", MiddlewareType.PRODUCER, address=address)
+    producer.push("ON")
+    assert consumer.pull(timeout=5) == ("/parent", "ON")
+
+    drop(broker, consumer)
+    assert consumer.pull(timeout=0.5) is None # /parent retains nothing of its own
+    assert consumer.reconnects == 1
+    producer.push("ON") # a new publish, equal to the last one received
+    assert consumer.pull(timeout=5) == ("/parent", "ON")
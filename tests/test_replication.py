@@ -0,0 +1,60 @@
+"""Test primary/standby replication."""
+import socket
+import time
+
+from src.clients import Producer
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_standby(start_broker):
+    primary = start_broker(5301)
+    primary.put_topic("/repl/a", 1)
+    primary.put_topic("/repl/b", "two")
+
+    standby = start_broker(5302, standby_of="localhost:5301")
+    assert wait_for(lambda: standby.get_topic("/repl/b") == "two") # initial sync
+    assert standby.get_topic("/repl/a") == 1
+
+    producer = Producer("/repl/c", lambda: iter([99]), JSONQueue, address="localhost:5301")
+    producer.run(1)
+    assert wait_for(lambda: standby.get_topic("/repl/c") == 99)
+    assert standby.metrics.histograms["replication_lag_us"].count >= 2
+    assert primary.metrics.gauges["replicas"] == 1
+
+    # primary goes away: the standby takes over with the values it holds
+    conn, _ = primary.replication.replicas[0]
+    conn.shutdown(socket.SHUT_RDWR)
+    assert wait_for(lambda: standby.standby.promoted)
+    assert standby.list_topics() == ["/repl/a", "/repl/b", "/repl/c"]
+
+
+def test_large_values(start_broker):
+    primary = start_broker(5303)
+    standby = start_broker(5304, standby_of="localhost:5303")
+    assert wait_for(lambda: primary.replication.replicas)
+
+    producer = PickleQueue("/repl/blob", MiddlewareType.PRODUCER, address="localhost:5303")
+    blob = bytes(range(256)) * 400 # 100 KB, too big for a plain frame
+    producer.push(blob)
+    assert wait_for(lambda: standby.get_topic("/repl/blob") == blob)
+    producer.push(1, "/repl/after") # the stream goes on after a segmented frame
+    assert wait_for(lambda: standby.get_topic("/repl/after") == 1)
+
+
+def test_evictions(start_broker):
+    primary = start_broker(5305, max_topics=2)
+    standby = start_broker(5306, standby_of="localhost:5305")
+    assert wait_for(lambda: primary.replication.replicas)
+
+    producer = PickleQueue("/evict", MiddlewareType.PRODUCER, address="localhost:5305")
+    for i in range(3):
+        producer.push(i, f"/evict/{i}")
+    assert wait_for(lambda: standby.get_topic("/evict/2") == 2)
+    assert standby.list_topics() == ["/evict/1", "/evict/2"] # dropped on the standby too
@@ -0,0 +1,140 @@
+"""Test REQUEST/REPLY calls."""
+import array
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.clients import Responder
+from src.middleware import AsyncPickleQueue, JSONQueue, MiddlewareType, PickleQueue, RPCError, XMLQueue
+
+ADDRESS = "localhost:5409"
+
+
+@pytest.fixture(scope="module")
+def rpc_broker(start_broker):
+    return start_broker(5409)
+
+
+def serve(topic, handler, queue_type=PickleQueue):
+    responder = Responder(topic, handler, queue_type, address=ADDRESS)
+    threading.Thread(target=responder.run, daemon=True).start()
+    return responder
+
+
+def divide(topic, payload):
+    return payload["a"] / payload["b"]
+
+
+@pytest.mark.parametrize("queue_type", [JSONQueue, XMLQueue, PickleQueue])
+def test_call(rpc_broker, queue_type):
+    serve("/rpc/divide/" + queue_type.__name__, divide, queue_type)
+    time.sleep(0.1)
+    client = queue_type("/rpc", MiddlewareType.PRODUCER, address=ADDRESS)
+
+    assert client.call("/rpc/divide/" + queue_type.__name__, {"a": 3, "b": 2}, timeout=5) == 1.5
+    with pytest.raises(RPCError, match="ZeroDivisionError"):
+        client.call("/rpc/divide/" + queue_type.__name__, {"a": 3, "b": 0}, timeout=5)
+    with pytest.raises(RPCError, match="no responder"):
+        client.call("/nowhere", None, timeout=5)
+
+
+def test_concurrent_calls(rpc_broker):
+    """Replies find their caller whatever the order they come back in."""
+    serve("/rpc/sleep", lambda topic, n: time.sleep(0.001 * (n % 5)) or n)
+    serve("/rpc/sleep", lambda topic, n: n) # round-robin between the two
+    time.sleep(0.1)
+    client = PickleQueue("/rpc", MiddlewareType.PRODUCER, address=ADDRESS)
+    results = {}
+
+    def worker(k):
+        results[k] = [client.call("/rpc/sleep", 100 * k + i, timeout=5) for i in range(20)]
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {k: [100 * k + i for i in range(20)] for k in range(8)}
+    assert not client.calls
+    assert rpc_broker.metrics.histograms["rpc_us"].count >= 160
+
+
+def test_subtopics_and_arrays(rpc_broker):
+    serve("/rpc/sum", lambda topic, values: [topic, sum(values)])
+    time.sleep(0.1)
+    client = JSONQueue("/rpc", MiddlewareType.PRODUCER, address=ADDRESS)
+    assert client.call("/rpc/sum/floats", array.array("d", [0.5] * 2000), timeout=5) == ["/rpc/sum/floats", 1000.0]
+
+
+def test_timeout_and_responder_gone(rpc_broker):
+    stuck = PickleQueue("/rpc/stuck", MiddlewareType.PRODUCER, address=ADDRESS)
+    stuck.serve("/rpc/stuck")
+    time.sleep(0.1)
+    client = PickleQueue("/rpc", MiddlewareType.PRODUCER, address=ADDRESS)
+
+    with pytest.raises(TimeoutError):
+        client.call("/rpc/stuck", 1, timeout=0.2)
+    assert stuck.pull(timeout=5) == ("/rpc/stuck", 1)
+    stuck.reply("late") # nobody waits for it anymore
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pytest.raises(RPCError, client.call, "/rpc/stuck", 2, 5)))
+    thread.start()
+    assert stuck.pull(timeout=5) == ("/rpc/stuck", 2)
+    stuck.sckt.close()
+    thread.join()
+    assert "went away" in str(result[0].value)
+    assert not rpc_broker.calls
+
+
+def test_calls_and_pulls(rpc_broker):
+    """Messages read by a call() wait for pull()."""
+    serve("/rpc/echo", lambda topic, payload: payload)
+    client = PickleQueue("/rpc/news", MiddlewareType.CONSUMER, address=ADDRESS)
+    producer = PickleQueue("/rpc/news", MiddlewareType.PRODUCER, address=ADDRESS)
+    time.sleep(0.1)
+    producer.push("first")
+    time.sleep(0.1)
+
+    assert client.call("/rpc/echo", 1, timeout=5) == 1
+    assert client.pull(timeout=5) == ("/rpc/news", "first")
+
+
+def test_unencodable_payloads(rpc_broker):
+    serve("/rpc/json", lambda topic, payload: payload, JSONQueue)
+    serve("/rpc/bytes", lambda topic, payload: b"raw")
+    time.sleep(0.1)
+
+    with pytest.raises(RPCError, match="cannot encode the request"): # JSON cannot carry bytes
+        PickleQueue("/rpc", MiddlewareType.PRODUCER, address=ADDRESS).call("/rpc/json", b"abc", timeout=5)
+    with pytest.raises(RPCError, match="cannot encode the reply"):
+        JSONQueue("/rpc", MiddlewareType.PRODUCER, address=ADDRESS).call("/rpc/bytes", 1, timeout=5)
+    assert rpc_broker.metrics.counters["encode_errors:JSON"] >= 2
+
+
+def test_async_calls(rpc_broker):
+    serve("/rpc/async", lambda topic, n: time.sleep(0.001 * (n % 3)) or n)
+    stuck = PickleQueue("/rpc/async/stuck", MiddlewareType.PRODUCER, address=ADDRESS)
+    stuck.serve("/rpc/async/stuck") # never replies
+    producer = PickleQueue("/rpc/async/news", MiddlewareType.PRODUCER, address=ADDRESS)
+
+    async def main():
+        client = await AsyncPickleQueue.create("/rpc/async/news", MiddlewareType.CONSUMER, address=ADDRESS)
+        await asyncio.sleep(0.1)
+        producer.push("first")
+        results = await asyncio.gather(*(client.call("/rpc/async", i, timeout=5) for i in range(50)))
+        assert results == list(range(50))
+        assert await client.pull() == ("/rpc/async/news", "first") # read by a call(), kept for pull()
+
+        pulled = asyncio.ensure_future(client.pull()) # a pull() reading the socket hands replies over
+        assert await client.call("/rpc/async", 7, timeout=5) == 7
+        producer.push("second")
+        assert await pulled == ("/rpc/async/news", "second")
+        with pytest.raises(TimeoutError):
+            await client.call("/rpc/async/stuck", 1, timeout=0.2)
+        assert not client.futures
+        await client.close()
+
+    asyncio.run(main())
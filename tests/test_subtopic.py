@@ -69,3 +69,22 @@ def test_multiple_producers_to_consumer(consumer_JSON, consumer_Pickle, broker):
     assert root in broker.list_topics()
 
     assert producer3.produced[0] not in consumer_Pickle.received
+
+
+def test_subscribe_snapshot(broker):
+    base = "/" + "".join(random.sample(string.ascii_lowercase, 6))
+    values = {base + "/temperature": 21, base + "/temperature/fahrenheit": 70, base + "/humidity": 63}
+    for topic, value in values.items():
+        Producer(topic, lambda value=value: iter([value]), JSONQueue).run(1)
+    time.sleep(0.1)
+
+    consumer = Consumer(base, PickleQueue, snapshot=True)
+    consumer.run(1)
+    assert consumer.received == [values]
+
+    # served again from the cached encodings, with the live update after it
+    consumer2 = Consumer(base, JSONQueue, snapshot=True)
+    Producer(base + "/humidity", gen, PickleQueue).run(1)
+    consumer2.run(2)
+    assert consumer2.received[0] == values
+    assert len(consumer2.received) == 2
@@ -0,0 +1,50 @@
+"""Test the topic index behind REQ_TOPICS."""
+from src.middleware import MiddlewareType, PickleQueue
+from src.topics import TopicIndex
+
+
+def test_page():
+    index = TopicIndex()
+    for topic in ["/b/2", "/a", "/b/1", "/b/3", "/c", "/b/1"]:
+        index.add(topic)
+
+    assert list(index) == ["/a", "/b/1", "/b/2", "/b/3", "/c"]
+
+    assert index.page("/b/", limit=2) == (["/b/1", "/b/2"], "/b/2")
+    assert index.page("/b/", cursor="/b/2", limit=2) == (["/b/3"], None)
+    assert index.page("/b/", limit=3) == (["/b/1", "/b/2", "/b/3"], None)
+    assert index.page("/z") == ([], None)
+
+    index.discard("/b/2")
+    assert "/b/2" not in index
+    assert index.page("/b/") == (["/b/1", "/b/3"], None)
+
+
+def test_req_topics(broker):
+    for i in range(25):
+        broker.put_topic(f"/paged/{i:02}", i)
+
+    queue = PickleQueue(None, _type=MiddlewareType.PRODUCER)
+    pages = []
+    cursor = None
+    while True:
+        queue.list_topics(None, prefix="/paged/", cursor=cursor, limit=10)
+        pages.append(queue.pull())
+        cursor = queue.topics_cursor
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == [f"/paged/{i:02}" for i in range(25)]
+
+
+def test_req_topics_fits_frame(broker):
+    for i in range(200):
+        broker.put_topic(f"/long/{i:03}/" + "x" * 500, i)
+
+    queue = PickleQueue(None, _type=MiddlewareType.PRODUCER)
+    queue.list_topics(None, prefix="/long/")
+    page = queue.pull()
+
+    assert 0 < len(page) < 200
+    assert queue.topics_cursor == page[-1]
@@ -0,0 +1,64 @@
+"""Test publish-to-deliver latency tracing."""
+import random
+import string
+import threading
+import time
+
+from src.clients import Consumer, Producer
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+
+TOPIC = "/" + "".join(random.sample(string.ascii_lowercase, 6))
+LEAF = TOPIC + "/leaf"
+
+
+def gen():
+    while True:
+        yield random.randint(0, 100)
+
+
+def test_latency(broker):
+    consumer = Consumer(TOPIC, PickleQueue, trace=True)
+    thread = threading.Thread(target=consumer.run, args=(5,), daemon=True)
+    thread.start()
+
+    Producer(LEAF, gen, JSONQueue, trace=True).run(5)
+    thread.join(timeout=2)
+
+    latency = consumer.latency()
+    assert list(latency) == [LEAF]
+    assert latency[LEAF]["total"]["count"] == 5
+    assert latency[LEAF]["total"]["p50"] <= latency[LEAF]["total"]["p999"]
+    assert set(latency[LEAF]) == {"producer", "broker", "network", "total"}
+
+
+def test_untraced(broker):
+    consumer = Consumer(TOPIC + "/untraced", PickleQueue, trace=True)
+    thread = threading.Thread(target=consumer.run, args=(2,), daemon=True)
+    thread.start()
+
+    Producer(TOPIC + "/untraced", gen, PickleQueue).run(2)
+    thread.join(timeout=2)
+
+    assert len(consumer.received) == 2
+    assert consumer.latency() == {}
+
+
+def test_queued_time_is_broker_time(start_broker):
+    broker = start_broker(5414)
+    address = "localhost:5414"
+    consumer = PickleQueue("/queued", MiddlewareType.CONSUMER, address=address, trace=True)
+    producer = PickleQueue("/queued", MiddlewareType.PRODUCER, address=address)
+    traced = PickleQueue("/queued", MiddlewareType.PRODUCER, address=address, trace=True)
+    time.sleep(0.1)
+
+    for i in range(2000): # ~8 MB the consumer does not read yet: the rest waits in the broker's outbox
+        producer.push([i, "x" * 4000])
+    while not broker.outbox:
+        time.sleep(0.01)
+    traced.push("late")
+    time.sleep(0.3)
+
+    while consumer.pull(timeout=5)[1] != "late":
+        pass
+    broker_us = consumer.latency("/queued")["/queued"]["broker"]["p50"]
+    assert broker_us >= 200000 # stamped "out" once written, not when queued
@@ -0,0 +1,125 @@
+"""Test the Unix domain socket transport."""
+import random
+import socket
+import time
+
+import pytest
+
+from src.clients import Consumer, Producer
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue
+from src import shm
+from src.shm import Ring
+
+
+def gen():
+    while True:
+        yield random.randint(0, 100)
+
+
+def test_unix_socket(start_broker, tmp_path):
+    path = str(tmp_path / "broker.sock")
+    start_broker(5401, unix_path=path)
+
+    consumer = Consumer("/uds", PickleQueue, address="unix://" + path)
+    tcp_consumer = Consumer("/uds", JSONQueue, address="localhost:5401")
+    producer = Producer("/uds", gen, JSONQueue, address="unix://" + path)
+    producer.run(5)
+    consumer.run(5)
+    tcp_consumer.run(5)
+
+    assert consumer.received == producer.produced
+    assert tcp_consumer.received == producer.produced
+
+
+def test_partial_frames(broker):
+    """Frames split across several reads are reassembled by the broker."""
+    consumer = Consumer("/partial", PickleQueue)
+    producer = PickleQueue("/partial", _type=MiddlewareType.PRODUCER)
+    frame = bytes([2]) + producer.converter.serialize(
+        {"method": "PUBLICATE", "args": {"msg": "x" * 1000, "topic": "/partial"}}
+    )
+    for i in range(0, len(frame), 100):
+        producer.sckt.send(frame[i:i + 100])
+        time.sleep(0.01)
+    consumer.run(1)
+
+    assert consumer.received == ["x" * 1000]
+
+
+def test_ring_wraps_around():
+    ring = Ring(size=64, create=True)
+    reader = Ring(ring.name, 64)
+    try:
+        for i in range(20):
+            data = bytes([i]) * 40
+            assert ring.write(data) == (40, True)
+            assert ring.write(data) == (24, False) # only what fits
+            assert reader.read() == data + data[:24]
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_ring_size_checked():
+    ring = Ring(size=64, create=True)
+    doorbell, other = socket.socketpair()
+    try:
+        with pytest.raises(ValueError):
+            shm.accept(doorbell, {"c2b": ring.name, "b2c": ring.name, "size": 1 << 20}) # past the segment
+    finally:
+        ring.close()
+        doorbell.close()
+        other.close()
+
+
+def test_close_unlinks_rings(broker):
+    consumer = PickleQueue("/shm/close", MiddlewareType.CONSUMER, address="shm+localhost:5000")
+    names = [consumer.sckt.rx.name, consumer.sckt.tx.name]
+    consumer.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            Ring(name)
+    with pytest.raises(ConnectionError):
+        consumer.pull(timeout=0.1)
+
+
+def test_shared_memory(broker):
+    consumer = Consumer("/shm", PickleQueue, address="shm+localhost:5000")
+    tcp_consumer = Consumer("/shm", JSONQueue)
+    producer = Producer("/shm", gen, JSONQueue, address="shm+localhost:5000")
+    producer.run(50)
+    consumer.run(50)
+    tcp_consumer.run(50)
+
+    assert consumer.received == producer.produced
+    assert tcp_consumer.received == producer.produced
+    consumer.queue.close()
+    producer.queue[0].close()
+
+
+def test_shared_memory_timeouts(broker):
+    consumer = PickleQueue("/shm/timeout", MiddlewareType.CONSUMER, address="shm+localhost:5000")
+    producer = PickleQueue("/shm/timeout", MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+    producer.push(1)
+    assert consumer.pull(timeout=5) == ("/shm/timeout", 1)
+    start = time.monotonic()
+    assert consumer.pull(timeout=0.5) is None # the doorbell of the frame already read does not count
+    assert time.monotonic() - start < 1.5
+    consumer.close()
+
+
+def test_lagging_shared_memory_consumer(broker):
+    consumer = PickleQueue("/shm/lag", MiddlewareType.CONSUMER, address="shm+localhost:5000")
+    producer = PickleQueue("/shm/lag", MiddlewareType.PRODUCER)
+    time.sleep(0.1)
+    payload = "x" * 4000
+    for i in range(600): # ~2.4 MB, more than the ring holds
+        producer.push([i, payload])
+    time.sleep(0.2)
+    loops = broker.metrics.histograms["loop_us"].count
+    time.sleep(0.5)
+    assert broker.metrics.histograms["loop_us"].count - loops < 2000 # retried on a timer, not spinning
+
+    assert [consumer.pull(timeout=5)[1][0] for _ in range(600)] == list(range(600))
+    consumer.close()
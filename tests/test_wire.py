@@ -1,12 +1,13 @@
 """Test consumer/producer interaction on the wire"""
 import random
+import time
 import string
 from unittest.mock import MagicMock, patch
 
 import pytest
 
 from src.clients import Producer
-from src.middleware import JSONQueue, XMLQueue
+from src.middleware import JSONQueue, MiddlewareType, PickleQueue, XMLQueue
 
 TOPIC = "".join(random.sample(string.ascii_lowercase, 6))
 
@@ -46,3 +47,51 @@ def test_simple_producer_XML(broker):
         assert b">" in data_sent
         assert data_sent.count(b"<") == data_sent.count(b">")
         assert TOPIC.encode("utf8") in data_sent
+
+
+def test_out_of_band_buffers(broker):
+    blob = bytes(range(256)) * 1000 # too big for a plain frame
+    consumer = PickleQueue("/oob", MiddlewareType.CONSUMER)
+    producer = PickleQueue("/oob", MiddlewareType.PRODUCER)
+
+    frame = producer.converter.serialize_frame({"method": "PUBLICATE", "args": {"msg": blob, "topic": "/oob"}})
+    assert frame[-1].obj is blob # handed over, not copied into the pickle
+    assert all(blob not in bytes(buffer) for buffer in frame[:-1])
+
+    producer.push({"image": blob, "small": b"x"})
+    assert consumer.pull() == ("/oob", {"image": blob, "small": b"x"})
+
+
+def test_unencodable_retained_value(broker):
+    producer = PickleQueue("/oob/binary", MiddlewareType.PRODUCER)
+    producer.push(b"abc")
+    time.sleep(0.1)
+    consumer = JSONQueue("/oob/binary", MiddlewareType.CONSUMER)
+    assert consumer.pull(timeout=0.2) is None # JSON cannot carry bytes: not sent
+    assert broker.metrics.counters["encode_errors:JSON"] >= 1
+
+    producer.push(b"still serving")
+    assert PickleQueue("/oob/binary", MiddlewareType.CONSUMER).pull(timeout=5)[1] == b"still serving"
+
+
+def test_prefetch(broker):
+    consumer = PickleQueue("/prefetch", MiddlewareType.CONSUMER, prefetch=16)
+    producer = PickleQueue("/prefetch", MiddlewareType.PRODUCER)
+    assert consumer.pull(timeout=0.5) is None # nothing published yet
+
+    for i in range(100):
+        producer.push(i)
+    producer.push({"blob": bytes(range(256)) * 20}) # segmented frame
+    time.sleep(0.5)
+    assert len(consumer.prefetched.frames) <= 16 # the rest waits in the socket
+
+    assert [consumer.pull(timeout=5)[1] for _ in range(100)] == list(range(100))
+    assert consumer.pull(timeout=5)[1] == {"blob": bytes(range(256)) * 20}
+    assert consumer.pull(timeout=0.1) is None
+
+
+def test_pull_timeout(broker):
+    consumer = JSONQueue("/timeout", MiddlewareType.CONSUMER)
+    start = time.monotonic()
+    assert consumer.pull(timeout=0.2) is None
+    assert time.monotonic() - start >= 0.2